@@ -228,6 +228,12 @@ STATICFILES_FINDERS = [
 # https://docs.djangoproject.com/en/dev/ref/settings/#media-root
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# https://docs.djangoproject.com/en/dev/ref/settings/#storages
+STORAGES = {
+    # Файлы по хэшу содержимого с подсчетом ссылок (namito.catalog.storage)
+    "default": {"BACKEND": "namito.catalog.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
 
 
 # TEMPLATES
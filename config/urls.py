@@ -10,6 +10,8 @@ from django.views.generic import TemplateView
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 
+from namito.catalog.storage import serve_media
+
 
 urlpatterns = [
 
@@ -21,7 +23,8 @@ urlpatterns = [
     path('api/', include("namito.catalog.urls")),
     path('api/', include("namito.advertisement.urls")),
 
-    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT),
+    # Только при DEBUG: в production media отдает nginx (compose/production/nginx)
+    *static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT, view=serve_media),
 ]
 schema_view = get_schema_view(
     openapi.Info(
@@ -50,7 +53,7 @@ urlpatterns += [
     # path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT, view=serve_media)
 
 handler404 = 'pages.api.views.handle_not_found'
 
@@ -35,6 +35,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.production")
 # file. This includes Django's development server, if the WSGI_APPLICATION
 # setting points here.
 application = get_wsgi_application()
+
+# Индексы нечеткого поиска, подсказок и атрибутов каталога строятся в фоне при старте воркера
+from namito.catalog.bitmap import catalog_index  # noqa: E402
+from namito.catalog.fuzzy import fuzzy_index  # noqa: E402
+from namito.catalog.suggest import suggest_index  # noqa: E402
+
+catalog_index.warm_up()
+fuzzy_index.warm_up()
+suggest_index.warm_up()
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
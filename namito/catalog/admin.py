@@ -6,6 +6,7 @@ from django.utils.safestring import mark_safe
 
 from mptt.admin import DraggableMPTTAdmin
 
+from .pricing import reprice
 from .forms import (
     CategoryAdminForm,
     ColorAdminForm,
@@ -26,7 +27,10 @@ from .models import (
     SizeChartItem,
     Tag,
     Characteristic,
-    ReviewImage
+    ReviewImage,
+    SearchQueryStat,
+    ProductViewDaily,
+    DiscountCampaign
 )
 
 
@@ -47,6 +51,7 @@ class CategoryAdmin(DraggableMPTTAdmin):
     search_fields = ["id", 'name']
     list_select_related = ["parent"]
     mptt_level_indent = 20
+    actions = ['reprice_products']
 
     @admin.display(description="Name")
     def indented_name(self, instance):
@@ -57,6 +62,12 @@ class CategoryAdmin(DraggableMPTTAdmin):
             )
         )
 
+    def reprice_products(self, request, queryset):
+        variants, products = reprice(categories=queryset)
+        self.message_user(request, f"Пересчитано цен вариантов: {variants}, продуктов: {products}")
+
+    reprice_products.short_description = "Пересчитать цены со скидкой (с подкатегориями)"
+
 
 class ImageInline(nested_admin.NestedTabularInline):
     model = Image
@@ -145,6 +156,7 @@ class BrandAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     readonly_fields = ('logo_preview',)
     form = BrandForm
+    actions = ['reprice_products']
 
     def logo_preview(self, obj):
         if obj.logo:
@@ -153,6 +165,12 @@ class BrandAdmin(admin.ModelAdmin):
 
     logo_preview.short_description = 'Logo Preview'
 
+    def reprice_products(self, request, queryset):
+        variants, products = reprice(brands=queryset)
+        self.message_user(request, f"Пересчитано цен вариантов: {variants}, продуктов: {products}")
+
+    reprice_products.short_description = "Пересчитать цены со скидкой"
+
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -181,6 +199,16 @@ class VariantAdmin(admin.ModelAdmin):
     search_fields = ['product__name', 'color__name', 'size__name']
 
 
+@admin.register(DiscountCampaign)
+class DiscountCampaignAdmin(admin.ModelAdmin):
+    list_display = ['name', 'discount_type', 'discount_value', 'starts_at', 'ends_at', 'status']
+    list_filter = ['status']
+    search_fields = ['name']
+    readonly_fields = ['status']
+    filter_horizontal = ['categories', 'brands', 'tags']
+    autocomplete_fields = ['products']
+
+
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
     list_display = ['image_preview', 'color', 'main_image']
@@ -193,6 +221,21 @@ class ImageAdmin(admin.ModelAdmin):
     image_preview.short_description = 'Preview'
 
 
+@admin.register(SearchQueryStat)
+class SearchQueryStatAdmin(admin.ModelAdmin):
+    list_display = ['query', 'count', 'updated_at']
+    search_fields = ['query']
+    ordering = ['-count']
+
+
+@admin.register(ProductViewDaily)
+class ProductViewDailyAdmin(admin.ModelAdmin):
+    list_display = ['product', 'date', 'views', 'anonymous_views', 'viewers']
+    list_filter = ['date']
+    raw_id_fields = ['product']
+    ordering = ['-date', '-views']
+
+
 class SizeChartItemInline(admin.TabularInline):
     model = SizeChartItem
     extra = 0
@@ -0,0 +1,167 @@
+import math
+from functools import cached_property
+
+from django.db.models import Case, CharField, Count, F, IntegerField, When, Min, Max, Exists, OuterRef, Value
+from django.db.models.functions import Cast, Floor, Least
+from django_filters.constants import EMPTY_VALUES
+
+from namito.catalog.bitmap import PRICE_BANDS, catalog_index, to_index_params
+from namito.catalog.models import Product, Variant, Color, Size, Brand
+
+
+class CategoryFacets:
+    """
+    Продукты и фасеты (цвета, бренды, размеры, рейтинги, цены) всего поддерева категории.
+    Поддерево выбирается один раз по интервалу lft/rght, поэтому число запросов
+    не зависит от глубины дерева.
+    """
+
+    def __init__(self, category):
+        self.category = category
+        self.products = Product.objects.filter(
+            category__tree_id=category.tree_id,
+            category__lft__gte=category.lft,
+            category__rght__lte=category.rght,
+        ).filter(Exists(Variant.objects.filter(product=OuterRef('pk'))))
+        # Те же продукты, что выдает CategoryProductListView
+        self.products_with_images = self.products.filter(active=True, stats__image_count__gt=0)
+
+    @cached_property
+    def price_range(self):
+        # Минимальная цена среди всех вариантов и максимальная из минимальных цен продуктов
+        return Variant.objects.filter(
+            product__in=self.products_with_images,
+            price__gt=0
+        ).values('product').annotate(
+            lowest=Min(Case(When(discounted_price__gt=0, then='discounted_price'), default='price')),
+            cheapest=Min(Case(When(discounted_price__gt=0, then=Least('price', 'discounted_price')),
+                              default='price')),
+        ).aggregate(min_price=Min('lowest'), max_price=Max('cheapest'))
+
+    def get_min_price(self):
+        return self.price_range['min_price']
+
+    def get_max_price(self):
+        return self.price_range['max_price']
+
+    def get_colors(self):
+        variants = Variant.objects.filter(color=OuterRef('pk'), product__in=self.products)
+        return Color.objects.filter(Exists(variants)).order_by('pk')
+
+    def get_sizes(self):
+        variants = Variant.objects.filter(size=OuterRef('pk'), product__in=self.products)
+        return Size.objects.filter(Exists(variants)).order_by('pk')
+
+    def get_brands(self):
+        return Brand.objects.filter(Exists(self.products.filter(brand=OuterRef('pk')))).order_by('pk')
+
+    def get_ratings(self):
+        averages = self.products.filter(
+            stats__average_rating__gt=0
+        ).values_list('stats__average_rating', flat=True).distinct()
+        return sorted({math.floor(round(average, 2)) for average in averages})
+
+
+class ProductFacets:
+    """
+    Количество продуктов для каждого значения фасета при текущих фильтрах
+    ProductFilter. Фасет считается без фильтров своего измерения, чтобы выбранный
+    цвет не обнулял остальные цвета. Если фильтры поддерживает индекс
+    namito.catalog.bitmap, счетчики берутся из него, иначе все фасеты собираются
+    одним UNION ALL запросом.
+    """
+    # Параметры ProductFilter, относящиеся к каждому фасету
+    dimensions = {
+        'color': ('color', 'color_id'),
+        'size': ('size',),
+        'brand': ('brand',),
+        'rating': ('min_rating',),
+        'price': ('min_price', 'max_price'),
+    }
+    price_bands = PRICE_BANDS
+
+    def __init__(self, filterset, index_base=None):
+        # index_base - ограничения базовой выборки представления в терминах индекса;
+        # None - выборку нельзя выразить через индекс
+        self.filterset = filterset
+        self.index_base = index_base
+
+    def get_params(self):
+        return {
+            name: value for name, value in self.filterset.form.cleaned_data.items()
+            if name != 'sort_by_discount' and value not in EMPTY_VALUES
+        }
+
+    def get_products(self, dimension):
+        excluded = self.dimensions[dimension]
+        queryset = self.filterset.queryset
+        for name, value in self.get_params().items():
+            if name not in excluded:
+                queryset = self.filterset.filters[name].filter(queryset, value)
+        return queryset.order_by().values('pk')
+
+    def get_variant_facet(self, dimension, field):
+        return Variant.objects.filter(product__in=self.get_products(dimension)).annotate(
+            facet=Value(dimension), value=Cast(field, CharField())
+        ).order_by().values('facet', 'value').annotate(count=Count('product', distinct=True))
+
+    def get_product_facet(self, dimension, expression, **lookups):
+        # values() после annotate: MultilingualQuerySet иначе добавляет в выборку все поля модели
+        return Product.objects.filter(pk__in=self.get_products(dimension), **lookups).annotate(
+            facet=Value(dimension), value=Cast(expression, CharField())
+        ).order_by().values('facet', 'value').annotate(count=Count('pk'))
+
+    def get_price_band(self):
+        return Case(
+            *[When(min_price__lt=bound, then=Value(index)) for index, bound in enumerate(self.price_bands[1:])],
+            default=Value(len(self.price_bands) - 1),
+            output_field=IntegerField()
+        )
+
+    def get_counts(self):
+        queries = [
+            self.get_variant_facet('color', 'color_id'),
+            self.get_variant_facet('size', 'size__name'),
+            self.get_product_facet('brand', F('brand__name'), brand__isnull=False),
+            self.get_product_facet('rating', Floor('stats__average_rating'), stats__average_rating__gt=0),
+            self.get_product_facet('price', self.get_price_band()),
+        ]
+        counts = {dimension: {} for dimension in self.dimensions}
+        for row in queries[0].union(*queries[1:], all=True):
+            counts[row['facet']][row['value']] = row['count']
+        return {
+            'color': {int(value): count for value, count in counts['color'].items()},
+            'size': counts['size'],
+            'brand': counts['brand'],
+            'rating': {int(float(value)): count for value, count in counts['rating'].items()},
+            'price': {int(value): count for value, count in counts['price'].items()},
+        }
+
+    def get_index_counts(self):
+        if self.index_base is None:
+            return None
+        params = to_index_params(self.get_params())
+        if params is None:
+            return None
+        return catalog_index.facets(params, self.index_base)
+
+    def get_facets(self):
+        counts = self.get_index_counts()
+        if counts is None:
+            counts = self.get_counts()
+        # Фильтр min_rating - "не ниже", поэтому для рейтинга считаем накопительно
+        ratings = counts['rating']
+        bounds = self.price_bands + (None,)
+        return {
+            'colors': [{'id': value, 'count': count} for value, count in sorted(counts['color'].items())],
+            'sizes': [{'name': value, 'count': count} for value, count in sorted(counts['size'].items())],
+            'brands': [{'name': value, 'count': count} for value, count in sorted(counts['brand'].items())],
+            'ratings': [
+                {'min_rating': rating, 'count': sum(count for value, count in ratings.items() if value >= rating)}
+                for rating in sorted(ratings)
+            ],
+            'prices': [
+                {'min_price': bounds[value], 'max_price': bounds[value + 1], 'count': count}
+                for value, count in sorted(counts['price'].items())
+            ],
+        }
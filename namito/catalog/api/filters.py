@@ -1,9 +1,30 @@
 import django_filters
-from django.db.models import Avg, Min, Max, Q
+from django.db.models import Exists, Max, OuterRef, Subquery
+from django_filters.constants import EMPTY_VALUES
+from namito.catalog.bitmap import catalog_index, to_index_params
 from namito.catalog.models import Product, Category, Variant
 
 
+def variant_exists(**lookups):
+    """Коррелированный EXISTS по вариантам: не размножает строки продукта, поэтому не нужен DISTINCT."""
+    return Exists(Variant.objects.filter(product=OuterRef('pk'), **lookups))
+
+
+def split_values(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
 class ProductFilter(django_filters.FilterSet):
+    """
+    Каждый параметр применяется один раз: условия по вариантам - EXISTS,
+    цены, рейтинг и категория - по денормализованным колонкам продукта,
+    ProductStats и дерева категорий. JOIN со множественными связями нет.
+    Атрибутные параметры сначала разрешаются индексом namito.catalog.bitmap в
+    список id, если он готов и совпадений немного; иначе работает SQL.
+    """
+    # Параметры, которые индекс не хранит
+    not_indexed = ('name', 'sort_by_discount')
+
     name = django_filters.CharFilter(field_name="name", lookup_expr='icontains')
     min_price = django_filters.NumberFilter(method='filter_by_min_price')
     max_price = django_filters.NumberFilter(method='filter_by_max_price')
@@ -12,106 +33,83 @@ class ProductFilter(django_filters.FilterSet):
     min_rating = django_filters.NumberFilter(method='filter_by_min_rating')
     has_discount = django_filters.BooleanFilter(method='filter_by_discount_presence')
     color = django_filters.CharFilter(method='filter_by_colors')
+    color_id = django_filters.CharFilter(method='filter_by_colors')
     size = django_filters.CharFilter(method='filter_by_sizes')
+    in_stock = django_filters.BooleanFilter(method='filter_by_stock')
+    sort_by_discount = django_filters.ChoiceFilter(
+        choices=(('asc', 'asc'), ('desc', 'desc')), method='order_by_discount'
+    )
 
     class Meta:
         model = Product
         fields = ['name', 'min_price', 'max_price', 'brand', 'category_slug',
-                  'min_rating', 'has_discount', 'color', 'size']
+                  'min_rating', 'has_discount', 'color', 'color_id', 'size', 'in_stock', 'sort_by_discount']
+
+    def filter_queryset(self, queryset):
+        params = {name: value for name, value in self.form.cleaned_data.items() if value not in EMPTY_VALUES}
+        indexed = {name: value for name, value in params.items() if name not in self.not_indexed}
+        index_params = to_index_params(indexed) if indexed else None
+        product_ids = catalog_index.resolve(index_params) if index_params is not None else None
+        if product_ids is not None:
+            # Базовые условия queryset остаются в SQL, индекс только сужает выборку
+            queryset = queryset.filter(pk__in=product_ids)
+            params = {name: value for name, value in params.items() if name not in indexed}
+        for name, value in params.items():
+            queryset = self.filters[name].filter(queryset, value)
+        return queryset
+
+    def get_category(self, slug):
+        # Фильтр может применяться несколько раз для фасетов (ProductFacets) - категорию читаем один раз
+        if not hasattr(self, '_categories'):
+            self._categories = {}
+        if slug not in self._categories:
+            self._categories[slug] = Category.objects.filter(slug=slug).only('tree_id', 'lft', 'rght').first()
+        return self._categories[slug]
 
     def filter_by_category_slug(self, queryset, name, value):
-        category = Category.objects.filter(slug=value).first()
+        category = self.get_category(value)
         if category:
-            descendant_categories = category.get_descendants(include_self=True).values_list('id', flat=True)
-            return queryset.filter(category_id__in=descendant_categories)
+            # Потомки категории - отрезок [lft, rght] в ее дереве, отдельный запрос за ними не нужен
+            return queryset.filter(
+                category__tree_id=category.tree_id,
+                category__lft__gte=category.lft,
+                category__rght__lte=category.rght
+            )
         return queryset.none()
 
     def filter_by_brands(self, queryset, name, value):
-        brands = value.split(',')
-        return queryset.filter(brand__name__in=brands)
+        return queryset.filter(brand__name__in=split_values(value))
 
     def filter_by_colors(self, queryset, name, value):
-        colors = value.split(',')
-        return queryset.filter(variants__color__id__in=colors).distinct()
+        return queryset.filter(variant_exists(color_id__in=split_values(value)))
 
     def filter_by_sizes(self, queryset, name, value):
-        sizes = value.split(',')
-        return queryset.filter(variants__size__name__in=sizes).distinct()
+        return queryset.filter(variant_exists(size__name__in=split_values(value)))
+
+    def filter_by_stock(self, queryset, name, value):
+        in_stock = variant_exists(stock__gt=0)
+        return queryset.filter(in_stock if value else ~in_stock)
 
     def filter_by_min_rating(self, queryset, name, value):
-        return queryset.annotate(
-            avg_rating=Avg('reviews__rating')
-        ).filter(avg_rating__gte=value)
+        return queryset.filter(stats__average_rating__gte=value)
 
     def filter_by_discount_presence(self, queryset, name, value):
-        if value:
-            return queryset.filter(
-                variants__discount_value__gt=0,
-                variants__discount_type__isnull=False
-            ).distinct()
-        else:
-            return queryset.exclude(
-                variants__discount_value__gt=0,
-                variants__discount_type__isnull=False
-            ).distinct()
+        discounted = variant_exists(discount_value__gt=0, discount_type__isnull=False)
+        return queryset.filter(discounted if value else ~discounted)
 
+    # min_price и max_price продукта - минимум и максимум discounted_price вариантов (Product.update_price_range)
     def filter_by_min_price(self, queryset, name, value):
-        return queryset.annotate(
-            min_variant_price=Min(
-                'variants__discounted_price',
-                filter=Q(variants__discounted_price__isnull=False)
-            )
-        ).filter(min_variant_price__gte=value)
+        return queryset.filter(min_price__gte=value)
 
     def filter_by_max_price(self, queryset, name, value):
-        return queryset.annotate(
-            max_variant_price=Max(
-                'variants__discounted_price',
-                filter=Q(variants__discounted_price__isnull=False)
-            )
-        ).filter(max_variant_price__lte=value)
-
-    def sort_by_discount(self, queryset, order):
-        if order == 'asc':
-            return queryset.order_by('variants__discount_value').distinct()
-        elif order == 'desc':
-            return queryset.order_by('-variants__discount_value').distinct()
-        return queryset
-
-    @property
-    def qs(self):
-        queryset = super().qs
-        queryset = self.apply_filters(queryset)
-
-        sort_by_discount = self.request.GET.get('sort_by_discount')
-        if sort_by_discount:
-            queryset = self.sort_by_discount(queryset, sort_by_discount)
-
-        return queryset.distinct()
-
-    def apply_filters(self, queryset):
-        params = self.request.GET
-
-        min_price = params.get('min_price')
-        max_price = params.get('max_price')
-
-        if min_price is not None:
-            queryset = self.filter_by_min_price(queryset, 'min_price', min_price)
-
-        if max_price is not None:
-            queryset = self.filter_by_max_price(queryset, 'max_price', max_price)
-        if 'color_id' in params:
-            queryset = self.filter_by_colors(queryset, 'color_id', params.getlist('color_id'))
-        if 'size' in params:
-            queryset = self.filter_by_sizes(queryset, 'size', params['size'])
-        if 'brand' in params:
-            queryset = self.filter_by_brands(queryset, 'brand', params['brand'])
-        if 'category_slug' in params:
-            queryset = self.filter_by_category_slug(queryset, 'category_slug', params['category_slug'])
-        if 'min_rating' in params:
-            queryset = self.filter_by_min_rating(queryset, 'min_rating', float(params['min_rating']))
-        if 'has_discount' in params:
-            has_discount = params['has_discount'].lower() == 'true'
-            queryset = self.filter_by_discount_presence(queryset, 'has_discount', has_discount)
-
-        return queryset.distinct()
+        return queryset.filter(max_price__lte=value)
+
+    def order_by_discount(self, queryset, name, value):
+        discount = Subquery(
+            Variant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+            .annotate(value=Max('discount_value')).values('value')
+        )
+        queryset = queryset.annotate(variant_discount=discount)
+        if value == 'asc':
+            return queryset.order_by('variant_discount', 'id')
+        return queryset.order_by('-variant_discount', '-id')
@@ -1,7 +1,22 @@
+import base64
+import datetime
+import decimal
+import hashlib
+import json
 import math
 
-from rest_framework.pagination import PageNumberPagination
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, OrderBy, Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from namito.catalog.cache import get_catalog_version
 
 
 class CustomPageNumberPagination(PageNumberPagination):
@@ -17,3 +32,250 @@ class CustomPageNumberPagination(PageNumberPagination):
             'page_size': self.page_size,
             'total_pages': total_pages
         })
+
+
+def estimate_count(queryset):
+    """Оценка количества строк планировщиком PostgreSQL (None для других БД)."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedCountPaginator(Paginator):
+    """
+    count берется из кэша по ключу фильтров и версии каталога. Если планировщик
+    оценивает выборку больше estimate_threshold, точный COUNT(*) не выполняется.
+    """
+
+    def __init__(self, *args, cache_key=None, estimate_threshold=None, timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_key = cache_key
+        self.estimate_threshold = estimate_threshold
+        self.timeout = timeout
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        cached = cache.get(self.cache_key) if self.cache_key else None
+        if cached is not None:
+            count, self.count_exact = cached
+            return count
+
+        count = None
+        if self.estimate_threshold is not None and hasattr(self.object_list, 'query'):
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate > self.estimate_threshold:
+                count, self.count_exact = estimate, False
+        if count is None:
+            count, self.count_exact = super().count, True
+
+        if self.cache_key:
+            cache.set(self.cache_key, (count, self.count_exact), self.timeout)
+        return count
+
+
+class CachedCountPageNumberPagination(CustomPageNumberPagination):
+    """
+    Постраничная пагинация, которая не пересчитывает count на каждой странице.
+    Ключ кэша - путь, язык и нормализованные параметры фильтров; при изменении
+    каталога версия меняется и старые значения перестают использоваться.
+    """
+    count_cache_timeout = 60 * 15
+    estimate_threshold = 100000
+    # параметры, не влияющие на состав выборки
+    ignored_query_params = ('page', 'page_size', 'ordering', 'cursor', 'facets')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_cache_key = self.get_count_cache_key(request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        return CachedCountPaginator(
+            queryset, page_size,
+            cache_key=self.count_cache_key,
+            estimate_threshold=self.estimate_threshold,
+            timeout=self.count_cache_timeout
+        )
+
+    def get_count_cache_key(self, request):
+        filters = sorted(
+            (key, sorted(value for value in request.query_params.getlist(key) if value))
+            for key in request.query_params
+            if key not in self.ignored_query_params
+        )
+        filters = [(key, values) for key, values in filters if values]
+        payload = json.dumps([request.path, getattr(request, 'LANGUAGE_CODE', ''), filters])
+        digest = hashlib.md5(payload.encode()).hexdigest()
+        return f'catalog:count:{get_catalog_version()}:{digest}'
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        response.data['count_exact'] = self.page.paginator.count_exact
+        return response
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'Unsupported cursor value: {value!r}')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу: следующая страница начинается сразу после последней строки
+    предыдущей (WHERE (поле, id) > (значение, id)), без OFFSET и COUNT(*), поэтому
+    стоимость страницы не зависит от глубины.
+
+    Включается параметром cursor (пустое значение - первая страница). Без него
+    используется fallback_class или список отдается без пагинации.
+    Сортировка берется из queryset, при равенстве значений - по id.
+    """
+    page_size = 20
+    cursor_query_param = 'cursor'
+    results_key = 'results'
+    ordering = ('-pk',)
+    fallback_class = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    fallback = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self.cursor_query_param not in request.query_params:
+            if self.fallback_class is None:
+                return None
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.fields = self.get_ordering(queryset, view)
+        values, reverse = self.decode_cursor(request.query_params[self.cursor_query_param])
+
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(values, reverse))
+        ordering = [('-' if descending != reverse else '') + field for field, descending in self.fields]
+        results = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+
+        self.page = results
+        return results
+
+    def get_ordering(self, queryset, view=None):
+        """
+        [(поле, по убыванию)] из сортировки queryset. Поддерживаются имена полей
+        и аннотаций и F('поле').asc()/desc(); для выражений значение курсора
+        не из чего взять, это ошибка настройки представления.
+        """
+        ordering = list(queryset.query.order_by) or list(queryset.query.get_meta().ordering) or list(self.ordering)
+        fields = []
+        for field in ordering:
+            if isinstance(field, OrderBy) and isinstance(field.expression, F):
+                field = ('-' if field.descending else '') + field.expression.name
+            if not isinstance(field, str):
+                raise ImproperlyConfigured(
+                    f'{type(view).__name__ if view else type(self).__name__}: KeysetPagination supports only '
+                    f'orderings by field or annotation names, got {field!r}. Annotate the expression and order by '
+                    f'the annotation.'
+                )
+            descending = field.startswith('-')
+            field = field.lstrip('-')
+            fields.append(('pk' if field == 'id' else field, descending))
+        if not any(field == 'pk' for field, descending in fields):
+            fields.append(('pk', fields[-1][1] if fields else False))
+        return fields
+
+    def get_keyset_filter(self, values, reverse):
+        # NULL считается больше любого значения, как в PostgreSQL (ASC NULLS LAST)
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.fields, values, strict=True):
+            is_null = Q(**{f'{field}__isnull': True})
+            if value is None:
+                step = Q(pk__in=[]) if descending == reverse else ~is_null
+                same = is_null
+            else:
+                step = Q(**{f'{field}__gt': value}) | is_null if descending == reverse else Q(**{f'{field}__lt': value})
+                same = Q(**{field: value})
+            condition |= equal & step
+            equal &= same
+        return condition
+
+    def get_position(self, instance):
+        values = []
+        for field, _ in self.fields:
+            value = instance
+            for attr in field.split('__'):
+                value = getattr(value, attr) if value is not None else None
+            values.append(value)
+        return values
+
+    def encode_cursor(self, instance, reverse=False):
+        payload = json.dumps({'p': self.get_position(instance), 'r': reverse}, default=_encode_value)
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values, reverse = payload['p'], bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message) from None
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def get_next_link(self):
+        if self.fallback is not None:
+            return self.fallback.get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if self.fallback is not None:
+            return self.fallback.get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, '')
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            self.results_key: data,
+            'page_size': self.page_size,
+        })
+
+
+class ProductKeysetPagination(KeysetPagination):
+    results_key = 'products'
+    fallback_class = CachedCountPageNumberPagination
+
+
+class ProductSearchKeysetPagination(KeysetPagination):
+    results_key = 'products'
+
+
+class ReviewKeysetPagination(KeysetPagination):
+    results_key = 'reviews'
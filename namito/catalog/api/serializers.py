@@ -1,7 +1,5 @@
-import math
-
 from django.db import models
-from django.db.models import Avg, Min, Q, Case, When, IntegerField
+from django.db.models import Prefetch, prefetch_related_objects
 
 from rest_framework import serializers
 
@@ -21,6 +19,7 @@ from namito.catalog.models import (
     Characteristic,
     ReviewImage
 )
+from namito.catalog.api.facets import CategoryFacets
 from namito.orders.models import CartItem, OrderedItem
 from namito.users.api.serializers import UserProfileSerializer
 
@@ -32,8 +31,8 @@ class CategorySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'type', 'slug', 'image', 'parent', 'order', 'meta_title', 'meta_image',
-                  'promotion', 'children', 'background_color', 'icon']
+        fields = ['id', 'name', 'type', 'slug', 'image', 'placeholder', 'dominant_color', 'parent', 'order',
+                  'meta_title', 'meta_image', 'promotion', 'children', 'background_color', 'icon']
 
     def get_fields(self):
         fields = super().get_fields()
@@ -45,7 +44,8 @@ class CategorySerializer(serializers.ModelSerializer):
         if obj.id in self.context['serialized_categories']:
             return []
         self.context['serialized_categories'].add(obj.id)
-        serializer = CategorySerializer(obj.children.all(), many=True, context=self.context)
+        # get_children берет детей из кэша get_cached_trees, если дерево загружено целиком
+        serializer = CategorySerializer(obj.get_children(), many=True, context=self.context)
         return serializer.data
 
     def get_parent(self, obj):
@@ -58,8 +58,7 @@ class CategorySerializer(serializers.ModelSerializer):
         return None
 
 
-class CategoryBySlugSerializer(CategorySerializer):
-    products = serializers.SerializerMethodField()
+class CategoryFacetsSerializer(CategorySerializer):
     colors = serializers.SerializerMethodField()
     brands = serializers.SerializerMethodField()
     sizes = serializers.SerializerMethodField()
@@ -68,118 +67,46 @@ class CategoryBySlugSerializer(CategorySerializer):
     max_price = serializers.SerializerMethodField()
 
     class Meta(CategorySerializer.Meta):
-        fields = CategorySerializer.Meta.fields + ['products', 'ratings', 'min_price', 'max_price',
+        fields = CategorySerializer.Meta.fields + ['ratings', 'min_price', 'max_price',
                                                    'brands', 'colors', 'sizes']
 
-    def get_products(self, obj):
-        def get_all_products(category):
-            products = list(category.products.filter(variants__isnull=False).distinct())
-            for child in category.children.all():
-                products.extend(get_all_products(child))
-            return products
-
-        products = get_all_products(obj)
-        products_with_images = [product for product in products if Image.objects.filter(product=product).exists()]
-        product_data = []
-
-        for product in products_with_images:
-            rating = product.get_popularity_score()  # Получаем рейтинг продукта
-            product_serializer = ProductListSerializer(product, context=self.context)
-            product_data.append({**product_serializer.data, 'popularity_score': rating})
-
-        return product_data
+    def get_facets(self, obj):
+        if not hasattr(self, '_facets'):
+            self._facets = {}
+        if obj.pk not in self._facets:
+            self._facets[obj.pk] = CategoryFacets(obj)
+        return self._facets[obj.pk]
 
     def get_min_price(self, obj):
-        products = self.get_products(obj)
-        prices = []
-        for product in products:
-            for variant_data in product.get('variants', []):
-                price = variant_data.get('price')
-                discounted_price = variant_data.get('discounted_price')
-                if price:
-                    if discounted_price:
-                        prices.append(discounted_price)
-                    else:
-                        prices.append(price)
-        return min(prices) if prices else None
+        return self.get_facets(obj).get_min_price()
 
     def get_max_price(self, obj):
-        products = self.get_products(obj)
-        min_prices = []
-
-        for product in products:
-            variants = product.get('variants', [])
-
-            # Находим минимальную цену среди всех вариантов продукта
-            min_price = None
-            for variant_data in variants:
-                price = variant_data.get('price')
-                discounted_price = variant_data.get('discounted_price')
-
-                if price:
-                    if discounted_price:
-                        current_min = min(price, discounted_price)
-                    else:
-                        current_min = price
-
-                    if min_price is None or current_min < min_price:
-                        min_price = current_min
-
-            if min_price is not None:
-                min_prices.append(min_price)
-
-        return max(min_prices) if min_prices else None
+        return self.get_facets(obj).get_max_price()
 
     def get_colors(self, obj):
-        def get_all_products(category):
-            products = list(category.products.filter(variants__isnull=False).distinct())
-            for child in category.children.all():
-                products.extend(get_all_products(child))
-            return products
-
-        products = get_all_products(obj)
-        variants = Variant.objects.filter(product__in=products).select_related('color')
-        colors = {variant.color for variant in variants if variant.color}
-
-        data = [{'id': color.id, 'name': color.name, 'color': color.color} for color in colors]
-        return data
+        return [{'id': color.id, 'name': color.name, 'color': color.color}
+                for color in self.get_facets(obj).get_colors()]
 
     def get_brands(self, obj):
-        def get_all_products(category):
-            products = list(category.products.filter(variants__isnull=False).distinct())
-            for child in category.children.all():
-                products.extend(get_all_products(child))
-            return products
-
-        products = get_all_products(obj)
-        brands = Brand.objects.filter(products__in=products).distinct()
-        data = [{'name': brand.name} for brand in brands]
-        return data
+        return [{'name': brand.name} for brand in self.get_facets(obj).get_brands()]
 
     def get_sizes(self, obj):
-        def get_all_products(category):
-            products = list(category.products.filter(variants__isnull=False).distinct())
-            for child in category.children.all():
-                products.extend(get_all_products(child))
-            return products
+        return [{'id': size.id, 'name': size.name} for size in self.get_facets(obj).get_sizes()]
 
-        products = get_all_products(obj)
-        variants = Variant.objects.filter(product__in=products).select_related('size')
-        sizes = {variant.size for variant in variants if variant.size}
+    def get_ratings(self, obj):
+        return self.get_facets(obj).get_ratings()
 
-        data = [{'id': size.id, 'name': size.name} for size in sizes]
-        return data
 
-    def get_ratings(self, obj):
-        def get_all_products(category):
-            products = list(category.products.filter(variants__isnull=False).distinct())
-            for child in category.children.all():
-                products.extend(get_all_products(child))
-            return products
+class CategoryBySlugSerializer(CategoryFacetsSerializer):
+    products = serializers.SerializerMethodField()
+
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + ['products', 'ratings', 'min_price', 'max_price',
+                                                   'brands', 'colors', 'sizes']
 
-        products = get_all_products(obj)
-        ratings = [math.floor(product.get_average_rating()) for product in products if product.get_average_rating() > 0]
-        return set(ratings)
+    def get_products(self, obj):
+        # Страница продуктов формируется во view с пагинацией и сортировкой ProductListView
+        return self.context.get('products')
 
 
 class BrandSerializer(serializers.ModelSerializer):
@@ -208,10 +135,11 @@ class TagSerializer(serializers.ModelSerializer):
 
 class ImageSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
-        fields = '__all__'
+        exclude = ['image_hash', 'renditions']
 
     def get_image(self, obj):
         request = self.context.get('request')
@@ -221,6 +149,9 @@ class ImageSerializer(serializers.ModelSerializer):
             return obj.image.url
         return None
 
+    def get_srcset(self, obj):
+        return obj.get_srcset(request=self.context.get('request'))
+
 
 class VariantSerializer(serializers.ModelSerializer):
     product = serializers.CharField(source='product.name', read_only=True)
@@ -253,6 +184,51 @@ class CategorySeoSerializer(serializers.ModelSerializer):
         fields = ('id', 'slug', 'meta_title', 'meta_description', 'meta_image')
 
 
+class ProductListBatch:
+    """
+    Данные для ProductListSerializer, загруженные сразу для всей страницы продуктов
+    фиксированным числом запросов вместо нескольких запросов на каждый продукт.
+    """
+
+    def __init__(self, products, request=None):
+        self.product_ids = {product.pk for product in products}
+        prefetch_related_objects(
+            products,
+            'category',
+            'brand',
+            'tags',
+            'characteristics',
+            'images',
+            'stats',
+            Prefetch('variants', queryset=Variant.objects.select_related('color', 'size')),
+        )
+
+        user = request.user if request is not None else None
+        self.favorite_ids = set()
+        self.cart_quantities = {}
+        if user and user.is_authenticated:
+            self.favorite_ids = set(Favorite.objects.filter(
+                user=user,
+                product__in=self.product_ids
+            ).values_list('product', flat=True))
+            quantities = CartItem.objects.filter(
+                cart__user=user,
+                product_variant__product__in=self.product_ids,
+                to_purchase=True
+            ).values('product_variant__product').annotate(total_quantity=models.Sum('quantity'))
+            self.cart_quantities = {row['product_variant__product']: row['total_quantity'] for row in quantities}
+
+    def __contains__(self, product):
+        return product.pk in self.product_ids
+
+
+class ProductListBatchSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.batch = ProductListBatch(products, self.context.get('request'))
+        return super().to_representation(products)
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     price = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
@@ -261,90 +237,97 @@ class ProductListSerializer(serializers.ModelSerializer):
     is_favorite = serializers.SerializerMethodField()
     cart_quantity = serializers.SerializerMethodField()
     images = serializers.SerializerMethodField()
+    image_srcsets = serializers.SerializerMethodField()
+    image_placeholders = serializers.SerializerMethodField()
     brand = BrandSerializer(many=False, read_only=True)
     characteristics = serializers.SerializerMethodField()
 
+    batch = None
+
     class Meta:
         model = Product
         fields = ['id', 'name', 'description', 'category', 'price', 'brand', 'average_rating', 'tags', 'is_favorite',
-                  'cart_quantity', 'images', 'characteristics']
+                  'cart_quantity', 'images', 'image_srcsets', 'image_placeholders', 'characteristics']
+        list_serializer_class = ProductListBatchSerializer
 
     def get_price(self, product):
         # Получаем самую минимальную цену среди всех вариантов продукта
-        min_price = Variant.objects.filter(product=product).aggregate(
-            min_price=Min(
-                Case(
-                    When(discounted_price__isnull=False, then='discounted_price'),
-                    default='price',
-                    output_field=IntegerField(),
-                )
-            )
-        )['min_price']
+        variants = product.variants.all()
+        prices = [variant.price if variant.discounted_price is None else variant.discounted_price
+                  for variant in variants]
 
-        if min_price is not None:
+        if prices:
+            min_price = min(prices)
             # Находим первый вариант с минимальной ценой или скидкой
-            min_variant = Variant.objects.filter(product=product).filter(
-                Q(price=min_price) | Q(discounted_price=min_price)
-            ).first()
-
-            if min_variant:
-                price = min_variant.price
-                discount = min_variant.discounted_price
-                return {
-                    'price': price,
-                    'reduced_price': discount if discount != price else None
-                }
+            min_variant = min(
+                (variant for variant in variants
+                 if variant.price == min_price or variant.discounted_price == min_price),
+                key=lambda variant: variant.pk
+            )
+            price = min_variant.price
+            discount = min_variant.discounted_price
+            return {
+                'price': price,
+                'reduced_price': discount if discount != price else None
+            }
 
         # Возвращаем нулевые значения, если не найдено
         return {'price': 0, 'reduced_price': 0}
 
     def get_average_rating(self, product):
-        average = Review.objects.filter(product=product).aggregate(Avg('rating'))['rating__avg']
-        if average is None:
-            return 0
-        return round(average, 2)
+        return product.get_average_rating()
 
     def get_tags(self, product):
         tags_qs = product.tags.all()
         return TagSerializer(tags_qs, many=True).data
 
     def get_is_favorite(self, product):
-        user = self.context.get('request').user if 'request' in self.context else None
-        if user and user.is_authenticated:
-            return Favorite.objects.filter(user=user, product=product).exists()
-        return False
+        return product.pk in self.batch.favorite_ids
 
     def get_cart_quantity(self, product):
-        user = self.context.get('request').user if 'request' in self.context else None
-        if user and user.is_authenticated:
-            quantity = CartItem.objects.filter(
-                cart__user=user,
-                product_variant__product=product,
-                to_purchase=True
-            ).aggregate(total_quantity=models.Sum('quantity'))['total_quantity']
-            return quantity if quantity else 0
-        return 0
+        return self.batch.cart_quantities.get(product.pk) or 0
 
     def get_images(self, product):
         request = self.context.get('request')
-        images = Image.objects.filter(product=product)[:3]  # Ограничение до трех изображений
+        images = list(product.images.all())[:3]  # Ограничение до трех изображений
         if request is not None:
             return [request.build_absolute_uri(image.image.url) for image in images if image.image]
         return [image.image.url for image in images if image.image]
 
+    def get_image_srcsets(self, product):
+        # В том же порядке, что и images: размер карточки каталога для каждой картинки
+        request = self.context.get('request')
+        images = list(product.images.all())[:3]
+        return [image.get_srcset(['grid_card'], request) for image in images if image.image]
+
+    def get_image_placeholders(self, product):
+        images = list(product.images.all())[:3]
+        return [{'placeholder': image.placeholder, 'dominant_color': image.dominant_color}
+                for image in images if image.image]
+
     def get_characteristics(self, product):
-        characteristics = Characteristic.objects.filter(product=product)
+        characteristics = product.characteristics.all()
         return CharacteristicsSerializer(characteristics, many=True).data
 
     def to_representation(self, instance):
-        if not Image.objects.filter(product=instance).exists():  # Проверка наличия изображений
+        if self.batch is None or instance not in self.batch:
+            self.batch = ProductListBatch([instance], self.context.get('request'))
+        if not instance.images.all():  # Проверка наличия изображений
             return None
         representation = super().to_representation(instance)
-        variants = Variant.objects.filter(product=instance)
+        variants = instance.variants.all()
         representation['variants'] = VariantSerializer(variants, many=True).data
         return representation
 
 
+class CategoryProductSerializer(ProductListSerializer):
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        if representation is not None:
+            representation['popularity_score'] = instance.get_popularity_score()  # Получаем рейтинг продукта
+        return representation
+
+
 class CharacteristicsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Characteristic
@@ -377,10 +360,7 @@ class ProductSerializer(serializers.ModelSerializer):
         return VariantSerializer(variants_qs, many=True, context=self.context).data
 
     def get_average_rating(self, product):
-        average = Review.objects.filter(product=product).aggregate(Avg('rating'))['rating__avg']
-        if average is None:
-            return 0
-        return round(average, 2)
+        return product.get_average_rating()
 
     def get_tags(self, product):
         tags_qs = product.tags.all()
@@ -412,12 +392,10 @@ class ProductSerializer(serializers.ModelSerializer):
         return ReviewSerializer(reviews_qs, many=True, context=self.context).data
 
     def get_review_count(self, product):
-        review_count = Review.objects.filter(product=product, text__isnull=False, text__gt='').count()
-        return review_count
+        return product.get_stats().review_count
 
     def get_rating_count(self, product):
-        rating_count = Review.objects.filter(product=product).count()
-        return rating_count
+        return product.get_stats().rating_count
 
     def get_review_allowed(self, product):
         user = self.context.get('request').user
@@ -451,9 +429,14 @@ class ProductSerializer(serializers.ModelSerializer):
 
 
 class ReviewImageSerializer(serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = ReviewImage
-        fields = ['id', 'image', 'main_image']
+        fields = ['id', 'image', 'main_image', 'srcset', 'placeholder', 'dominant_color']
+
+    def get_srcset(self, obj):
+        return obj.get_srcset(['review_thumb'], self.context.get('request'))
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -470,20 +453,12 @@ class ReviewSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'product_name', 'product_image', 'user', 'text', 'created_at', 'updated_at', 'rating', 'images', 'review_allowed']
 
     def get_product_image(self, obj):
-        product = obj.product
-        main_image = product.images.filter(main_image=True).first()
-        if main_image:
+        image_url = obj.product.get_stats().main_image_url
+        if image_url:
             request = self.context.get('request')
             if request is not None:
-                return request.build_absolute_uri(main_image.image.url)
-            return main_image.image.url
-        else:
-            first_image = product.images.first()
-            if first_image:
-                request = self.context.get('request')
-                if request is not None:
-                    return request.build_absolute_uri(first_image.image.url)
-                return first_image.image.url
+                return request.build_absolute_uri(image_url)
+            return image_url
         return None
 
     def get_review_allowed(self, obj):
@@ -513,12 +488,21 @@ class ReviewSerializer(serializers.ModelSerializer):
         return representation
 
 
+class FavoriteListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        favorites = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        products = [favorite.product for favorite in favorites]
+        self.child.fields['product'].batch = ProductListBatch(products, self.context.get('request'))
+        return super().to_representation(favorites)
+
+
 class FavoriteSerializer(serializers.ModelSerializer):
     product = ProductListSerializer(read_only=True)
 
     class Meta:
         model = Favorite
         fields = ['id', 'user', 'product']
+        list_serializer_class = FavoriteListSerializer
 
 
 class SizeChartItemSerializer(serializers.ModelSerializer):
@@ -1,7 +1,9 @@
+from decimal import Decimal
+
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Max, Count, Min
-from django.db import models
+from django.db.models import Exists, F, OuterRef, Max, Min
+from django.db.models.functions import Coalesce
 from django.http import Http404
 
 
@@ -9,10 +11,8 @@ from rest_framework import generics, permissions, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied, ValidationError
-from rest_framework.filters import OrderingFilter
 
 from drf_yasg.utils import swagger_auto_schema
-from modeltranslation.translator import translator
 
 from namito.catalog.models import (
     Category,
@@ -24,8 +24,7 @@ from namito.catalog.models import (
     Review,
     Favorite,
     SizeChart,
-    Brand,
-    ProductView
+    Brand
 )
 from .serializers import (
     CategorySerializer,
@@ -43,12 +42,22 @@ from .serializers import (
     ColorSizeBrandSerializer,
     FavoriteToggleSerializer,
     CategoryBySlugSerializer,
+    CategoryFacetsSerializer,
+    CategoryProductSerializer,
     ProductSeoSerializer,
     CategorySeoSerializer
 
 )
-from .pagination import CustomPageNumberPagination
+from .pagination import ProductKeysetPagination, ProductSearchKeysetPagination, ReviewKeysetPagination
 from .filters import ProductFilter
+from .facets import CategoryFacets, ProductFacets
+from ..search import search_products
+from ..fuzzy import fuzzy_search_products
+from ..suggest import suggest_index
+from ..tree import get_serialized_category_tree
+from ..cache import get_cached_response_data
+from ..featured import TOP_PRODUCTS_POOL, get_featured_products
+from ..tracking import product_view_buffer, search_query_buffer
 from ...orders.models import OrderedItem
 
 
@@ -58,13 +67,22 @@ class CategoryListView(generics.ListAPIView):
     def get_queryset(self):
         return Category.objects.filter(parent=None)
 
+    def get_tree(self):
+        return get_serialized_category_tree(
+            'categories', lambda roots: self.get_serializer(roots, many=True).data, self.request
+        )
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.get_tree())
 
-class CategoryPromotionListView(generics.ListAPIView):
-    serializer_class = CategorySerializer
 
+class CategoryPromotionListView(CategoryListView):
     def get_queryset(self):
         return Category.objects.filter(parent=None, promotion=True)
 
+    def list(self, request, *args, **kwargs):
+        return Response([category for category in self.get_tree() if category['promotion']])
+
 
 class BrandListView(generics.ListAPIView):
     queryset = Category.objects.all()
@@ -78,67 +96,88 @@ class BrandDetailView(generics.RetrieveAPIView):
 
 class ProductListView(generics.ListAPIView):
     serializer_class = ProductListSerializer
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter
-    pagination_class = CustomPageNumberPagination
-    ordering_fields = ['name', 'max_discount', 'popularity', 'created_at', 'min_variant_price']
-    ordering = ['name']
+    pagination_class = ProductKeysetPagination
+
+    def get_base_queryset(self):
+        return Product.objects.filter(
+            Exists(Variant.objects.filter(product=OuterRef('pk'))),
+            active=True
+        )
+
+    def get_index_base(self):
+        # get_base_queryset в терминах индекса namito.catalog.bitmap (активные продукты с вариантами)
+        return {}
 
     def get_queryset(self):
-        queryset = Product.objects.annotate(
-            max_discount=Max('variants__discount_value'),
-            popularity=Count('views'),
-            min_variant_price=Min('variants__price')
-        ).filter(
-            active=True,
-            variants__isnull=False
-        ).distinct()
+        queryset = self.get_base_queryset()
 
         ordering_param = self.request.query_params.get('ordering')
+        # id в конце делает порядок однозначным при равных значениях.
+        # Агрегаты по вариантам считаются только для сортировок, которым они нужны;
+        # popularity и trending - индексированные колонки ProductStats (команда update_popularity)
         if ordering_param == 'popularity':
-            queryset = queryset.order_by('-popularity')
+            queryset = queryset.annotate(popularity=F('stats__popularity')).order_by('-popularity', '-id')
+        elif ordering_param == 'trending':
+            queryset = queryset.annotate(trending=F('stats__trending')).order_by('-trending', '-id')
         elif ordering_param == 'max_discount':
-            queryset = queryset.order_by('-max_discount')
+            # Coalesce: ключи сортировки не должны быть NULL, иначе курсор теряет строки
+            queryset = queryset.annotate(
+                max_discount=Coalesce(Max('variants__discount_value'), Decimal(0))
+            ).order_by('-max_discount', '-id')
         elif ordering_param == '-price':
-            queryset = queryset.order_by('-min_variant_price')
+            queryset = queryset.annotate(min_variant_price=Min('variants__price')).order_by('-min_variant_price', '-id')
         elif ordering_param == 'price':
-            queryset = queryset.order_by('min_variant_price')
+            queryset = queryset.annotate(min_variant_price=Min('variants__price')).order_by('min_variant_price', 'id')
         elif ordering_param == 'created_at':
-            queryset = queryset.order_by('-created_at')
+            queryset = queryset.order_by('-created_at', '-id')
         else:
-            queryset = queryset.order_by('name')
+            queryset = queryset.order_by('name', 'id')
 
         return queryset
 
+    def get_facets(self):
+        # Фасеты считаются по тем же параметрам ProductFilter, но без сортировки и аннотаций
+        filterset = DjangoFilterBackend().get_filterset(self.request, self.get_base_queryset(), self)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return ProductFacets(filterset, self.get_index_base()).get_facets()
+
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
+        with_facets = request.query_params.get('facets', '').lower() in ('1', 'true')
 
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
             # Убедитесь, что None значения фильтруются
             data = [item for item in serializer.data if item is not None]
-            return self.get_paginated_response(data)
+            response = self.get_paginated_response(data)
+            if with_facets:
+                response.data['facets'] = self.get_facets()
+            return response
 
         serializer = self.get_serializer(queryset, many=True)
         data = [item for item in serializer.data if item is not None]
+        if with_facets:
+            return Response({'products': data, 'facets': self.get_facets()})
         return Response(data)
 
 
 class TopProductListView(generics.ListAPIView):
     serializer_class = ProductListSerializer
+    featured_count = 15
 
     def get_queryset(self):
-        # Сначала фильтруем продукты с изображениями
-        queryset = Product.objects.annotate(image_count=models.Count('images')).filter(
-            is_top=True,
-            image_count__gt=0
-        ).distinct()
-
-        # Применяем случайный порядок и срезку
-        queryset = queryset.order_by('?')[:15]
-
-        return queryset
+        # Случайная выборка из пула топ-продуктов; с seed порядок стабилен и page листает ту же выборку
+        seed = self.request.query_params.get('seed')
+        try:
+            page = max(int(self.request.query_params.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        offset = (page - 1) * self.featured_count if seed else 0
+        return get_featured_products(Product.objects.all(), TOP_PRODUCTS_POOL, self.featured_count, seed, offset)
 
 
 class NewProductListView(generics.ListAPIView):
@@ -153,12 +192,20 @@ class NewProductListView(generics.ListAPIView):
 class SimilarProductsView(generics.ListAPIView):
     serializer_class = ProductListSerializer
 
+    count = 10
+
     def get_queryset(self):
         product_id = self.kwargs.get('product_id')
+        # Таблица похожих продуктов заполняется командой rebuild_similar_products
+        products = list(
+            Product.objects.filter(similar_to__product_id=product_id).order_by('similar_to__rank')[:self.count]
+        )
+        if products:
+            return products
         product = get_object_or_404(Product, pk=product_id)
         queryset = Product.objects.filter(
             category=product.category,
-        ).exclude(pk=product_id).distinct()[:10]
+        ).exclude(pk=product_id).distinct()[:self.count]
         return queryset
 
     def list(self, request, *args, **kwargs):
@@ -169,6 +216,30 @@ class SimilarProductsView(generics.ListAPIView):
         return Response(data)
 
 
+class BoughtTogetherProductsView(generics.ListAPIView):
+    serializer_class = ProductListSerializer
+
+    count = 10
+
+    def get_queryset(self):
+        product_id = self.kwargs.get('product_id')
+        # Таблица заполняется командой rebuild_bought_together и обновляется при оформлении заказов
+        products = list(
+            Product.objects.filter(
+                bought_with__product_id=product_id,
+                active=True
+            ).order_by('bought_with__rank')[:self.count]
+        )
+        if not products:
+            get_object_or_404(Product, pk=product_id)
+        return products
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        data = [item for item in serializer.data if item is not None]
+        return Response(data)
+
+
 class ProductDetailView(generics.RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
@@ -185,8 +256,8 @@ class ProductDetailView(generics.RetrieveAPIView):
             return Response({"detail": "Продукт не существует."}, status=404)
         user = request.user
 
-        if user.is_authenticated:
-            ProductView.objects.get_or_create(product=instance, user=user)
+        # Просмотр записывается в БД пачкой вместе с другими (namito.catalog.tracking)
+        product_view_buffer.record(instance.pk, user.pk if user.is_authenticated else None)
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
@@ -241,6 +312,7 @@ class ImageDetailView(generics.RetrieveAPIView):
 class UserReviewListView(generics.ListAPIView):
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = ReviewKeysetPagination
 
     def get_queryset(self):
         queryset = Review.objects.all()
@@ -254,6 +326,7 @@ class UserReviewListView(generics.ListAPIView):
 
 class ProductReviewListView(generics.ListAPIView):
     serializer_class = ReviewSerializer
+    pagination_class = ReviewKeysetPagination
 
     def get_queryset(self):
         product_id = self.kwargs.get('pk')
@@ -273,16 +346,18 @@ class ProductReviewListView(generics.ListAPIView):
             return Response({"detail": "Продукт с указанным идентификатором не найден."}, status=404)
 
         queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        response_data = serializer.data
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response_data = self.get_paginated_response(serializer.data).data
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response_data = {'reviews': serializer.data}
 
         # Add review_allowed field to the response
-        review_allowed = self.get_review_allowed(product)
+        response_data['review_allowed'] = self.get_review_allowed(product)
 
-        return Response({
-            'reviews': response_data,
-            'review_allowed': review_allowed
-        })
+        return Response(response_data)
 
     def get_review_allowed(self, product):
         request = self.request
@@ -369,7 +444,7 @@ class FavoriteListView(generics.ListAPIView):
 
     def get_queryset(self):
         user = self.request.user
-        return Favorite.objects.filter(user=user)
+        return Favorite.objects.filter(user=user).select_related('product')
 
 
 class SizeChartListView(generics.ListAPIView):
@@ -388,22 +463,44 @@ class SizeChartListView(generics.ListAPIView):
         return queryset
 
 
-class CategoryBySlugAPIView(generics.ListAPIView):
+class CategoryProductListView(ProductListView):
+    serializer_class = CategoryProductSerializer
+
+    def get_category(self):
+        if not hasattr(self, '_category'):
+            self._category = Category.objects.filter(slug=self.kwargs.get('slug')).first()
+            if self._category is None:
+                raise Http404("Категория не существует")
+        return self._category
+
+    def get_base_queryset(self):
+        facets = CategoryFacets(self.get_category())
+        return super().get_base_queryset().filter(pk__in=facets.products_with_images.values('pk'))
+
+    def get_index_base(self):
+        return {'category_slug': self.get_category().slug, 'has_images': True}
+
+
+class CategoryBySlugAPIView(CategoryProductListView):
+    def list(self, request, *args, **kwargs):
+        category = self.get_category()
+        context = self.get_serializer_context()
+        context['products'] = super().list(request, *args, **kwargs).data
+        serializer = CategoryBySlugSerializer(category, context=context)
+        return Response([serializer.data])
+
+
+class CategoryFacetsAPIView(generics.RetrieveAPIView):
     queryset = Category.objects.all()
-    serializer_class = CategoryBySlugSerializer
+    serializer_class = CategoryFacetsSerializer
     lookup_field = 'slug'
 
-    def get_queryset(self):
+    def get_object(self):
         slug = self.kwargs.get('slug')
-        queryset = Category.objects.filter(slug=slug)
-        if not queryset.exists():
+        try:
+            return self.get_queryset().get(slug=slug)
+        except Category.DoesNotExist:
             raise Http404("Категория не существует")
-        return queryset
-
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context['request'] = self.request
-        return context
 
 
 class CategoryByNameStartsWithAPIView(generics.ListAPIView):
@@ -425,44 +522,61 @@ class CategoryByNameStartsWithAPIView(generics.ListAPIView):
 class ProductSearchByNameAndBrandAPIView(generics.ListAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductListSerializer
+    pagination_class = ProductSearchKeysetPagination
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
-        language_code = self.request.LANGUAGE_CODE
+    fuzzy = False
 
-        search_query = self.request.query_params.get('name')
-        brand_query = self.request.query_params.get('brand')
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(stats__image_count__gt=0)
+        texts = [self.request.query_params.get('name'), self.request.query_params.get('brand')]
+        if self.fuzzy:
+            # опечатки и латиница вместо кириллицы
+            return fuzzy_search_products(queryset, *texts)
+        return search_products(queryset, self.request.LANGUAGE_CODE, *texts)
 
-        if search_query is None and brand_query is None:
-            return queryset.none()
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        texts = [request.query_params.get('name'), request.query_params.get('brand')]
+        if any(texts) and not self.get_products(response):
+            # Нечеткий поиск - только если полнотекстовый ничего не нашел, без лишнего запроса exists()
+            self.fuzzy = True
+            response = super().list(request, *args, **kwargs)
+        # Успешные запросы (первая страница) попадают в подсказки
+        if self.get_products(response) and not request.query_params.get('cursor'):
+            user = request.user
+            client = user.pk if user.is_authenticated else request.META.get('REMOTE_ADDR')
+            search_query_buffer.record(request.query_params.get('name'), client)
+        return response
 
-        filters = Q()
+    def get_products(self, response):
+        # С параметром cursor ответ - словарь, который не пуст и без найденных продуктов
+        if isinstance(response.data, dict):
+            return response.data.get('products', response.data)
+        return response.data
 
-        if search_query:
-            product_translation_opts = translator.get_options_for_model(Product)
-            for field in product_translation_opts.fields:
-                translated_field = f"{field}_{language_code}"
-                filters |= Q(**{f"{translated_field}__icontains": search_query})
 
-        if brand_query:
-            brand_translation_opts = translator.get_options_for_model(Brand)
-            for field in brand_translation_opts.fields:
-                translated_field = f"brand__{field}_{language_code}"
-                filters |= Q(**{f"{translated_field}__icontains": brand_query})
+class SuggestAPIView(APIView):
+    max_limit = 20
 
-        queryset = queryset.filter(filters).filter(images__isnull=False).distinct()
-        return queryset
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), self.max_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer.'}) from None
+        return Response(suggest_index.suggest(request.query_params.get('q'), request.LANGUAGE_CODE, limit))
 
 
 class ColorSizeBrandAPIView(generics.ListAPIView):
     serializer_class = ColorSizeBrandSerializer
 
     def list(self, request, *args, **kwargs):
-        colors = Color.objects.all()
-        sizes = Size.objects.all()
-        brands = Brand.objects.all()
-        serializer = self.get_serializer({'colors': colors, 'sizes': sizes, 'brands': brands})
-        return Response(serializer.data)
+        def build():
+            colors = Color.objects.all()
+            sizes = Size.objects.all()
+            brands = Brand.objects.all()
+            return self.get_serializer({'colors': colors, 'sizes': sizes, 'brands': brands}).data
+
+        return Response(get_cached_response_data('color-size-brand', [Color, Size, Brand], request, build))
 
 
 class DiscountAPIView(generics.ListAPIView):
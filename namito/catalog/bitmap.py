@@ -0,0 +1,361 @@
+import copy
+import math
+import threading
+import time
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+
+from namito.catalog.cache import bump_version, get_version
+
+INDEX_VERSION = 'catalog.index'
+CHANGE_TIMEOUT = 60 * 60
+# Запись журнала, после которой индекс перестраивается целиком (изменились категории, бренды, размеры)
+FULL_REBUILD = 0
+PRICE_BANDS = (0, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+
+def record_index_change(product_id=None):
+    """Журнал изменений для индексов других воркеров: версия -> id продукта."""
+    version = bump_version(INDEX_VERSION)
+    cache.set(f'catalog:index-change:{version}', product_id or FULL_REBUILD, CHANGE_TIMEOUT)
+
+
+def schedule_index_change(product_id=None):
+    # После коммита: иначе другой воркер может перечитать продукт до записи изменений
+    transaction.on_commit(lambda: record_index_change(product_id))
+
+
+def load_rows(product_ids=None):
+    from namito.catalog.models import Category, Product, Variant
+
+    products = Product.objects.all()
+    variants = Variant.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        variants = variants.filter(product_id__in=product_ids)
+    rows = {
+        row[0]: row for row in products.values_list(
+            'pk', 'active', 'category__tree_id', 'category__lft', 'category__rght', 'brand__name',
+            'min_price', 'max_price', 'stats__average_rating', 'stats__image_count'
+        ).iterator(chunk_size=10000)
+    }
+    variant_rows = {}
+    for product_id, *variant in variants.values_list(
+        'product_id', 'color_id', 'size__name', 'discount_value', 'discount_type', 'stock'
+    ).iterator(chunk_size=10000):
+        variant_rows.setdefault(product_id, []).append(variant)
+    categories = None
+    if product_ids is None:
+        categories = {slug: bounds for slug, *bounds in Category.objects.values_list('slug', 'tree_id', 'lft', 'rght')}
+    return rows, variant_rows, categories
+
+
+class _Snapshot:
+    """
+    Колонки атрибутов продуктов, позиция в массивах - порядковый номер продукта по id.
+    Многозначные атрибуты вариантов (цвет, размер) - булевы матрицы значение x продукт,
+    цены дополнительно хранятся отсортированными для поиска диапазона.
+    """
+
+    def __init__(self, rows, variant_rows, categories):
+        self.ids = np.array(sorted(rows), dtype=np.int64)
+        self.positions = {pk: position for position, pk in enumerate(self.ids.tolist())}
+        self.categories = categories
+        size = len(self.ids)
+        self.active = np.zeros(size, dtype=bool)
+        self.has_variants = np.zeros(size, dtype=bool)
+        self.has_images = np.zeros(size, dtype=bool)
+        self.in_stock = np.zeros(size, dtype=bool)
+        self.discount = np.zeros(size, dtype=bool)
+        self.tree = np.zeros(size, dtype=np.int64)
+        self.lft = np.zeros(size, dtype=np.int64)
+        self.rght = np.zeros(size, dtype=np.int64)
+        self.brand = np.full(size, -1, dtype=np.int64)
+        self.min_price = np.zeros(size, dtype=np.int64)
+        self.max_price = np.zeros(size, dtype=np.int64)
+        self.rating = np.full(size, np.nan, dtype=np.float64)
+        self.brands, self.colors, self.sizes = {}, {}, {}
+        self.color_matrix = np.zeros((0, size), dtype=bool)
+        self.size_matrix = np.zeros((0, size), dtype=bool)
+
+        colors = {variant[0] for variants in variant_rows.values() for variant in variants}
+        sizes = {variant[1] for variants in variant_rows.values() for variant in variants}
+        self.add_values(self.colors, 'color_matrix', sorted(colors))
+        self.add_values(self.sizes, 'size_matrix', sorted(sizes, key=str))
+        for pk, position in self.positions.items():
+            self.set_row(position, rows[pk], variant_rows.get(pk, ()))
+        self.sort_prices()
+
+    def copy(self):
+        """Независимая копия: изменения применяются к ней, читатели продолжают работать со старым снимком."""
+        snapshot = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, np.ndarray):
+                setattr(snapshot, name, value.copy())
+            elif isinstance(value, dict):
+                setattr(snapshot, name, dict(value))
+        return snapshot
+
+    def add_values(self, keys, matrix_name, values):
+        values = [value for value in values if value not in keys]
+        if values:
+            for value in values:
+                keys[value] = len(keys)
+            matrix = getattr(self, matrix_name)
+            setattr(self, matrix_name, np.vstack([matrix, np.zeros((len(values), matrix.shape[1]), dtype=bool)]))
+
+    def set_row(self, position, row, variants):
+        pk, active, tree, lft, rght, brand, min_price, max_price, rating, image_count = row
+        self.active[position] = active
+        self.has_variants[position] = bool(variants)
+        self.has_images[position] = bool(image_count)
+        self.tree[position], self.lft[position], self.rght[position] = tree, lft, rght
+        if brand is not None and brand not in self.brands:
+            self.brands[brand] = len(self.brands)
+        self.brand[position] = self.brands[brand] if brand is not None else -1
+        self.min_price[position], self.max_price[position] = min_price, max_price
+        self.rating[position] = rating if rating is not None else np.nan
+
+        self.add_values(self.colors, 'color_matrix', [variant[0] for variant in variants])
+        self.add_values(self.sizes, 'size_matrix', [variant[1] for variant in variants])
+        self.color_matrix[:, position] = False
+        self.size_matrix[:, position] = False
+        self.in_stock[position] = self.discount[position] = False
+        for color, size, discount_value, discount_type, stock in variants:
+            self.color_matrix[self.colors[color], position] = True
+            self.size_matrix[self.sizes[size], position] = True
+            self.in_stock[position] |= bool(stock and stock > 0)
+            self.discount[position] |= bool(discount_value and discount_value > 0 and discount_type is not None)
+
+    def clear_row(self, position):
+        self.active[position] = False
+
+    def sort_prices(self):
+        self.min_price_order = np.argsort(self.min_price, kind='stable')
+        self.min_price_sorted = self.min_price[self.min_price_order]
+        self.max_price_order = np.argsort(self.max_price, kind='stable')
+        self.max_price_sorted = self.max_price[self.max_price_order]
+
+    def values_mask(self, keys, matrix, values):
+        rows = [keys[value] for value in values if value in keys]
+        if not rows:
+            return np.zeros(len(self.ids), dtype=bool)
+        return np.logical_or.reduce(matrix[rows], axis=0)
+
+    def masks(self, params):
+        """Маска для каждого параметра фильтра; параметры уже приведены к типам индекса."""
+        masks = {}
+        for name, value in params.items():
+            if name == 'category_slug':
+                bounds = self.categories.get(value)
+                if bounds is None:
+                    mask = np.zeros(len(self.ids), dtype=bool)
+                else:
+                    tree, lft, rght = bounds
+                    mask = (self.tree == tree) & (self.lft >= lft) & (self.rght <= rght)
+            elif name == 'brand':
+                mask = np.isin(self.brand, [self.brands[brand] for brand in value if brand in self.brands])
+            elif name == 'color':
+                mask = self.values_mask(self.colors, self.color_matrix, value)
+            elif name == 'size':
+                mask = self.values_mask(self.sizes, self.size_matrix, value)
+            elif name in ('has_discount', 'in_stock', 'has_images'):
+                column = {'has_discount': self.discount, 'in_stock': self.in_stock, 'has_images': self.has_images}[name]
+                mask = column if value else ~column
+            elif name == 'min_price':
+                mask = np.zeros(len(self.ids), dtype=bool)
+                mask[self.min_price_order[np.searchsorted(self.min_price_sorted, value, 'left'):]] = True
+            elif name == 'max_price':
+                mask = np.zeros(len(self.ids), dtype=bool)
+                mask[self.max_price_order[:np.searchsorted(self.max_price_sorted, value, 'right')]] = True
+            elif name == 'min_rating':
+                mask = self.rating >= value
+            else:
+                raise KeyError(name)
+            masks[name] = mask
+        return masks
+
+    def base_mask(self, base_params):
+        mask = self.active & self.has_variants
+        for value in self.masks(base_params).values():
+            mask &= value
+        return mask
+
+
+class CatalogIndex:
+    """
+    Колоночный индекс атрибутов каталога в памяти воркера для ProductFilter и фасетов.
+    Изменения продуктов записываются в журнал в кэше (record_index_change), каждый
+    воркер не чаще check_interval сверяет версию журнала и перечитывает только
+    измененные продукты, а раз в rebuild_interval перестраивает индекс целиком.
+    Снимок после построения не меняется: изменения применяются к копии, и ссылка
+    на нее подменяется, поэтому читатели работают без блокировки.
+    Пока индекс не построен, фильтры работают через SQL.
+    """
+    check_interval = 5
+    # Страховка от потерянных записей журнала (вытеснение ключей, запись мимо сигналов)
+    rebuild_interval = 60 * 60
+    max_changes = 1000
+    # При большем числе совпадений фильтр в SQL выгоднее, чем список id в запросе
+    max_ids = 5000
+    dimensions = {
+        'color': ('color',),
+        'size': ('size',),
+        'brand': ('brand',),
+        'rating': ('min_rating',),
+        'price': ('min_price', 'max_price'),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0
+        self._built_at = 0
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    def build(self):
+        with self._build_lock:
+            started = time.time()
+            version = get_version(INDEX_VERSION)
+            snapshot = _Snapshot(*load_rows())
+            with self._lock:
+                self._snapshot = snapshot
+                self._version = version
+                self._checked_at = self._built_at = started
+
+    def warm_up(self):
+        if not self._build_lock.locked():
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def refresh(self):
+        now = time.time()
+        if not self.ready or now - self._checked_at < self.check_interval or self._build_lock.locked():
+            return
+        self._checked_at = now
+        if now - self._built_at > self.rebuild_interval:
+            self.warm_up()
+            return
+        version = get_version(INDEX_VERSION)
+        if version == self._version:
+            return
+        if not 0 < version - self._version <= self.max_changes:
+            self.warm_up()
+            return
+        keys = [f'catalog:index-change:{number}' for number in range(self._version + 1, version + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys) or FULL_REBUILD in changes.values():
+            self.warm_up()
+            return
+        self.update_products(set(changes.values()), version)
+
+    def update_products(self, product_ids, version):
+        rows, variant_rows, categories = load_rows(product_ids)
+        with self._lock:
+            if self._version is None or self._version >= version:
+                # индекс успели перестроить или обновить другим потоком
+                return False
+            if any(pk not in self._snapshot.positions for pk in rows):
+                # новый продукт меняет размер массивов - проще перестроить индекс
+                self.warm_up()
+                return False
+            snapshot = self._snapshot.copy()
+            for pk in product_ids:
+                position = snapshot.positions.get(pk)
+                if position is None:
+                    continue
+                if pk in rows:
+                    snapshot.set_row(position, rows[pk], variant_rows.get(pk, ()))
+                else:
+                    snapshot.clear_row(position)
+            snapshot.sort_prices()
+            self._snapshot = snapshot
+            self._version = version
+        return True
+
+    def resolve(self, params, base_params=None):
+        """Отсортированный список id продуктов, подходящих под params, или None, если нужен SQL."""
+        self.refresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        mask = snapshot.base_mask(base_params or {})
+        for value in snapshot.masks(params).values():
+            mask &= value
+        product_ids = snapshot.ids[mask]
+        if len(product_ids) > self.max_ids:
+            return None
+        return product_ids.tolist()
+
+    def facets(self, params, base_params=None):
+        """Счетчики фасетов в формате ProductFacets.get_counts или None, если индекс не готов."""
+        self.refresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        base = snapshot.base_mask(base_params or {})
+        masks = snapshot.masks(params)
+
+        def matched(dimension):
+            mask = base.copy()
+            for name, value in masks.items():
+                if name not in self.dimensions[dimension]:
+                    mask &= value
+            return mask
+
+        colors = np.count_nonzero(snapshot.color_matrix & matched('color'), axis=1)
+        sizes = np.count_nonzero(snapshot.size_matrix & matched('size'), axis=1)
+        brand_mask = matched('brand') & (snapshot.brand >= 0)
+        brands = np.bincount(snapshot.brand[brand_mask], minlength=len(snapshot.brands))
+        ratings = snapshot.rating[matched('rating')]
+        ratings = np.floor(ratings[ratings > 0]).astype(np.int64)
+        bands = np.searchsorted(PRICE_BANDS[1:], snapshot.min_price[matched('price')], 'right')
+        rating_values, rating_counts = np.unique(ratings, return_counts=True)
+        band_values, band_counts = np.unique(bands, return_counts=True)
+
+        brand_names = {index: name for name, index in snapshot.brands.items()}
+        return {
+            'color': {color: int(colors[row]) for color, row in snapshot.colors.items() if colors[row]},
+            'size': {size: int(sizes[row]) for size, row in snapshot.sizes.items() if sizes[row]},
+            'brand': {brand_names[index]: int(count) for index, count in enumerate(brands) if count},
+            'rating': {int(value): int(count) for value, count in zip(rating_values, rating_counts, strict=True)},
+            'price': {int(value): int(count) for value, count in zip(band_values, band_counts, strict=True)},
+        }
+
+
+def to_index_params(params):
+    """
+    Приводит очищенные значения ProductFilter к параметрам индекса. Возвращает
+    None, если какой-то параметр индекс не поддерживает (например, поиск по имени).
+    """
+    result = {}
+    for name, value in params.items():
+        if name in ('brand', 'size'):
+            result[name] = [item.strip() for item in value.split(',') if item.strip()]
+        elif name in ('color', 'color_id'):
+            if 'color' in result:
+                # два параметра цвета в SQL - два условия через AND, в индексе одно
+                return None
+            try:
+                result['color'] = [int(item) for item in value.split(',') if item.strip()]
+            except ValueError:
+                return None
+        elif name in ('min_price', 'max_price', 'min_rating'):
+            value = float(value)
+            if not math.isfinite(value):
+                return None
+            result[name] = value
+        elif name in ('category_slug', 'has_discount', 'in_stock'):
+            result[name] = value
+        else:
+            return None
+    return result
+
+
+catalog_index = CatalogIndex()
@@ -0,0 +1,71 @@
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.utils.translation import get_language
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_version(name):
+    # Начальное значение - время, чтобы после вытеснения ключа не вернуться к старым версиям
+    return cache.get_or_set(f'version:{name}', time.time_ns, None)
+
+
+def get_versions(names):
+    keys = [f'version:{name}' for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_version(name):
+    try:
+        return cache.incr(f'version:{name}')
+    except ValueError:
+        version = time.time_ns()
+        cache.set(f'version:{name}', version, None)
+        return version
+
+
+def get_catalog_version():
+    return get_version('catalog')
+
+
+def bump_catalog_version():
+    bump_version('catalog')
+
+
+def get_model_version_name(model):
+    return model._meta.label_lower
+
+
+def bump_model_version(sender, **kwargs):
+    bump_version(get_model_version_name(sender))
+
+
+def track_model_versions(*models):
+    """Версия модели (app_label.model) меняется при каждом post_save/post_delete."""
+    for model in models:
+        name = get_model_version_name(model)
+        post_save.connect(bump_model_version, sender=model, dispatch_uid=f'version:{name}:save')
+        post_delete.connect(bump_model_version, sender=model, dispatch_uid=f'version:{name}:delete')
+
+
+def get_cached_response_data(name, models, request, build, timeout=RESPONSE_CACHE_TIMEOUT):
+    """
+    Данные ответа из кэша. Ключ - имя представления, язык, адрес сайта и версии
+    моделей, из которых собран ответ, поэтому изменение любой из них дает новый ключ.
+    """
+    versions = get_versions([get_model_version_name(model) for model in models])
+    key = ':'.join(map(str, [
+        'response', name, get_language(), request.build_absolute_uri('/'), *versions
+    ]))
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, timeout)
+    return data
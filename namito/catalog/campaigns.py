@@ -0,0 +1,121 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from namito.catalog.bitmap import schedule_index_change
+from namito.catalog.cache import bump_catalog_version
+from namito.catalog.pricing import discounted_price_expression, own_price_expression, update_price_ranges
+
+# Вариантов в одной транзакции: блокировки строк держатся доли секунды, а не всю акцию
+CAMPAIGN_BATCH_SIZE = 5000
+
+
+def update_variants(variants, batch_size=CAMPAIGN_BATCH_SIZE, **values):
+    """
+    UPDATE вариантов пачками по id, каждая пачка - отдельная транзакция вместе
+    с пересчетом диапазона цен ее продуктов. Возвращает число измененных вариантов.
+    """
+    from namito.catalog.models import Product
+
+    variant_ids = list(variants.order_by('pk').values_list('pk', flat=True))
+    updated = 0
+    for start in range(0, len(variant_ids), batch_size):
+        batch = variants.filter(pk__in=variant_ids[start:start + batch_size])
+        with transaction.atomic():
+            product_ids = list(batch.order_by().values_list('product_id', flat=True).distinct())
+            changed = batch.update(**values)
+            if changed:
+                updated += changed
+                update_price_ranges(Product.objects.filter(pk__in=product_ids))
+    return updated
+
+
+def invalidate_prices():
+    # Цены менялись без сигналов: сбрасываем кэш списков и перестраиваем индекс атрибутов
+    transaction.on_commit(bump_catalog_version)
+    schedule_index_change()
+
+
+def apply_campaign(campaign, batch_size=CAMPAIGN_BATCH_SIZE):
+    """
+    Ставит цену акции вариантам ее продуктов, если она ниже текущей. Повторный
+    вызов ничего не меняет, поэтому активные акции применяются при каждом запуске
+    планировщика - так скидку получают и варианты, добавленные после старта.
+    """
+    from namito.catalog.models import Variant
+
+    price = discounted_price_expression(campaign.discount_type, campaign.discount_value)
+    variants = Variant.objects.filter(product__in=campaign.get_products().values('pk')).filter(
+        Q(discounted_price__isnull=True) | Q(discounted_price__gt=price)
+    )
+    return update_variants(variants, batch_size, campaign=campaign, discounted_price=price)
+
+
+def withdraw_campaign(campaign, batch_size=CAMPAIGN_BATCH_SIZE):
+    """Возвращает вариантам акции их собственную цену со скидкой."""
+    return update_variants(campaign.variants.all(), batch_size, campaign=None, discounted_price=own_price_expression())
+
+
+def withdraw_variants(variant_ids, batch_size=CAMPAIGN_BATCH_SIZE):
+    """
+    Возвращает собственную цену вариантам удаленной акции. Вызывается после
+    коммита удаления, когда campaign у них уже NULL.
+    """
+    from namito.catalog.models import Variant
+
+    variants = Variant.objects.filter(pk__in=variant_ids, campaign__isnull=True)
+    updated = update_variants(variants, batch_size, discounted_price=own_price_expression())
+    if updated:
+        invalidate_prices()
+    return updated
+
+
+def refresh_campaign(campaign, batch_size=CAMPAIGN_BATCH_SIZE):
+    """
+    Приводит цены вариантов с этой акцией к ее текущим условиям после правки
+    в админке. Меняются только разошедшиеся цены, поэтому скидка не пропадает
+    на время пересчета: вышедшие из акции варианты получают свою цену, остальные -
+    новую цену акции, если она выгоднее собственной.
+    """
+    products = campaign.get_products().values('pk')
+    variants = campaign.variants.all()
+    updated = update_variants(variants.exclude(product__in=products), batch_size, campaign=None,
+                              discounted_price=own_price_expression())
+    price = Least(own_price_expression(), discounted_price_expression(campaign.discount_type, campaign.discount_value))
+    return updated + update_variants(variants.filter(product__in=products).exclude(discounted_price=price),
+                                     batch_size, discounted_price=price)
+
+
+def run_discount_campaigns(now=None, batch_size=CAMPAIGN_BATCH_SIZE):
+    """
+    Завершает истекшие акции, запускает наступившие и применяет все активные
+    с их текущими условиями. Пересекающиеся акции не суммируются: вариант
+    получает самую низкую цену.
+    Возвращает (запущено, завершено, изменено вариантов).
+    """
+    from namito.catalog.models import DiscountCampaign
+
+    now = now or timezone.now()
+    updated = 0
+    finished = list(DiscountCampaign.objects.filter(status=DiscountCampaign.ACTIVE, ends_at__lte=now))
+    for campaign in finished:
+        updated += withdraw_campaign(campaign, batch_size)
+        campaign.status = DiscountCampaign.FINISHED
+        campaign.save(update_fields=['status'])
+    finished = len(finished) + DiscountCampaign.objects.filter(
+        status=DiscountCampaign.SCHEDULED, ends_at__lte=now
+    ).update(status=DiscountCampaign.FINISHED)
+    started = DiscountCampaign.objects.filter(
+        status=DiscountCampaign.SCHEDULED, starts_at__lte=now, ends_at__gt=now
+    ).update(status=DiscountCampaign.ACTIVE)
+
+    campaigns = list(DiscountCampaign.objects.filter(status=DiscountCampaign.ACTIVE).order_by('pk'))
+    for campaign in campaigns:
+        updated += refresh_campaign(campaign, batch_size)
+    # Варианты, которые refresh_campaign вернул к своей цене, могут получить другую акцию
+    for campaign in campaigns:
+        updated += apply_campaign(campaign, batch_size)
+    if updated:
+        invalidate_prices()
+    return started, finished, updated
@@ -0,0 +1,62 @@
+import random
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from namito.catalog.cache import get_catalog_version
+
+FEATURED_POOL_TIMEOUT = 60 * 10
+# Пулы топ-продуктов: у каждой выдачи свой отбор
+TOP_PRODUCTS_POOL = 'top-products'
+MAIN_PAGE_POOL = 'main-page'
+
+
+def get_featured_queryset(pool):
+    from namito.catalog.models import Product, Variant
+    queryset = Product.objects.filter(is_top=True)
+    if pool == TOP_PRODUCTS_POOL:
+        # TopProductListView: топ-продукты с изображениями
+        return queryset.filter(stats__image_count__gt=0)
+    # Главная страница: топ-продукты в наличии
+    return queryset.filter(Exists(Variant.objects.filter(product=OuterRef('pk'), stock__gt=0)))
+
+
+def get_featured_pool(pool):
+    """
+    Отсортированный список id продуктов пула. Ключ включает версию каталога: после
+    изменения продуктов пул строится заново одним запросом, а не правится на месте.
+    """
+    key = f'catalog:featured-pool:{pool}:{get_catalog_version()}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(get_featured_queryset(pool).order_by('pk').values_list('pk', flat=True))
+        cache.set(key, ids, FEATURED_POOL_TIMEOUT)
+    return ids
+
+
+def sample_featured_ids(pool, count=None, seed=None, offset=0):
+    """
+    Случайные id из пула за O(offset + count): частичная перетасовка Фишера-Йетса,
+    где переставленные позиции хранятся в словаре. С одинаковым seed порядок
+    одинаковый, поэтому offset дает следующую страницу той же выборки.
+    count=None - весь пул.
+    """
+    ids = get_featured_pool(pool)
+    if count is None:
+        count = len(ids)
+    rng = random.Random(seed) if seed is not None else random
+    swaps = {}
+    result = []
+    for index in range(min(offset + count, len(ids))):
+        other = rng.randrange(index, len(ids))
+        value = swaps.get(other, other)
+        swaps[other] = swaps.get(index, index)
+        if index >= offset:
+            result.append(ids[value])
+    return result
+
+
+def get_featured_products(queryset, pool, count=None, seed=None, offset=0):
+    ids = sample_featured_ids(pool, count, seed, offset)
+    products = {product.pk: product for product in queryset.filter(pk__in=ids)}
+    return [products[pk] for pk in ids if pk in products]
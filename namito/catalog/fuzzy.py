@@ -0,0 +1,185 @@
+import re
+import threading
+import time
+
+import numpy as np
+from django.db.models import Case, IntegerField, Value, When
+from unidecode import unidecode
+
+
+def normalize(text):
+    # Кириллица и латиница сводятся к одной транслитерации: "кроссовки" и "krossovki" совпадают
+    return re.findall(r'[a-z0-9]+', unidecode(text or '').lower())
+
+
+def trigrams(text):
+    result = set()
+    for word in normalize(text):
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+def product_terms(row):
+    """Названия продукта на обоих языках, бренд и категория - отдельные термы."""
+    pk, *names = row
+    return pk, [terms for terms in {frozenset(trigrams(name)) for name in names if name} if terms]
+
+
+class _Snapshot:
+    """Неизменяемая часть индекса: массивы NumPy, построенные за один проход по таблице."""
+
+    def __init__(self, rows):
+        term_products, term_sizes, pairs = [], [], {}
+        self.slices = {}
+        for pk, terms in map(product_terms, rows):
+            start = len(term_products)
+            for terms_set in terms:
+                term_id = len(term_products)
+                term_products.append(pk)
+                term_sizes.append(len(terms_set))
+                for trigram in terms_set:
+                    pairs.setdefault(trigram, []).append(term_id)
+            self.slices[pk] = (start, len(term_products))
+        self.term_products = np.array(term_products, dtype=np.int64)
+        self.term_sizes = np.array(term_sizes, dtype=np.float32)
+        self.postings = {trigram: np.array(ids, dtype=np.int32) for trigram, ids in pairs.items()}
+        self.alive = np.ones(len(term_products), dtype=bool)
+
+
+class FuzzyProductIndex:
+    """
+    Триграммный индекс названий продуктов, брендов и категорий в памяти процесса.
+    Строится в фоне при старте воркера, до этого поиск ничего не находит.
+    Изменения продуктов попадают в небольшой overlay до следующей полной перестройки.
+
+    Оценка - доля триграмм запроса, найденных в терме (coverage), при равенстве -
+    сходство Жаккара.
+    """
+    min_coverage = 0.45
+    rebuild_interval = 60 * 10
+    overlay_limit = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot = None
+        self._overlay = {}
+        self._built_at = 0
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    def get_rows(self, product_ids=None):
+        from namito.catalog.models import Product
+        queryset = Product.objects.all()
+        if product_ids is not None:
+            queryset = queryset.filter(pk__in=product_ids)
+        return queryset.values_list(
+            'pk', 'name_ru', 'name_en', 'brand__name', 'category__name_ru', 'category__name_en'
+        ).iterator(chunk_size=5000)
+
+    def build(self):
+        with self._build_lock:
+            started = time.time()
+            snapshot = _Snapshot(self.get_rows())
+            with self._lock:
+                # изменения, пришедшие во время построения, могли не попасть в snapshot - оставляем их в overlay
+                self._overlay = {pk: item for pk, item in self._overlay.items() if item[0] >= started}
+                for pk in self._overlay:
+                    start, end = snapshot.slices.get(pk, (0, 0))
+                    snapshot.alive[start:end] = False
+                self._snapshot = snapshot
+                self._built_at = started
+
+    def warm_up(self):
+        if not self._build_lock.locked():
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def update_products(self, product_ids):
+        if not self.ready:
+            return
+        updated_at = time.time()
+        rows = dict(map(product_terms, self.get_rows(product_ids)))
+        with self._lock:
+            for pk in product_ids:
+                start, end = self._snapshot.slices.get(pk, (0, 0))
+                self._snapshot.alive[start:end] = False
+                self._overlay[pk] = (updated_at, rows.get(pk))
+            overflow = len(self._overlay) > self.overlay_limit
+        if overflow:
+            self.warm_up()
+
+    def remove_products(self, product_ids):
+        if not self.ready:
+            return
+        with self._lock:
+            for pk in product_ids:
+                start, end = self._snapshot.slices.get(pk, (0, 0))
+                self._snapshot.alive[start:end] = False
+                self._overlay[pk] = (time.time(), None)
+
+    def search(self, text, limit=50):
+        """Список id продуктов, от наиболее похожих."""
+        query = trigrams(text)
+        if not query:
+            return []
+        if not self.ready:
+            # Полное построение занимает секунды: запрос его не ждет
+            self.warm_up()
+            return []
+        if time.time() - self._built_at > self.rebuild_interval and not self._build_lock.locked():
+            # Другие воркеры не получают сигналы этого процесса, поэтому индекс периодически перестраивается
+            self._built_at = time.time()
+            self.warm_up()
+
+        with self._lock:
+            snapshot = self._snapshot
+            alive = snapshot.alive.copy()
+            overlay = list(self._overlay.items())
+
+        scores = {}
+        arrays = [snapshot.postings[trigram] for trigram in query if trigram in snapshot.postings]
+        if arrays:
+            shared = np.bincount(np.concatenate(arrays), minlength=len(snapshot.term_products)).astype(np.float32)
+            shared[~alive] = 0
+            coverage = shared / len(query)
+            candidates = np.flatnonzero(coverage >= self.min_coverage)
+            if len(candidates):
+                similarity = shared[candidates] / (len(query) + snapshot.term_sizes[candidates] - shared[candidates])
+                score = coverage[candidates] + similarity / 10
+                # у продукта не больше пяти термов, поэтому limit * 5 лучших термов хватает на limit продуктов
+                if len(score) > limit * 5:
+                    top = np.argpartition(-score, limit * 5)[:limit * 5]
+                    candidates, score = candidates[top], score[top]
+                order = np.argsort(-score, kind='stable')
+                products = snapshot.term_products[candidates[order]].tolist()
+                for pk, value in zip(products, score[order].tolist(), strict=True):
+                    if pk not in scores:
+                        scores[pk] = value
+
+        for pk, (_, terms) in overlay:
+            for terms_set in terms or ():
+                shared = len(query & terms_set)
+                if shared / len(query) >= self.min_coverage:
+                    value = shared / len(query) + shared / len(query | terms_set) / 10
+                    scores[pk] = max(scores.get(pk, 0), value)
+
+        return sorted(scores, key=lambda pk: (-scores[pk], pk))[:limit]
+
+
+fuzzy_index = FuzzyProductIndex()
+
+
+def fuzzy_search_products(queryset, *texts, limit=50):
+    """Продукты из queryset, найденные нечетким поиском, в порядке релевантности."""
+    product_ids = fuzzy_index.search(' '.join(text for text in texts if text), limit=limit)
+    if not product_ids:
+        return queryset.none()
+    return queryset.filter(pk__in=product_ids).annotate(
+        fuzzy_rank=Case(
+            *[When(pk=pk, then=Value(position)) for position, pk in enumerate(product_ids)],
+            output_field=IntegerField()
+        )
+    ).order_by('fuzzy_rank', 'id')
@@ -0,0 +1,161 @@
+import hashlib
+import io
+import logging
+import os
+from multiprocessing import get_context
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import connections
+from PIL import Image as PILImage
+
+from namito.catalog.cache import bump_catalog_version, bump_model_version
+from namito.catalog.renditions import get_dominant_color, get_placeholder, is_complete, render, to_rgb
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые process_file заполняет значениями, а не файлами
+VALUE_FIELDS = ('renditions', 'placeholder', 'dominant_color')
+
+
+def get_processed_models():
+    from namito.catalog.models import ProcessedImageModel
+    return [model for model in apps.get_models() if issubclass(model, ProcessedImageModel)]
+
+
+def get_jobs(model, reprocess=False):
+    """
+    Задания для пула: строки с новым загруженным изображением (image_hash пуст)
+    или, при reprocess, все строки - неизмененные файлы пропустит проверка хэша.
+    """
+    queryset = model.objects.exclude(image='').exclude(image__isnull=True).order_by('pk')
+    if not reprocess:
+        queryset = queryset.filter(image_hash='')
+    fields = ['pk', 'image', 'image_hash', 'renditions', 'placeholder', *model.image_thumbnails]
+    for row in queryset.values_list(*fields).iterator():
+        pk, name, image_hash, renditions, placeholder, *thumbnails = row
+        yield {
+            'model': model._meta.label,
+            'pk': pk,
+            'name': name,
+            'image_hash': image_hash,
+            'renditions': renditions or {},
+            'placeholder': placeholder,
+            'thumbnails': dict(zip(model.image_thumbnails, thumbnails, strict=True)),
+        }
+
+
+def encode_webp(pil_image, quality):
+    output = io.BytesIO()
+    to_rgb(pil_image).save(output, format='WEBP', quality=quality)
+    return output.getvalue()
+
+
+def process_file(job):
+    """
+    Выполняется в дочернем процессе: читает исходный файл, кодирует WEBP (если у модели
+    задан image_quality), миниатюры и размеры из image_renditions и записывает их под
+    новыми именами, считает заглушку и основной цвет. Строки моделей здесь не
+    меняются - замену файлов в строке делает родительский процесс (swap_files).
+    Возвращает (job, хэш, {поле: новое значение}).
+    """
+    model = apps.get_model(job['model'])
+    name = job['name']
+    storage = model._meta.get_field('image').storage
+    try:
+        with storage.open(name, 'rb') as source:
+            data = source.read()
+        if (hashlib.sha256(data).hexdigest() == job['image_hash']
+                and is_complete(job['renditions'], model.image_renditions) and job['placeholder']):
+            # файл не менялся с прошлой обработки
+            return job, job['image_hash'], {}
+        pil_image = PILImage.open(io.BytesIO(data))
+        pil_image.load()
+    except (OSError, ValueError) as e:
+        # Битый или пропавший файл не обрабатываем повторно при каждом запуске
+        logger.error(f"Error processing image {name}: {e}")
+        return job, hashlib.sha256(b'').hexdigest(), {}
+
+    base = os.path.splitext(name)[0]
+    files = {
+        'placeholder': get_placeholder(pil_image),
+        'dominant_color': get_dominant_color(pil_image),
+    }
+    if model.image_quality is not None and pil_image.format != 'WEBP':
+        data = encode_webp(pil_image, model.image_quality)
+        files['image'] = storage.save(f'{base}.webp', ContentFile(data))
+    for field_name, size in model.image_thumbnails.items():
+        thumbnail = pil_image.copy()
+        thumbnail.thumbnail(size)
+        field_storage = model._meta.get_field(field_name).storage
+        files[field_name] = field_storage.save(
+            f'{base}_{field_name}.webp', ContentFile(encode_webp(thumbnail, model.image_quality))
+        )
+    if model.image_renditions:
+        renditions = {}
+        for (rendition, image_format, width), content in render(pil_image, model.image_renditions).items():
+            file_name = storage.save(f'{base}_{rendition}_{width}.{image_format}', ContentFile(content))
+            renditions.setdefault(rendition, {}).setdefault(image_format, {})[str(width)] = file_name
+        files['renditions'] = renditions
+    return job, hashlib.sha256(data).hexdigest(), files
+
+
+def get_file_names(files):
+    """
+    Пары (поле, имя файла); файлы renditions лежат в хранилище поля image.
+    Повторы сохраняются: в ContentAddressedStorage каждое сохранение - отдельная ссылка.
+    """
+    names = [(field_name, name) for field_name, name in files.items() if field_name not in VALUE_FIELDS and name]
+    for formats in files.get('renditions', {}).values():
+        for widths in formats.values():
+            names.extend(('image', name) for name in widths.values())
+    return names
+
+
+def delete_files(model, names):
+    for field_name, name in names:
+        model._meta.get_field(field_name).storage.delete(name)
+
+
+def swap_files(job, image_hash, files):
+    """
+    Подменяет файлы строки одним UPDATE, только если в ней все еще тот же исходный
+    файл. Иначе изображение успели заменить - новые файлы удаляются.
+    """
+    model = apps.get_model(job['model'])
+    updated = model.objects.filter(pk=job['pk'], image=job['name']).update(image_hash=image_hash, **files)
+    if not updated:
+        delete_files(model, get_file_names(files))
+        return False
+    replaced = {field_name: job['thumbnails'][field_name] for field_name in files if field_name in job['thumbnails']}
+    if 'image' in files:
+        replaced['image'] = job['name']
+    if 'renditions' in files:
+        replaced['renditions'] = job['renditions']
+    # Совпадающие по содержимому файлы не пропадут: хранилище удаляет только последнюю ссылку
+    delete_files(model, get_file_names(replaced))
+    return bool(files)
+
+
+def process_images(processes=None, reprocess=False, models=None):
+    """
+    Обрабатывает ожидающие изображения в пуле процессов. Возвращает число строк,
+    файлы которых были заменены.
+    """
+    jobs = [job for model in models or get_processed_models() for job in get_jobs(model, reprocess)]
+    if not jobs:
+        return 0
+    swapped = {}
+    connections.close_all()
+    with get_context('fork').Pool(processes) as pool:
+        for result in pool.imap_unordered(process_file, jobs):
+            if swap_files(*result):
+                swapped.setdefault(result[0]['model'], []).append(result[0]['pk'])
+    for label, pks in swapped.items():
+        model = apps.get_model(label)
+        model.images_processed(pks)
+        # URL изображений в кэшированных ответах устарели
+        bump_model_version(model)
+    if swapped:
+        bump_catalog_version()
+    return sum(len(pks) for pks in swapped.values())
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+
+from namito.catalog.api.filters import ProductFilter
+from namito.catalog.api.views import ProductListView
+
+
+class Command(BaseCommand):
+    help = (
+        'Time ProductFilter on the current database and print the query plan, e.g. '
+        '--params "color=1,2&size=S,M&brand=Nike&has_discount=true&min_price=100&min_rating=1"'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--params', default='has_discount=true&min_price=100&min_rating=1',
+                            help='Query string of /api/products/ filter parameters')
+        parser.add_argument('--runs', type=int, default=10)
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        data = QueryDict(options['params'])
+        # Индекс namito.catalog.bitmap в команде не построен: замеряется SQL-фильтрация
+        filterset = ProductFilter(data, queryset=ProductListView().get_base_queryset())
+        if not filterset.is_valid():
+            raise CommandError(filterset.errors.as_text())
+        queryset = filterset.qs.order_by('name', 'id')
+        page = queryset.values_list('pk', flat=True)[:20]
+
+        started = time.perf_counter()
+        for _ in range(options['runs']):
+            list(page)
+            count = queryset.count()
+        elapsed = (time.perf_counter() - started) / options['runs'] * 1000
+
+        self.stdout.write(str(page.query))
+        if connection.vendor == 'postgresql':
+            self.stdout.write(page.explain(analyze=options['analyze'], buffers=options['analyze']))
+        else:
+            self.stdout.write(page.explain())
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully ran {options["runs"]} times: {elapsed:.1f} ms per page and count, {count} products'
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+from namito.catalog.images import process_images
+
+
+class Command(BaseCommand):
+    help = 'Convert uploaded images to WEBP and generate thumbnails in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--all', action='store_true', help='Check every image, skipping unchanged files by hash')
+        parser.add_argument('--watch', action='store_true', help='Keep polling for new uploads')
+        parser.add_argument('--interval', type=float, default=5)
+
+    def handle(self, *args, **options):
+        count = process_images(processes=options['processes'], reprocess=options['all'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully processed {count} images'))
+        while options['watch']:
+            time.sleep(options['interval'])
+            count = process_images(processes=options['processes'])
+            if count:
+                self.stdout.write(self.style.SUCCESS(f'Successfully processed {count} images'))
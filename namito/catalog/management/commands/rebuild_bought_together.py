@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from namito.catalog.together import BOUGHT_TOGETHER_COUNT, rebuild_bought_together, update_pending_bought_together
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the frequently bought together table from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-count', type=int, default=1)
+        parser.add_argument('--top-n', type=int, default=BOUGHT_TOGETHER_COUNT)
+        parser.add_argument('--pending', action='store_true',
+                            help='Only update products queued by new and cancelled orders')
+        parser.add_argument('--watch', action='store_true', help='With --pending, keep polling the queue')
+        parser.add_argument('--interval', type=float, default=60)
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            count = update_pending_bought_together()
+            self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} queued products'))
+            while options['watch']:
+                time.sleep(options['interval'])
+                count = update_pending_bought_together()
+                if count:
+                    self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} queued products'))
+            return
+        count = rebuild_bought_together(min_count=options['min_count'], limit=options['top_n'])
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt {count} frequently bought together pairs'))
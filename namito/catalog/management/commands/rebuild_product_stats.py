@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from namito.catalog.models import Product, ProductStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild denormalized rating, view and image statistics for all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        missing = Product.objects.filter(stats__isnull=True).values_list('pk', flat=True)
+        ProductStats.objects.bulk_create(
+            [ProductStats(product_id=pk) for pk in missing],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+
+        product_ids = list(ProductStats.objects.order_by('product').values_list('product', flat=True))
+        for start in range(0, len(product_ids), batch_size):
+            ProductStats.objects.filter(product__in=product_ids[start:start + batch_size]).refresh()
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt statistics for {len(product_ids)} products'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from namito.catalog.models import Product
+from namito.catalog.search import search_enabled, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Rebuild full-text search vectors for all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            raise CommandError('Full-text search requires PostgreSQL')
+        batch_size = options['batch_size']
+
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(product_ids), batch_size):
+            update_search_vectors(Product.objects.filter(pk__in=product_ids[start:start + batch_size]))
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt search vectors for {len(product_ids)} products'))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from namito.catalog.similarity import rebuild_similar_products, update_pending_similar_products
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the similar products table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--pending', action='store_true', help='Only update products queued by catalog edits')
+        parser.add_argument('--watch', action='store_true', help='With --pending, keep polling the queue')
+        parser.add_argument('--interval', type=float, default=60)
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            count = update_pending_similar_products()
+            self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} queued products'))
+            while options['watch']:
+                time.sleep(options['interval'])
+                count = update_pending_similar_products()
+                if count:
+                    self.stdout.write(self.style.SUCCESS(f'Successfully updated {count} queued products'))
+            return
+        count = rebuild_similar_products(
+            processes=options['processes'],
+            chunk_size=options['chunk_size'],
+            stdout=self.stdout,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt similar products for {count} products'))
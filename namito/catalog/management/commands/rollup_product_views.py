@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from namito.catalog.tracking import PRODUCT_VIEW_RETENTION_DAYS, rollup_product_views
+
+
+class Command(BaseCommand):
+    help = 'Roll up unique product viewers per day and delete raw views past retention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2)
+        parser.add_argument('--retention-days', type=int, default=PRODUCT_VIEW_RETENTION_DAYS)
+        parser.add_argument('--watch', action='store_true', help='Keep running every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60 * 60)
+
+    def handle(self, *args, **options):
+        while True:
+            updated, deleted = rollup_product_views(options['days'], options['retention_days'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully rolled up {updated} daily rows and deleted {deleted} old views'
+            ))
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from namito.catalog.campaigns import CAMPAIGN_BATCH_SIZE, run_discount_campaigns
+
+
+class Command(BaseCommand):
+    help = 'Start and finish scheduled discount campaigns and apply active ones to variant prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=CAMPAIGN_BATCH_SIZE)
+        parser.add_argument('--watch', action='store_true', help='Keep running every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60)
+
+    def handle(self, *args, **options):
+        while True:
+            started, finished, updated = run_discount_campaigns(batch_size=options['batch_size'])
+            if started or finished or updated or not options['watch']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Successfully started {started} and finished {finished} campaigns, '
+                    f'updated {updated} variant prices'
+                ))
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
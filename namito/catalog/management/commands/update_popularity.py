@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+from namito.catalog.popularity import update_popularity
+
+
+class Command(BaseCommand):
+    help = 'Recompute time-decayed popularity and trending scores for all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--watch', action='store_true', help='Keep running every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60 * 60)
+
+    def handle(self, *args, **options):
+        while True:
+            count = update_popularity(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Successfully updated popularity for {count} products'))
+            if not options['watch']:
+                return
+            time.sleep(options['interval'])
@@ -1,12 +1,24 @@
-from django.core.management.base import BaseCommand
-from namito.catalog.models import Product
+from django.core.management.base import BaseCommand, CommandError
+from namito.catalog.models import Brand, Category
+from namito.catalog.pricing import reprice
 
 
 class Command(BaseCommand):
-    help = 'Update price range for all products based on their variants'
+    help = 'Recalculate discounted variant prices and product price ranges'
 
-    def handle(self, *args, **kwargs):
-        products = Product.objects.all()
-        for product in products:
-            product.update_price_range()
-        self.stdout.write(self.style.SUCCESS('Successfully updated price ranges for all products'))
+    def add_arguments(self, parser):
+        parser.add_argument('--category', action='append', default=[], help='Category slug, with all subcategories')
+        parser.add_argument('--brand', action='append', default=[], help='Brand name')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        categories = list(Category.objects.filter(slug__in=options['category']))
+        brands = list(Brand.objects.filter(name__in=options['brand']))
+        missing = set(options['category']) - {category.slug for category in categories}
+        missing |= set(options['brand']) - {brand.name for brand in brands}
+        if missing:
+            raise CommandError(f'Unknown categories or brands: {", ".join(sorted(missing))}')
+        variants, products = reprice(categories, brands, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully updated {variants} variant prices and price ranges of {products} products'
+        ))
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:44
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_product_stats(apps, schema_editor):
+    Product = apps.get_model('catalog', 'Product')
+    ProductStats = apps.get_model('catalog', 'ProductStats')
+    Review = apps.get_model('catalog', 'Review')
+    ProductView = apps.get_model('catalog', 'ProductView')
+    Image = apps.get_model('catalog', 'Image')
+
+    ProductStats.objects.bulk_create(
+        [ProductStats(product_id=pk) for pk in Product.objects.values_list('pk', flat=True)],
+        batch_size=1000
+    )
+
+    reviews = Review.objects.filter(product=OuterRef('product')).order_by().values('product')
+    views = ProductView.objects.filter(product=OuterRef('product')).order_by().values('product')
+    images = Image.objects.filter(product=OuterRef('product'))
+    ProductStats.objects.update(
+        average_rating=Subquery(reviews.annotate(value=Avg('rating')).values('value')),
+        rating_count=Coalesce(Subquery(reviews.annotate(value=Count('pk')).values('value')), 0),
+        review_count=Coalesce(Subquery(
+            reviews.filter(text__isnull=False, text__gt='').annotate(value=Count('pk')).values('value')
+        ), 0),
+        view_count=Coalesce(Subquery(views.annotate(value=Count('pk')).values('value')), 0),
+        image_count=Coalesce(Subquery(
+            images.order_by().values('product').annotate(value=Count('pk')).values('value')
+        ), 0),
+        main_image=Coalesce(Subquery(images.order_by('-main_image', 'pk').values('image')[:1]), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0022_product_max_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='catalog.product', verbose_name='Продукт')),
+                ('average_rating', models.FloatField(blank=True, db_index=True, null=True, verbose_name='Средний рейтинг')),
+                ('rating_count', models.PositiveIntegerField(default=0, verbose_name='Количество оценок')),
+                ('review_count', models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')),
+                ('view_count', models.PositiveIntegerField(db_index=True, default=0, verbose_name='Количество просмотров')),
+                ('image_count', models.PositiveIntegerField(default=0, verbose_name='Количество изображений')),
+                ('main_image', models.CharField(blank=True, default='', max_length=100, verbose_name='Главное изображение')),
+            ],
+            options={
+                'verbose_name': 'Статистика продукта',
+                'verbose_name_plural': 'Статистика продуктов',
+            },
+        ),
+        migrations.RunPython(populate_product_stats, migrations.RunPython.noop),
+    ]
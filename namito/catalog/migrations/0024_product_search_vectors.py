@@ -0,0 +1,58 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def populate_search_vectors(apps, schema_editor):
+    # Выражение namito.catalog.search.build_search_vectors на момент миграции
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('catalog', 'Product')
+    Brand = apps.get_model('catalog', 'Brand')
+    Category = apps.get_model('catalog', 'Category')
+    brand_name = Subquery(Brand.objects.filter(pk=OuterRef('brand_id')).values('name')[:1])
+    vectors = {}
+    for language_code, config in (('ru', 'russian'), ('en', 'english')):
+        category_name = Subquery(
+            Category.objects.filter(pk=OuterRef('category_id')).values(f'name_{language_code}')[:1]
+        )
+        vectors[f'search_vector_{language_code}'] = (
+            SearchVector(f'name_{language_code}', weight='A', config=config)
+            + SearchVector(brand_name, category_name, weight='B', config=config)
+            + SearchVector('keywords', weight='C', config=config)
+            + SearchVector(f'description_{language_code}', weight='D', config=config)
+        )
+    Product.objects.update(**vectors)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0023_productstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector_en',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector_ru',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector_ru'], name='product_search_ru_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector_en'], name='product_search_en_gin'),
+        ),
+        migrations.RunPython(populate_search_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0024_product_search_vectors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=100, unique=True, verbose_name='Запрос')),
+                ('count', models.PositiveIntegerField(db_index=True, default=1, verbose_name='Количество')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Поисковый запрос',
+                'verbose_name_plural': 'Поисковые запросы',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0025_searchquerystat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Сходство')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Позиция')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_products', to='catalog.product', verbose_name='Продукт')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='catalog.product', verbose_name='Похожий продукт')),
+            ],
+            options={
+                'verbose_name': 'Похожий продукт',
+                'verbose_name_plural': 'Похожие продукты',
+                'indexes': [models.Index(fields=['product', 'rank'], name='catalog_sim_product_c0369b_idx')],
+                'unique_together': {('product', 'similar')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0026_similarproduct'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoughtTogether',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(verbose_name='Количество заказов')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Позиция')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bought_with', to='catalog.product', verbose_name='Покупают вместе с')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bought_together', to='catalog.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Покупают вместе',
+                'verbose_name_plural': 'Покупают вместе',
+                'indexes': [models.Index(fields=['product', 'rank'], name='catalog_bou_product_80735c_idx')],
+                'unique_together': {('product', 'other')},
+            },
+        ),
+    ]
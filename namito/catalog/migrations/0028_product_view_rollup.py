@@ -0,0 +1,65 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def set_viewed_on(apps, schema_editor):
+    ProductView = apps.get_model('catalog', 'ProductView')
+    ProductView.objects.update(viewed_on=TruncDate('viewed_at'))
+
+
+def populate_daily_views(apps, schema_editor):
+    # Каждая существующая строка - один просмотр, чтобы счетчики не обнулились при refresh_views
+    ProductView = apps.get_model('catalog', 'ProductView')
+    ProductViewDaily = apps.get_model('catalog', 'ProductViewDaily')
+    rows = ProductView.objects.values('product', 'viewed_on').annotate(count=Count('pk')).order_by()
+    ProductViewDaily.objects.bulk_create([
+        ProductViewDaily(product_id=row['product'], date=row['viewed_on'], views=row['count'], viewers=row['count'])
+        for row in rows.iterator()
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0027_boughttogether'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='productview',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='productview',
+            name='viewed_on',
+            field=models.DateField(db_index=True, default=django.utils.timezone.localdate),
+        ),
+        migrations.RunPython(set_viewed_on, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='productview',
+            unique_together={('product', 'user', 'viewed_on')},
+        ),
+        migrations.CreateModel(
+            name='ProductViewDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='Дата')),
+                ('views', models.PositiveIntegerField(default=0, verbose_name='Просмотры')),
+                ('viewers', models.PositiveIntegerField(default=0, verbose_name='Пользователи')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='catalog.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Просмотры продукта за день',
+                'verbose_name_plural': 'Просмотры продуктов по дням',
+                'unique_together': {('product', 'date')},
+            },
+        ),
+        migrations.RunPython(populate_daily_views, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0028_product_view_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productstats',
+            name='popularity',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddField(
+            model_name='productstats',
+            name='trending',
+            field=models.FloatField(default=0, verbose_name='Тренд'),
+        ),
+        migrations.AddIndex(
+            model_name='productstats',
+            index=models.Index(fields=['popularity', 'product'], name='productstats_popularity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productstats',
+            index=models.Index(fields=['trending', 'product'], name='productstats_trending_idx'),
+        ),
+    ]
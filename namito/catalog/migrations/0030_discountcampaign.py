@@ -0,0 +1,43 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0029_popularity_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscountCampaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('discount_type', models.CharField(choices=[('percent', 'Percent'), ('unit', 'Unit')], default='percent', max_length=7, verbose_name='Тип скидки')),
+                ('discount_value', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Значение скидки')),
+                ('starts_at', models.DateTimeField(verbose_name='Начало')),
+                ('ends_at', models.DateTimeField(verbose_name='Окончание')),
+                ('status', models.CharField(choices=[('scheduled', 'Запланирована'), ('active', 'Активна'), ('finished', 'Завершена')], default='scheduled', editable=False, max_length=9, verbose_name='Статус')),
+                ('brands', models.ManyToManyField(blank=True, related_name='discount_campaigns', to='catalog.brand', verbose_name='Бренды')),
+                ('categories', models.ManyToManyField(blank=True, related_name='discount_campaigns', to='catalog.category', verbose_name='Категории')),
+                ('products', models.ManyToManyField(blank=True, related_name='discount_campaigns', to='catalog.product', verbose_name='Продукты')),
+                ('tags', models.ManyToManyField(blank=True, related_name='discount_campaigns', to='catalog.tag', verbose_name='Теги')),
+            ],
+            options={
+                'verbose_name': 'Акция',
+                'verbose_name_plural': 'Акции',
+            },
+        ),
+        migrations.AddField(
+            model_name='variant',
+            name='campaign',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='variants', to='catalog.discountcampaign', verbose_name='Акция'),
+        ),
+        migrations.AddIndex(
+            model_name='discountcampaign',
+            index=models.Index(fields=['status', 'starts_at'], name='catalog_dis_status_3a9d17_idx'),
+        ),
+    ]
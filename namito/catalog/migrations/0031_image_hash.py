@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0030_discountcampaign'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='reviewimage',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0031_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productstats',
+            name='main_image_renditions',
+            field=models.JSONField(blank=True, null=True, verbose_name='Размеры главного изображения'),
+        ),
+        migrations.AddField(
+            model_name='reviewimage',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
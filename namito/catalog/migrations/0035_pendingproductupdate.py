@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0034_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingProductUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=32, verbose_name='Вид пересчета')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Ожидающий пересчет',
+                'verbose_name_plural': 'Ожидающие пересчеты',
+                'unique_together': {('kind', 'product')},
+            },
+        ),
+    ]
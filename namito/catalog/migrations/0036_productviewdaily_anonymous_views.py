@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0035_pendingproductupdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productviewdaily',
+            name='anonymous_views',
+            field=models.PositiveIntegerField(default=0, verbose_name='Анонимные просмотры'),
+        ),
+    ]
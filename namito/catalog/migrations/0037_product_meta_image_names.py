@@ -0,0 +1,24 @@
+# Generated by Django 4.2.11 on 2026-10-18 15:02
+
+from django.conf import settings
+from django.db import migrations
+
+
+def strip_media_url(apps, schema_editor):
+    # Product.save раньше записывал в meta_image URL файла, теперь - имя в хранилище
+    Product = apps.get_model('catalog', 'Product')
+    prefix = settings.MEDIA_URL
+    products = Product.objects.filter(meta_image__startswith=prefix).values_list('pk', 'meta_image')
+    for pk, url in products.iterator():
+        Product.objects.filter(pk=pk).update(meta_image=url[len(prefix):])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0036_productviewdaily_anonymous_views'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_media_url, migrations.RunPython.noop),
+    ]
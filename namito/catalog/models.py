@@ -1,43 +1,83 @@
 import html
 import re
-import io
 import uuid
 
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
-from django.core.files.base import ContentFile
 from django.conf import settings
-from django.db.models import Avg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models import Avg, Case, Count, Exists, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 
 from mptt.models import MPTTModel, TreeForeignKey
 from colorfield.fields import ColorField
-from PIL import Image as PILImage
 from unidecode import unidecode
 
+from namito.catalog.pricing import apply_discount, reprice_variants
+from namito.catalog.renditions import build_srcset
 from namito.users.models import User
 
 
 class ProcessedImageModel(models.Model):
+    """
+    Изображение сохраняется как загружено, WEBP, миниатюры и заглушку делает команда
+    process_images (namito.catalog.images) в пуле процессов и подменяет файлы в строке.
+    """
+    # Хэш SHA-256 обработанного файла image; пустой - изображение ждет обработки
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # Готовые размеры: {размер: {формат: {ширина: имя файла}}} (namito.catalog.renditions)
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Размытая копия изображения (data URI) и основной цвет для показа до загрузки
+    placeholder = models.TextField(blank=True, editable=False)
+    dominant_color = models.CharField(max_length=7, blank=True, editable=False)
+    # Качество WEBP; None - файл не перекодируется
+    image_quality = 70
+    # Поле миниатюры -> максимальный размер
+    image_thumbnails = {}
+    # Размеры из RENDITIONS, которые нужны этой модели
+    image_renditions = ()
+
     class Meta:
         abstract = True
 
     def save(self, *args, **kwargs):
-        self.process_image()
+        if self.image and not self.image._committed:
+            self.image_hash = ''
+            self.placeholder = ''
+            self.dominant_color = ''
         super().save(*args, **kwargs)
 
-    def process_image(self):
-        if self.image:
-            pil_image = PILImage.open(self.image)
-            if pil_image.format != 'WEBP':
-                output_io_stream = io.BytesIO()
-                pil_image.convert('RGB').save(output_io_stream, format='WEBP', quality=70)
-                output_io_stream.seek(0)
-                self.image = ContentFile(output_io_stream.read(),
-                                         name=self.image.name.split('.')[0] + '.webp')
+    @classmethod
+    def images_processed(cls, pks):
+        """Вызывается после подмены файлов строк pks, сигналы при этом не отправляются."""
+
+    def get_srcset(self, names=None, request=None):
+        # Пока новое изображение не обработано, в renditions - размеры предыдущего
+        if not self.image_hash:
+            return {}
+        return build_srcset(self.renditions, self._meta.get_field('image').storage, names, request)
+
 
+class StoredFile(models.Model):
+    """Файл ContentAddressedStorage (namito.catalog.storage) и число ссылок на него."""
+    name = models.CharField(max_length=100, unique=True, verbose_name=_('Имя файла'))
+    size = models.PositiveBigIntegerField(verbose_name=_('Размер'))
+    references = models.PositiveIntegerField(default=1, verbose_name=_('Количество ссылок'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Время создания'))
+
+    class Meta:
+        verbose_name = _('Файл хранилища')
+        verbose_name_plural = _('Файлы хранилища')
 
-class Category(MPTTModel, models.Model):
+    def __str__(self):
+        return self.name
+
+
+class Category(MPTTModel, ProcessedImageModel):
     CATEGORY_TYPES = [
         (0, _("For men")),
         (1, _("For woman")),
@@ -57,6 +97,8 @@ class Category(MPTTModel, models.Model):
     meta_image = models.ImageField(null=True, blank=True, verbose_name=_('Мета изображение'))
     promotion = models.BooleanField(default=False, verbose_name=_('Продвижение'))
     icon = models.ImageField(upload_to='category_icons/', null=True, blank=True, verbose_name=_('Иконки'))
+    # meta_image ссылается на тот же файл, поэтому image не перекодируется
+    image_quality = None
 
     class Meta:
         verbose_name = _("Категория")
@@ -139,10 +181,17 @@ class Product(models.Model):
     sku = models.CharField(max_length=50, unique=True, blank=True, null=True, verbose_name=_('Артикул'))
     active = models.BooleanField(default=True, verbose_name=_('Активность'))
     created_at = models.DateTimeField(auto_now_add=True)
+    # Заполняются сигналами (namito.catalog.search), вручную не редактируются
+    search_vector_ru = SearchVectorField(null=True, editable=False)
+    search_vector_en = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = "Продукт"
         verbose_name_plural = "Продукты"
+        indexes = [
+            GinIndex(fields=['search_vector_ru'], name='product_search_ru_gin'),
+            GinIndex(fields=['search_vector_en'], name='product_search_en_gin'),
+        ]
 
 
     def get_images(self):
@@ -163,17 +212,18 @@ class Product(models.Model):
         if not self.meta_title:
             self.meta_title = self.generate_meta_title()
         if not self.meta_image:
+            # Имя файла в хранилище, а не URL: с абсолютным MEDIA_URL URL не помещается в поле
             main_image = self.images.filter(main_image=True).first()
             if main_image:
-                self.meta_image = main_image.image.url
+                self.meta_image = main_image.image.name
             elif self.images.exists():
                 first_image = self.images.first()
-                self.meta_image = first_image.image.url
+                self.meta_image = first_image.image.name
 
-        if self.variants:
-            for variant in self.variants.all():
-                variant.discounted_price = variant.get_price()
-                variant.save()
+        if self.pk:
+            # Цены вариантов пересчитываются одним UPDATE, без save() каждого варианта
+            reprice_variants(self.variants.all())
+            self.set_price_range()
 
         super().save(*args, **kwargs)
 
@@ -196,12 +246,18 @@ class Product(models.Model):
     def __str__(self):
         return f'{self.name}'
 
+    def get_stats(self):
+        try:
+            return self.stats
+        except ProductStats.DoesNotExist:
+            return ProductStats(product=self)
+
     def get_popularity_score(self):
-        return self.views.count()
+        return self.get_stats().view_count
 
     def get_average_rating(self):
-        # Рассчитываем средний рейтинг для продукта
-        average_rating = self.reviews.aggregate(Avg('rating'))['rating__avg']
+        # Средний рейтинг берем из денормализованной статистики продукта
+        average_rating = self.get_stats().average_rating
         if average_rating is None:
             return 0
         return round(average_rating, 2)
@@ -223,28 +279,30 @@ class Product(models.Model):
             'max_price': price_data
         }
 
-    def update_price_range(self):
-        # Проверка флага для предотвращения рекурсии
-        if hasattr(self, '_updating_price_range') and self._updating_price_range:
-            return
+    def set_price_range(self):
+        prices = self.variants.aggregate(min_price=models.Min('discounted_price'), max_price=models.Max('discounted_price'))
+        self.min_price = prices['min_price'] if prices['min_price'] is not None else 0
+        self.max_price = prices['max_price'] if prices['max_price'] is not None else 0
 
-        self._updating_price_range = True
-        min_price = self.variants.aggregate(models.Min('discounted_price'))['discounted_price__min']
-        max_price = self.variants.aggregate(models.Max('discounted_price'))['discounted_price__max']
-
-        self.min_price = min_price if min_price is not None else 0
-        self.max_price = max_price if max_price is not None else 0
-        self.save(update_fields=['min_price', 'max_price'])
-        self._updating_price_range = False
+    def update_price_range(self):
+        # UPDATE без save(): Product.save пересчитал бы все варианты продукта
+        self.set_price_range()
+        Product.objects.filter(pk=self.pk).update(min_price=self.min_price, max_price=self.max_price)
 
 
 class ProductView(models.Model):
+    """
+    Просмотры авторизованных пользователей, не больше одного в день. Пишутся
+    пачками из namito.catalog.tracking и хранятся PRODUCT_VIEW_RETENTION_DAYS,
+    для статистики используется ProductViewDaily.
+    """
     product = models.ForeignKey(Product, related_name='views', on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     viewed_at = models.DateTimeField(auto_now_add=True)
+    viewed_on = models.DateField(default=timezone.localdate, db_index=True)
 
     class Meta:
-        unique_together = ('product', 'user')
+        unique_together = ('product', 'user', 'viewed_on')
         verbose_name = "Просмотр продукта"
         verbose_name_plural = "Просмотры продуктов"
 
@@ -252,6 +310,163 @@ class ProductView(models.Model):
         return f"{self.user} просмотрел(а) {self.product} в {self.viewed_at}"
 
 
+class ProductViewDaily(models.Model):
+    product = models.ForeignKey(Product, related_name='daily_views', on_delete=models.CASCADE,
+                                verbose_name=_('Продукт'))
+    date = models.DateField(db_index=True, verbose_name=_('Дата'))
+    views = models.PositiveIntegerField(default=0, verbose_name=_('Просмотры'))
+    # Просмотры без входа в аккаунт: в ProductStats.view_count не входят
+    anonymous_views = models.PositiveIntegerField(default=0, verbose_name=_('Анонимные просмотры'))
+    viewers = models.PositiveIntegerField(default=0, verbose_name=_('Пользователи'))
+
+    class Meta:
+        unique_together = ('product', 'date')
+        verbose_name = _("Просмотры продукта за день")
+        verbose_name_plural = _("Просмотры продуктов по дням")
+
+    def __str__(self):
+        return f'{self.product_id} {self.date}'
+
+
+class ProductStatsQuerySet(models.QuerySet):
+    def refresh_ratings(self):
+        reviews = Review.objects.filter(product=OuterRef('product')).order_by().values('product')
+        return self.update(
+            average_rating=Subquery(reviews.annotate(value=Avg('rating')).values('value')),
+            rating_count=Coalesce(Subquery(reviews.annotate(value=Count('pk')).values('value')), 0),
+            review_count=Coalesce(Subquery(
+                reviews.filter(text__isnull=False, text__gt='').annotate(value=Count('pk')).values('value')
+            ), 0),
+        )
+
+    def refresh_views(self):
+        views = ProductViewDaily.objects.filter(product=OuterRef('product')).order_by().values('product')
+        return self.update(
+            view_count=Coalesce(Subquery(views.annotate(value=Sum('views')).values('value')), 0),
+        )
+
+    def refresh_images(self):
+        images = Image.objects.filter(product=OuterRef('product'))
+        return self.update(
+            image_count=Coalesce(Subquery(
+                images.order_by().values('product').annotate(value=Count('pk')).values('value')
+            ), 0),
+            # Главная картинка, а если ее нет - первая загруженная
+            main_image=Coalesce(Subquery(images.order_by('-main_image', 'pk').values('image')[:1]), Value('')),
+            # Размеры только обработанного изображения, иначе в них размеры предыдущего файла
+            main_image_renditions=Subquery(images.order_by('-main_image', 'pk').annotate(value=Case(
+                When(image_hash='', then=Value(None)), default=F('renditions'), output_field=models.JSONField()
+            )).values('value')[:1]),
+        )
+
+    def refresh(self):
+        self.refresh_ratings()
+        self.refresh_views()
+        self.refresh_images()
+
+
+class ProductStats(models.Model):
+    product = models.OneToOneField(Product, related_name='stats', on_delete=models.CASCADE, primary_key=True,
+                                   verbose_name=_('Продукт'))
+    average_rating = models.FloatField(blank=True, null=True, db_index=True, verbose_name=_('Средний рейтинг'))
+    rating_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество оценок'))
+    review_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество отзывов'))
+    view_count = models.PositiveIntegerField(default=0, db_index=True, verbose_name=_('Количество просмотров'))
+    image_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество изображений'))
+    main_image = models.CharField(max_length=100, blank=True, default='', verbose_name=_('Главное изображение'))
+    main_image_renditions = models.JSONField(blank=True, null=True, verbose_name=_('Размеры главного изображения'))
+    # Оценки с затуханием по времени, пересчитываются командой update_popularity
+    popularity = models.FloatField(default=0, verbose_name=_('Популярность'))
+    trending = models.FloatField(default=0, verbose_name=_('Тренд'))
+
+    objects = ProductStatsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['popularity', 'product'], name='productstats_popularity_idx'),
+            models.Index(fields=['trending', 'product'], name='productstats_trending_idx'),
+        ]
+        verbose_name = _("Статистика продукта")
+        verbose_name_plural = _("Статистика продуктов")
+
+    def __str__(self):
+        return f'{self.product_id}'
+
+    @property
+    def main_image_url(self):
+        if self.main_image:
+            return Image._meta.get_field('image').storage.url(self.main_image)
+        return None
+
+    def get_main_image_srcset(self, names=None, request=None):
+        return build_srcset(self.main_image_renditions, Image._meta.get_field('image').storage, names, request)
+
+
+class SearchQueryStat(models.Model):
+    query = models.CharField(max_length=100, unique=True, verbose_name=_('Запрос'))
+    count = models.PositiveIntegerField(default=1, db_index=True, verbose_name=_('Количество'))
+    updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Обновлено'))
+
+    class Meta:
+        verbose_name = _("Поисковый запрос")
+        verbose_name_plural = _("Поисковые запросы")
+
+    def __str__(self):
+        return self.query
+
+
+class SimilarProduct(models.Model):
+    product = models.ForeignKey(Product, related_name='similar_products', on_delete=models.CASCADE,
+                                verbose_name=_('Продукт'))
+    similar = models.ForeignKey(Product, related_name='similar_to', on_delete=models.CASCADE,
+                                verbose_name=_('Похожий продукт'))
+    score = models.FloatField(verbose_name=_('Сходство'))
+    rank = models.PositiveSmallIntegerField(verbose_name=_('Позиция'))
+
+    class Meta:
+        unique_together = ('product', 'similar')
+        indexes = [models.Index(fields=['product', 'rank'])]
+        verbose_name = _("Похожий продукт")
+        verbose_name_plural = _("Похожие продукты")
+
+    def __str__(self):
+        return f'{self.product_id} -> {self.similar_id}'
+
+
+class BoughtTogether(models.Model):
+    product = models.ForeignKey(Product, related_name='bought_together', on_delete=models.CASCADE,
+                                verbose_name=_('Продукт'))
+    other = models.ForeignKey(Product, related_name='bought_with', on_delete=models.CASCADE,
+                              verbose_name=_('Покупают вместе с'))
+    count = models.PositiveIntegerField(verbose_name=_('Количество заказов'))
+    score = models.FloatField(verbose_name=_('Оценка'))
+    rank = models.PositiveSmallIntegerField(verbose_name=_('Позиция'))
+
+    class Meta:
+        unique_together = ('product', 'other')
+        indexes = [models.Index(fields=['product', 'rank'])]
+        verbose_name = _("Покупают вместе")
+        verbose_name_plural = _("Покупают вместе")
+
+    def __str__(self):
+        return f'{self.product_id} + {self.other_id}'
+
+
+class PendingProductUpdate(models.Model):
+    """Очередь отложенных пересчетов по продуктам (namito.catalog.pending), kind - вид пересчета."""
+    kind = models.CharField(max_length=32, verbose_name=_('Вид пересчета'))
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE, verbose_name=_('Продукт'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Время создания'))
+
+    class Meta:
+        unique_together = ('kind', 'product')
+        verbose_name = _("Ожидающий пересчет")
+        verbose_name_plural = _("Ожидающие пересчеты")
+
+    def __str__(self):
+        return f'{self.kind} {self.product_id}'
+
+
 class Characteristic(models.Model):
     key = models.CharField(max_length=255, null=True, blank=True, verbose_name=_('Ключь'))
     value = models.CharField(max_length=255, null=True, blank=True, verbose_name=_('Значение'))
@@ -306,6 +521,9 @@ class Variant(models.Model):
     discount_type = models.CharField(default=0, max_length=7, choices=DISCOUNT_TYPE_CHOICES, blank=True, null=True,
                                      help_text=_("Type of the discount - either a percent or a fixed unit."), verbose_name=_('Тмп скидки'))
     discounted_price = models.PositiveIntegerField(default=0, verbose_name=_("Цена со скидкой"), blank=True, null=True)
+    # Кампания, цена которой сейчас в discounted_price (namito.catalog.campaigns)
+    campaign = models.ForeignKey('DiscountCampaign', related_name='variants', on_delete=models.SET_NULL,
+                                 blank=True, null=True, editable=False, verbose_name=_('Акция'))
 
     class Meta:
         verbose_name = 'Вариант'
@@ -318,20 +536,77 @@ class Variant(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.color} - {self.size}"
 
+    def get_own_price(self):
+        return apply_discount(self.price, self.discount_type, self.discount_value)
+
     def get_price(self):
-        if self.discount_value and self.discount_type:
-            if self.discount_type == 'percent':
-                discount_amount = (self.discount_value / 100) * self.price
-                return round(self.price - discount_amount)
-            elif self.discount_type == 'unit':
-                return round(self.price - self.discount_value)
-        return self.price
+        # Кампания применяется, только если она выгоднее собственной скидки варианта
+        price = self.get_own_price()
+        if self.campaign_id:
+            price = min(price, self.campaign.get_price(self.price))
+        return price
 
     def save(self, *args, **kwargs):
+        self.discounted_price = self.get_price()
         super().save(*args, **kwargs)
-        # Проверка флага для предотвращения рекурсии
-        if not hasattr(self.product, '_updating_price_range') or not self.product._updating_price_range:
-            self.product.update_price_range()
+        self.product.update_price_range()
+
+
+class DiscountCampaign(models.Model):
+    """
+    Скидка на продукты из поддеревьев категорий, брендов, тегов или списка продуктов.
+    Применяется и снимается командой run_discount_campaigns (namito.catalog.campaigns).
+    """
+    SCHEDULED = 'scheduled'
+    ACTIVE = 'active'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [
+        (SCHEDULED, _('Запланирована')),
+        (ACTIVE, _('Активна')),
+        (FINISHED, _('Завершена')),
+    ]
+    name = models.CharField(max_length=255, verbose_name=_('Название'))
+    discount_type = models.CharField(max_length=7, choices=Variant.DISCOUNT_TYPE_CHOICES, default='percent',
+                                     verbose_name=_('Тип скидки'))
+    discount_value = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_('Значение скидки'))
+    starts_at = models.DateTimeField(verbose_name=_('Начало'))
+    ends_at = models.DateTimeField(verbose_name=_('Окончание'))
+    categories = models.ManyToManyField(Category, blank=True, related_name='discount_campaigns',
+                                        verbose_name=_('Категории'))
+    brands = models.ManyToManyField(Brand, blank=True, related_name='discount_campaigns', verbose_name=_('Бренды'))
+    tags = models.ManyToManyField(Tag, blank=True, related_name='discount_campaigns', verbose_name=_('Теги'))
+    products = models.ManyToManyField(Product, blank=True, related_name='discount_campaigns',
+                                      verbose_name=_('Продукты'))
+    status = models.CharField(max_length=9, choices=STATUS_CHOICES, default=SCHEDULED, editable=False,
+                              verbose_name=_('Статус'))
+
+    class Meta:
+        verbose_name = 'Акция'
+        verbose_name_plural = 'Акции'
+        indexes = [
+            models.Index(fields=['status', 'starts_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.name}'
+
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': _('Окончание акции должно быть позже начала.')})
+
+    def get_price(self, price):
+        return apply_discount(price, self.discount_type, self.discount_value)
+
+    def get_products(self):
+        # Категория - все поддерево: отрезок [lft, rght] в ее дереве
+        condition = Q(pk__in=self.products.values('pk')) | Q(brand__in=self.brands.values('pk'))
+        condition |= Q(Exists(Product.tags.through.objects.filter(
+            product=OuterRef('pk'), tag__in=self.tags.values('pk')
+        )))
+        for category in self.categories.all():
+            condition |= Q(category__tree_id=category.tree_id, category__lft__gte=category.lft,
+                           category__rght__lte=category.rght)
+        return Product.objects.filter(condition)
 
 
 class Image(ProcessedImageModel):
@@ -340,29 +615,19 @@ class Image(ProcessedImageModel):
     main_image = models.BooleanField(default=False, verbose_name=_("Главная картинка"))
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE, null=True, blank=True)
     color = models.ForeignKey(Color, related_name='images', on_delete=models.PROTECT, verbose_name=_('Цвет'))
+    image_quality = 90
+    image_thumbnails = {'small_image': (150, 150)}
+    image_renditions = ('grid_card', 'pdp_gallery', 'cart_line')
 
     class Meta:
         verbose_name = 'Изображение'
         verbose_name_plural = 'Изображения'
 
-    def save(self, *args, **kwargs):
-        self.process_image()
-        super().save(*args, **kwargs)
-
-    def process_image(self):
-        if self.image:
-            pil_image = PILImage.open(self.image)
-            output_io_stream = io.BytesIO()
-            pil_image.save(output_io_stream, format='WEBP', quality=90)
-            output_io_stream.seek(0)
-            self.image.save(f"{self.image.name.split('.')[0]}.webp", ContentFile(output_io_stream.read()), save=False)
-
-            small_image = pil_image.copy()
-            small_image.thumbnail((150, 150))
-            small_output_io_stream = io.BytesIO()
-            small_image.save(small_output_io_stream, format='WEBP', quality=90)
-            small_output_io_stream.seek(0)
-            self.small_image.save(f"{self.image.name.split('.')[0]}_small.webp", ContentFile(small_output_io_stream.read()), save=False)
+    @classmethod
+    def images_processed(cls, pks):
+        # ProductStats.main_image хранит имя файла, а оно сменилось на .webp
+        products = cls.objects.filter(pk__in=pks).values('product_id')
+        ProductStats.objects.filter(product__in=products).refresh_images()
 
 
 class Review(models.Model):
@@ -386,6 +651,7 @@ class ReviewImage(ProcessedImageModel):
     review = models.ForeignKey(Review, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='review_images/')
     main_image = models.BooleanField(default=False)
+    image_renditions = ('review_thumb',)
 
     class Meta:
         verbose_name = _("Картинка отзыва")
@@ -398,6 +664,7 @@ class ReviewImage(ProcessedImageModel):
 class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='favorites')
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
 
     class Meta:
         unique_together = ['user', 'product']
@@ -0,0 +1,38 @@
+from django.db import transaction
+
+PENDING_BATCH_SIZE = 200
+
+
+def enqueue_products(kind, product_ids):
+    """
+    Ставит продукты в очередь пересчета kind в текущей транзакции записи.
+    Продукт, который уже ждет пересчета, второй раз не добавляется.
+    """
+    from namito.catalog.models import PendingProductUpdate
+
+    PendingProductUpdate.objects.bulk_create([
+        PendingProductUpdate(kind=kind, product_id=product_id) for product_id in set(product_ids) if product_id
+    ], ignore_conflicts=True)
+
+
+def process_pending_products(kind, update, batch_size=PENDING_BATCH_SIZE):
+    """
+    Вызывает update(product_ids) для очереди kind пачками по batch_size продуктов
+    и удаляет их из очереди в той же транзакции: при ошибке продукты остаются
+    в очереди. Строки, занятые другим обработчиком, пропускаются (SKIP LOCKED).
+    Возвращает число пересчитанных продуктов.
+    """
+    from namito.catalog.models import PendingProductUpdate
+
+    processed = 0
+    while True:
+        with transaction.atomic():
+            pending = list(
+                PendingProductUpdate.objects.select_for_update(skip_locked=True).filter(kind=kind)
+                .order_by('pk').values_list('pk', 'product_id')[:batch_size]
+            )
+            if not pending:
+                return processed
+            update(sorted(product_id for pk, product_id in pending))
+            PendingProductUpdate.objects.filter(pk__in=[pk for pk, product_id in pending]).delete()
+        processed += len(pending)
@@ -0,0 +1,78 @@
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from namito.catalog.together import CANCELLED_STATUS
+
+# Вклад одного события в оценку
+EVENT_WEIGHTS = {
+    'view': 1,
+    'favorite': 3,
+    'cart': 5,
+    'sale': 10,
+}
+# Период полураспада в днях и окно, за пределами которого вклад пренебрежимо мал
+POPULARITY_HALF_LIFE = 30
+POPULARITY_WINDOW = 180
+TRENDING_HALF_LIFE = 3
+TRENDING_WINDOW = 21
+
+
+def get_events(since):
+    """Массивы (продукт, время события, вес) за период начиная с since."""
+    from namito.catalog.models import Favorite, ProductViewDaily
+    from namito.orders.models import CartItem, OrderedItem
+
+    sources = [
+        (ProductViewDaily.objects.filter(date__gte=timezone.localdate(since))
+         .values_list('product_id', 'date', 'views'), 'view'),
+        # строки без даты созданы до появления поля - считаем их самыми старыми в окне
+        (Favorite.objects.annotate(at=Coalesce('created_at', Value(since)), count=Value(1)).filter(at__gte=since)
+         .values_list('product_id', 'at', 'count'), 'favorite'),
+        (CartItem.objects.annotate(at=Coalesce('created_at', 'cart__created_at')).filter(at__gte=since)
+         .values_list('product_variant__product_id', 'at', 'quantity'), 'cart'),
+        (OrderedItem.objects.exclude(order__status=CANCELLED_STATUS).filter(order__created_at__gte=since)
+         .values_list('product_variant__product_id', 'order__created_at', 'quantity'), 'sale'),
+    ]
+    product_ids, timestamps, weights = [], [], []
+    for queryset, event in sources:
+        for product_id, at, count in queryset.iterator(chunk_size=10000):
+            if not isinstance(at, datetime):
+                at = timezone.make_aware(datetime.combine(at, time.min))
+            product_ids.append(product_id)
+            timestamps.append(at.timestamp())
+            weights.append(EVENT_WEIGHTS[event] * count)
+    return (np.array(product_ids, dtype=np.int64), np.array(timestamps, dtype=np.float64),
+            np.array(weights, dtype=np.float64))
+
+
+def decayed_scores(product_ids, timestamps, weights, now, half_life, window):
+    """Сумма весов событий, каждый из которых уменьшается вдвое за half_life дней."""
+    age = (now.timestamp() - timestamps) / 86400
+    keep = age <= window
+    decay = weights[keep] * np.power(0.5, np.maximum(age[keep], 0) / half_life)
+    ids, positions = np.unique(product_ids[keep], return_inverse=True)
+    return dict(zip(ids.tolist(), np.bincount(positions, weights=decay).tolist(), strict=True))
+
+
+def update_popularity(batch_size=1000):
+    """Пересчитывает ProductStats.popularity и trending. Возвращает число измененных строк."""
+    from namito.catalog.models import ProductStats
+
+    now = timezone.now()
+    events = get_events(now - timedelta(days=max(POPULARITY_WINDOW, TRENDING_WINDOW)))
+    popularity = decayed_scores(*events, now, POPULARITY_HALF_LIFE, POPULARITY_WINDOW)
+    trending = decayed_scores(*events, now, TRENDING_HALF_LIFE, TRENDING_WINDOW)
+
+    changed = []
+    current = ProductStats.objects.values_list('product_id', 'popularity', 'trending')
+    for product_id, old_popularity, old_trending in current.iterator(chunk_size=batch_size):
+        new_popularity = round(popularity.get(product_id, 0), 4)
+        new_trending = round(trending.get(product_id, 0), 4)
+        if new_popularity != old_popularity or new_trending != old_trending:
+            changed.append(ProductStats(product_id=product_id, popularity=new_popularity, trending=new_trending))
+    ProductStats.objects.bulk_update(changed, ['popularity', 'trending'], batch_size=batch_size)
+    return len(changed)
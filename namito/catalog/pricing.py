@@ -0,0 +1,114 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Case, DecimalField, ExpressionWrapper, F, IntegerField, Max, Min, OuterRef, Q, Subquery, Value, When
+)
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
+
+from namito.catalog.bitmap import schedule_index_change
+from namito.catalog.cache import bump_catalog_version
+
+
+def apply_discount(price, discount_type, discount_value):
+    """
+    Цена со скидкой в процентах или в валюте. Округление - до целого, половина
+    вверх, как ROUND в SQL (discounted_price_expression), цена не меньше нуля.
+    """
+    if not discount_value or discount_type not in ('percent', 'unit'):
+        return price
+    if discount_type == 'percent':
+        price = price - (discount_value / 100) * price
+    else:
+        price = price - discount_value
+    return max(int(Decimal(price).quantize(Decimal(1), rounding=ROUND_HALF_UP)), 0)
+
+
+def discounted_price_expression(discount_type, discount_value):
+    """apply_discount в SQL; discount_value - значение или выражение (F('discount_value'))."""
+    if not isinstance(discount_value, F):
+        discount_value = Value(discount_value, output_field=DecimalField())
+    if discount_type == 'percent':
+        price = F('price') - discount_value * F('price') / Value(100)
+    elif discount_type == 'unit':
+        price = F('price') - discount_value
+    else:
+        return F('price')
+    price = Round(ExpressionWrapper(price, output_field=DecimalField()))
+    return Greatest(Cast(price, IntegerField()), Value(0))
+
+
+def own_price_expression():
+    """Цена варианта с его собственной скидкой, без кампаний."""
+    has_discount = Q(discount_value__isnull=False) & ~Q(discount_value=0)
+    return Case(
+        *[When(has_discount & Q(discount_type=discount_type),
+               then=discounted_price_expression(discount_type, F('discount_value')))
+          for discount_type in ('percent', 'unit')],
+        default=F('price'),
+        output_field=IntegerField()
+    )
+
+
+def get_price_range_subquery(aggregate):
+    from namito.catalog.models import Variant
+
+    return Coalesce(Subquery(
+        Variant.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        .annotate(value=aggregate('discounted_price')).values('value')
+    ), 0)
+
+
+def update_price_ranges(products):
+    """min_price и max_price продуктов одним UPDATE с подзапросами по вариантам."""
+    return products.update(
+        min_price=get_price_range_subquery(Min),
+        max_price=get_price_range_subquery(Max),
+    )
+
+
+def reprice_variants(variants, batch_size=1000):
+    """
+    Пересчитывает discounted_price вариантов по Variant.get_price. Изменившиеся
+    цены записываются пачками: bulk_update - один UPDATE ... SET = CASE id
+    на batch_size вариантов. Сигналы вариантов не отправляются.
+    """
+    from namito.catalog.models import Variant
+
+    changed = []
+    variants = variants.select_related('campaign').only(
+        'pk', 'price', 'discount_value', 'discount_type', 'discounted_price',
+        'campaign', 'campaign__discount_type', 'campaign__discount_value'
+    )
+    for variant in variants.iterator(chunk_size=batch_size):
+        price = variant.get_price()
+        if price != variant.discounted_price:
+            variant.discounted_price = price
+            changed.append(variant)
+    Variant.objects.bulk_update(changed, ['discounted_price'], batch_size=batch_size)
+    return len(changed)
+
+
+def reprice(categories=None, brands=None, batch_size=1000):
+    """
+    Пересчет цен со скидкой и диапазонов цен продуктов из поддеревьев categories
+    и брендов brands (все продукты, если не заданы). Возвращает число измененных
+    вариантов и число продуктов.
+    """
+    from namito.catalog.models import Product, Variant
+
+    condition = Q()
+    for category in categories or ():
+        condition |= Q(category__tree_id=category.tree_id, category__lft__gte=category.lft,
+                       category__rght__lte=category.rght)
+    if brands:
+        condition |= Q(brand__in=brands)
+    products = Product.objects.filter(condition)
+
+    with transaction.atomic():
+        variants = reprice_variants(Variant.objects.filter(product__in=products.values('pk')), batch_size)
+        updated = update_price_ranges(products)
+        # Сигналы не отправлялись: кэш списков и индекс атрибутов обновляем целиком
+        transaction.on_commit(bump_catalog_version)
+        schedule_index_change()
+    return variants, updated
@@ -0,0 +1,111 @@
+import base64
+import io
+
+from PIL import Image as PILImage
+
+try:
+    # Pillow до 11.2 умеет AVIF только с этим плагином; без него делаем только WEBP
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+# Размеры изображений под каждое место показа: ширины для 1x и 2x экранов
+RENDITIONS = {
+    'grid_card': (240, 480),
+    'pdp_gallery': (600, 1200),
+    'cart_line': (96, 192),
+    'review_thumb': (160, 320),
+}
+# Форматы в порядке предпочтения клиента, качество подобрано под одинаковый визуальный результат
+FORMAT_QUALITY = {
+    'avif': 50,
+    'webp': 75,
+}
+# Заглушка, которая показывается до загрузки изображения: крошечный WEBP прямо в ответе API
+PLACEHOLDER_SIZE = (16, 16)
+PLACEHOLDER_QUALITY = 40
+
+
+def get_formats():
+    PILImage.init()
+    return [image_format for image_format in FORMAT_QUALITY if image_format.upper() in PILImage.SAVE]
+
+
+def is_complete(renditions, names):
+    """Есть ли в renditions строки все размеры names во всех доступных форматах."""
+    formats = set(get_formats())
+    return set(renditions) == set(names) and all(set(renditions[name]) == formats for name in names)
+
+
+def to_rgb(pil_image):
+    if pil_image.mode not in ('RGB', 'RGBA'):
+        transparent = pil_image.mode in ('LA', 'PA') or 'transparency' in pil_image.info
+        pil_image = pil_image.convert('RGBA' if transparent else 'RGB')
+    return pil_image
+
+
+def get_placeholder(pil_image):
+    """Data URI размытой копии изображения размером не больше PLACEHOLDER_SIZE (~200 байт)."""
+    preview = to_rgb(pil_image).copy()
+    preview.thumbnail(PLACEHOLDER_SIZE)
+    output = io.BytesIO()
+    preview.save(output, format='WEBP', quality=PLACEHOLDER_QUALITY)
+    return f'data:image/webp;base64,{base64.b64encode(output.getvalue()).decode()}'
+
+
+def get_dominant_color(pil_image):
+    """Самый частый цвет после сведения к палитре из 5 цветов, '#rrggbb'. Прозрачность - на белом фоне."""
+    preview = to_rgb(pil_image).copy()
+    preview.thumbnail((64, 64))
+    if preview.mode == 'RGBA':
+        background = PILImage.new('RGB', preview.size, (255, 255, 255))
+        background.paste(preview, mask=preview.getchannel('A'))
+        preview = background
+    palette = preview.quantize(colors=5)
+    count, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def render(pil_image, names):
+    """
+    Перекодирует изображение во все размеры names. Изображение не увеличивается:
+    ширины больше исходной дают одну копию исходного размера.
+    Возвращает {(размер, формат, ширина): байты}.
+    """
+    pil_image = to_rgb(pil_image)
+    resized = {}
+    files = {}
+    for name in names:
+        for width in sorted({min(width, pil_image.width) for width in RENDITIONS[name]}):
+            if width not in resized:
+                height = max(1, round(pil_image.height * width / pil_image.width))
+                resized[width] = pil_image.resize((width, height), PILImage.LANCZOS)
+            for image_format in get_formats():
+                output = io.BytesIO()
+                resized[width].save(output, format=image_format.upper(), quality=FORMAT_QUALITY[image_format])
+                files[name, image_format, width] = output.getvalue()
+    return files
+
+
+def build_srcset(renditions, storage, names=None, request=None):
+    """
+    {размер: {формат: 'url 240w, url 480w'}} для атрибута srcset. Клиент выбирает
+    первый поддерживаемый формат, ширину - браузер по sizes.
+    """
+    srcset = {}
+    for name, formats in (renditions or {}).items():
+        if names is not None and name not in names:
+            continue
+        srcset[name] = {}
+        for image_format in FORMAT_QUALITY:
+            if image_format not in formats:
+                continue
+            urls = []
+            for width, file_name in sorted(formats[image_format].items(), key=lambda item: int(item[0])):
+                url = storage.url(file_name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls.append(f'{url} {width}w')
+            srcset[name][image_format] = ', '.join(urls)
+    return srcset
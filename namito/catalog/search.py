@@ -0,0 +1,101 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast
+from modeltranslation.translator import translator
+
+# Словари PostgreSQL для языков сайта
+SEARCH_CONFIGS = {
+    'ru': 'russian',
+    'en': 'english',
+}
+# ts_rank хранится целым числом миллионных долей (точность float4 - 6-7 знаков)
+SEARCH_RANK_SCALE = 1000000
+
+
+def search_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def get_search_config(language_code):
+    return SEARCH_CONFIGS.get(language_code, SEARCH_CONFIGS[settings.LANGUAGE_CODE])
+
+
+def get_search_vector_field(language_code):
+    if language_code not in SEARCH_CONFIGS:
+        language_code = settings.LANGUAGE_CODE
+    return f'search_vector_{language_code}'
+
+
+def build_search_vectors(brand_model, category_model):
+    """
+    Выражения для search_vector_<язык>: название (A), бренд и категория (B),
+    ключевые слова (C), описание (D). Бренд и категория берутся подзапросами,
+    чтобы выражение можно было использовать в queryset.update().
+    """
+    brand_name = Subquery(brand_model.objects.filter(pk=OuterRef('brand_id')).values('name')[:1])
+    vectors = {}
+    for language_code, config in SEARCH_CONFIGS.items():
+        category_name = Subquery(
+            category_model.objects.filter(pk=OuterRef('category_id')).values(f'name_{language_code}')[:1]
+        )
+        vectors[get_search_vector_field(language_code)] = (
+            SearchVector(f'name_{language_code}', weight='A', config=config)
+            + SearchVector(brand_name, category_name, weight='B', config=config)
+            + SearchVector('keywords', weight='C', config=config)
+            + SearchVector(f'description_{language_code}', weight='D', config=config)
+        )
+    return vectors
+
+
+def update_search_vectors(queryset):
+    if not search_enabled():
+        return 0
+    from namito.catalog.models import Brand, Category
+    return queryset.update(**build_search_vectors(Brand, Category))
+
+
+def build_search_query(text, language_code):
+    # Префиксный поиск по каждому слову: "крос бел" -> 'крос':* & 'бел':*
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    raw = ' & '.join(f"'{word}':*" for word in words)
+    return SearchQuery(raw, config=get_search_config(language_code), search_type='raw')
+
+
+def search_products(queryset, language_code, *texts):
+    """
+    Полнотекстовый поиск с сортировкой по ts_rank. Без PostgreSQL используется
+    icontains по переводимым полям и названию бренда.
+    """
+    texts = [text for text in texts if text]
+    if not texts:
+        return queryset.none()
+
+    if not search_enabled():
+        filters = Q()
+        for text in texts:
+            for field in translator.get_options_for_model(queryset.model).fields:
+                filters |= Q(**{f'{field}_{language_code}__icontains': text})
+            filters |= Q(brand__name__icontains=text)
+        return queryset.filter(filters).order_by('name', 'id')
+
+    query = None
+    for text in texts:
+        search_query = build_search_query(text, language_code)
+        if search_query is not None:
+            query = search_query if query is None else query | search_query
+    if query is None:
+        return queryset.none()
+
+    vector = F(get_search_vector_field(language_code))
+    # ts_rank - float4: его значение в курсоре (JSON, float8) не равно значению колонки,
+    # и строки с равным рангом терялись бы между страницами. Целое сравнивается точно.
+    rank = Cast(SearchRank(vector, query) * Value(SEARCH_RANK_SCALE, output_field=FloatField()), IntegerField())
+    return queryset.filter(**{get_search_vector_field(language_code): query}).annotate(
+        rank=rank
+    ).order_by('-rank', 'id')
@@ -1,7 +1,23 @@
-from django.db.models.signals import m2m_changed
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from mptt.signals import node_moved
 
-from namito.catalog.models import Brand, Size
+from namito.catalog.bitmap import schedule_index_change
+from namito.catalog.campaigns import withdraw_variants
+from namito.catalog.cache import bump_catalog_version, bump_model_version, track_model_versions
+from namito.catalog.fuzzy import fuzzy_index
+from namito.catalog.search import update_search_vectors
+from namito.catalog.similarity import schedule_similar_products_update
+from namito.catalog.together import CANCELLED_STATUS, schedule_bought_together_update
+from namito.catalog.models import (
+    Brand, Size, Product, ProductStats, Review, Image, Variant, Category, Color, Tag, Characteristic,
+    DiscountCampaign
+)
+from namito.orders.models import Order, OrderedItem
+
+# Модели, изменение которых влияет на выборки каталога (кэшированные count и т.п.)
+CATALOG_MODELS = (Product, Variant, Image, Review, Category, Brand, Color, Size, Tag)
 
 
 @receiver(m2m_changed, sender=Brand.categories.through)
@@ -20,3 +36,166 @@ def update_size_child_categories(sender, instance, action, **kwargs):
         for category in instance.categories.all():
             categories_to_update.update(category.get_descendants(include_self=True))
         instance.categories.set(categories_to_update)
+
+
+@receiver(post_save, sender=Product)
+def create_product_stats(sender, instance, created, **kwargs):
+    if created:
+        ProductStats.objects.get_or_create(product=instance)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def update_product_rating_stats(sender, instance, **kwargs):
+    ProductStats.objects.filter(product_id=instance.product_id).refresh_ratings()
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def update_product_image_stats(sender, instance, **kwargs):
+    if instance.product_id:
+        ProductStats.objects.filter(product_id=instance.product_id).refresh_images()
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_catalog_cache(sender, **kwargs):
+    if sender in CATALOG_MODELS:
+        bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(m2m_changed, sender=Brand.categories.through)
+@receiver(m2m_changed, sender=Size.categories.through)
+def invalidate_catalog_cache_m2m(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, **kwargs):
+    update_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Brand)
+def update_brand_products_search_vector(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Product.objects.filter(brand=instance))
+
+
+@receiver(post_save, sender=Category)
+def update_category_products_search_vector(sender, instance, created, **kwargs):
+    if not created:
+        update_search_vectors(Product.objects.filter(category=instance))
+
+
+@receiver(post_save, sender=Product)
+def update_product_fuzzy_index(sender, instance, **kwargs):
+    fuzzy_index.update_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_fuzzy_index(sender, instance, **kwargs):
+    fuzzy_index.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def update_related_products_fuzzy_index(sender, instance, created, **kwargs):
+    if not created and fuzzy_index.ready:
+        field = 'brand' if sender is Brand else 'category'
+        fuzzy_index.update_products(list(Product.objects.filter(**{field: instance}).values_list('pk', flat=True)))
+
+
+# Справочники, из которых собираются кэшируемые ответы (namito.catalog.cache.get_cached_response_data)
+track_model_versions(Category, Brand, Color, Size)
+
+
+@receiver(node_moved, sender=Category)
+def invalidate_moved_category(sender, **kwargs):
+    bump_model_version(sender)
+
+
+@receiver(post_save, sender=Product)
+def update_product_similar_products(sender, instance, **kwargs):
+    schedule_similar_products_update(instance.pk)
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Characteristic)
+@receiver(post_delete, sender=Characteristic)
+def update_related_similar_products(sender, instance, **kwargs):
+    if instance.product_id:
+        schedule_similar_products_update(instance.product_id)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_tagged_similar_products(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        for product_id in (pk_set or ()) if reverse else (instance.pk,):
+            schedule_similar_products_update(product_id)
+
+
+@receiver(post_save, sender=OrderedItem)
+@receiver(post_delete, sender=OrderedItem)
+def update_ordered_product_bought_together(sender, instance, **kwargs):
+    schedule_bought_together_update(
+        Variant.objects.filter(pk=instance.product_variant_id).values_list('product_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Order)
+def update_cancelled_order_bought_together(sender, instance, created, **kwargs):
+    if not created and instance.status == CANCELLED_STATUS:
+        schedule_bought_together_update(
+            instance.ordered_items.values_list('product_variant__product_id', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Variant)
+def update_product_price_range(sender, instance, **kwargs):
+    # min_price и max_price используются фильтрами цены (ProductFilter)
+    product = Product.objects.filter(pk=instance.product_id).first()
+    if product:
+        product.update_price_range()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_product_catalog_index(sender, instance, **kwargs):
+    schedule_index_change(instance.pk)
+
+
+@receiver(post_save, sender=Variant)
+@receiver(post_delete, sender=Variant)
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def update_related_catalog_index(sender, instance, **kwargs):
+    if instance.product_id:
+        schedule_index_change(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(node_moved, sender=Category)
+def rebuild_catalog_index(sender, **kwargs):
+    # Границы категорий и названия брендов и размеров меняют много продуктов сразу
+    schedule_index_change()
+
+
+@receiver(pre_delete, sender=DiscountCampaign)
+def withdraw_deleted_campaign(sender, instance, **kwargs):
+    # После удаления акции ее цена осталась бы в discounted_price вариантов. Цены
+    # снимаются после коммита, пачками в своих транзакциях, а не в транзакции удаления
+    variant_ids = list(instance.variants.values_list('pk', flat=True))
+    if variant_ids:
+        transaction.on_commit(lambda: withdraw_variants(variant_ids))
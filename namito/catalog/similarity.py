@@ -0,0 +1,203 @@
+import math
+import os
+from multiprocessing import get_context
+
+import numpy as np
+from django.db import connections, transaction
+from django.db.models import Min
+
+from namito.catalog.pending import PENDING_BATCH_SIZE, enqueue_products, process_pending_products
+
+# Вес каждой группы признаков в итоговом векторе
+FEATURE_WEIGHTS = {
+    'category': 3.0,
+    'brand': 1.5,
+    'tag': 1.0,
+    'characteristic': 1.0,
+    'color': 0.75,
+    'price': 1.5,
+}
+# Соседние ценовые диапазоны отличаются в PRICE_BAND_RATIO раз
+PRICE_BAND_RATIO = 1.35
+SIMILAR_PRODUCTS_COUNT = 12
+# Вид пересчета в очереди PendingProductUpdate
+SIMILAR_PRODUCTS_UPDATE = 'similar_products'
+
+
+class FeatureSpace:
+    """
+    Разреженные векторы признаков продуктов (путь категории, бренд, теги,
+    характеристики, цвета, ценовой диапазон) и обратный индекс по признакам.
+    Сходство - косинусное: скалярное произведение нормированных векторов,
+    считается одним np.bincount по спискам продуктов каждого признака.
+    """
+
+    def __init__(self, products):
+        from namito.catalog.models import Category, Characteristic, Product, Variant
+
+        rows = list(products.annotate(price=Min('variants__price')).values_list(
+            'pk', 'category_id', 'brand_id', 'active', 'stats__image_count', 'price'
+        ).order_by('pk'))
+        self.product_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.positions = {pk: position for position, pk in enumerate(self.product_ids.tolist())}
+        # рекомендуются только продукты, которые можно показать в списке
+        self.candidates = np.array([bool(row[3] and row[4]) for row in rows], dtype=bool)
+
+        parents = dict(Category.objects.values_list('pk', 'parent_id'))
+        features = {pk: {} for pk in self.positions}
+        for pk, category_id, brand_id, _, _, price in rows:
+            path = []
+            while category_id is not None and category_id not in path:
+                path.append(category_id)
+                category_id = parents.get(category_id)
+            # более глубокие уровни пути весят больше
+            self.add(features[pk], 'category', {('c', category): len(path) - depth for depth, category in enumerate(path)})
+            if brand_id:
+                self.add(features[pk], 'brand', {('b', brand_id): 1})
+            if price:
+                band = int(math.log(price) / math.log(PRICE_BAND_RATIO))
+                self.add(features[pk], 'price', {('p', band): 1, ('p', band - 1): 0.5, ('p', band + 1): 0.5})
+
+        ids = list(self.positions)
+        groups = {'tag': {}, 'characteristic': {}, 'color': {}}
+        for pk, tag_id in Product.tags.through.objects.filter(product_id__in=ids).values_list('product_id', 'tag_id'):
+            groups['tag'].setdefault(pk, {})[('t', tag_id)] = 1
+        characteristics = Characteristic.objects.filter(product_id__in=ids).values_list('product_id', 'key_ru', 'value_ru')
+        for pk, key, value in characteristics:
+            if key and value:
+                groups['characteristic'].setdefault(pk, {})[('ch', key.strip().lower(), value.strip().lower())] = 1
+        for pk, color_id in Variant.objects.filter(product_id__in=ids).values_list('product_id', 'color_id').distinct():
+            groups['color'].setdefault(pk, {})[('col', color_id)] = 1
+        for group, values in groups.items():
+            for pk, group_features in values.items():
+                self.add(features[pk], group, group_features)
+
+        columns, postings = {}, {}
+        self.vectors = []
+        for position, pk in enumerate(self.product_ids.tolist()):
+            vector = features[pk]
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1
+            encoded = []
+            for feature, weight in vector.items():
+                column = columns.setdefault(feature, len(columns))
+                postings.setdefault(column, ([], []))
+                postings[column][0].append(position)
+                postings[column][1].append(weight / norm)
+                encoded.append((column, weight / norm))
+            self.vectors.append(encoded)
+        self.postings = {
+            column: (np.array(positions, dtype=np.int32), np.array(weights, dtype=np.float32))
+            for column, (positions, weights) in postings.items()
+        }
+
+    @staticmethod
+    def add(vector, group, group_features):
+        norm = math.sqrt(sum(weight * weight for weight in group_features.values())) or 1
+        for feature, weight in group_features.items():
+            vector[feature] = FEATURE_WEIGHTS[group] * weight / norm
+
+    def neighbours(self, position, count=SIMILAR_PRODUCTS_COUNT):
+        """[(id продукта, сходство)] по убыванию сходства."""
+        vector = self.vectors[position]
+        if not vector:
+            return []
+        indexes = np.concatenate([self.postings[column][0] for column, weight in vector])
+        weights = np.concatenate([self.postings[column][1] * weight for column, weight in vector])
+        scores = np.bincount(indexes, weights=weights, minlength=len(self.product_ids))
+        scores[position] = 0
+        scores[~self.candidates] = 0
+        if len(scores) > count:
+            top = np.argpartition(-scores, count)[:count]
+        else:
+            top = np.arange(len(scores))
+        top = top[scores[top] > 0]
+        top = top[np.lexsort((self.product_ids[top], -scores[top]))]
+        return [(int(self.product_ids[index]), float(scores[index])) for index in top]
+
+
+# FeatureSpace для дочерних процессов: передается через fork, а не сериализацией
+_space = None
+
+
+def _neighbours_chunk(positions):
+    return [(int(_space.product_ids[position]), _space.neighbours(position)) for position in positions]
+
+
+def save_similar_products(results):
+    from namito.catalog.models import SimilarProduct
+
+    with transaction.atomic():
+        SimilarProduct.objects.filter(product_id__in=[product_id for product_id, similar in results]).delete()
+        SimilarProduct.objects.bulk_create([
+            SimilarProduct(product_id=product_id, similar_id=similar_id, score=score, rank=rank)
+            for product_id, similar in results
+            for rank, (similar_id, score) in enumerate(similar)
+        ], batch_size=5000)
+
+
+def rebuild_similar_products(processes=None, chunk_size=500, stdout=None):
+    """Полный пересчет таблицы соседей; части продуктов считаются в отдельных процессах."""
+    global _space
+    from namito.catalog.models import Product
+
+    _space = FeatureSpace(Product.objects.all())
+    chunks = [range(start, min(start + chunk_size, len(_space.product_ids)))
+              for start in range(0, len(_space.product_ids), chunk_size)]
+    processes = processes or os.cpu_count() or 1
+
+    if processes > 1 and len(chunks) > 1:
+        # Соединения с БД не должны наследоваться дочерними процессами
+        connections.close_all()
+        with get_context('fork').Pool(processes) as pool:
+            for done, results in enumerate(pool.imap_unordered(_neighbours_chunk, chunks), 1):
+                save_similar_products(results)
+                if stdout:
+                    stdout.write(f'{done}/{len(chunks)} chunks')
+    else:
+        for done, chunk in enumerate(chunks, 1):
+            save_similar_products(_neighbours_chunk(chunk))
+            if stdout:
+                stdout.write(f'{done}/{len(chunks)} chunks')
+
+    count = len(_space.product_ids)
+    _space = None
+    return count
+
+
+def update_similar_products(product_ids):
+    """
+    Пересчет соседей для отдельных продуктов и для продуктов, в чьих списках они
+    уже есть. Кандидаты берутся из тех же деревьев категорий, поэтому загружается
+    только часть каталога. Продукты, в списки которых измененный продукт должен
+    попасть впервые, получат его при следующем полном пересчете (rebuild_similar_products).
+    """
+    from namito.catalog.models import Product, SimilarProduct
+
+    product_ids = set(product_ids) | set(
+        SimilarProduct.objects.filter(similar_id__in=product_ids).values_list('product_id', flat=True)
+    )
+    tree_ids = set(Product.objects.filter(pk__in=product_ids).values_list('category__tree_id', flat=True))
+    space = FeatureSpace(Product.objects.filter(category__tree_id__in=tree_ids))
+    results = [
+        (product_id, space.neighbours(space.positions[product_id]))
+        for product_id in sorted(product_ids) if product_id in space.positions
+    ]
+    save_similar_products(results)
+    # продукт, который больше нельзя показывать, убирается из чужих списков
+    hidden = [product_id for product_id in product_ids
+              if product_id in space.positions and not space.candidates[space.positions[product_id]]]
+    SimilarProduct.objects.filter(similar_id__in=hidden).delete()
+
+
+def schedule_similar_products_update(product_id):
+    """
+    Ставит продукт в очередь пересчета. Сохранение в админке только добавляет
+    строку в очередь, пересчет делает update_pending_similar_products
+    (rebuild_similar_products --pending) вне запроса.
+    """
+    enqueue_products(SIMILAR_PRODUCTS_UPDATE, [product_id])
+
+
+def update_pending_similar_products(batch_size=PENDING_BATCH_SIZE):
+    """Пересчитывает продукты из очереди. Возвращает их число."""
+    return process_pending_products(SIMILAR_PRODUCTS_UPDATE, update_similar_products, batch_size)
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+# Файл с таким именем никогда не меняется: новое содержимое - новое имя
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CONTENT_DIRECTORY = 'files'
+CONTENT_NAME_RE = re.compile(rf'^{CONTENT_DIRECTORY}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}(\.[0-9a-z]+)?$')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит файлы по хэшу SHA-256 содержимого: files/ab/cd/abcd....webp. Каталог
+    upload_to и имя загруженного файла не используются, кроме расширения.
+    Одинаковые файлы записываются один раз, число ссылок ведет StoredFile, и
+    delete удаляет файл только вместе с последней ссылкой. Файлы, сохраненные
+    до перехода на это хранилище, читаются и удаляются как раньше.
+    """
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()[:10]
+        return f'{CONTENT_DIRECTORY}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def is_content_addressed(self, name):
+        return bool(CONTENT_NAME_RE.match(name))
+
+    def get_available_name(self, name, max_length=None):
+        # Имя определяется содержимым в _save, совпадение с существующим файлом - не конфликт
+        return name
+
+    def _save(self, name, content):
+        from namito.catalog.models import StoredFile
+
+        name = self.get_content_name(name, content)
+        with transaction.atomic():
+            # UPDATE ждет блокировку строки, которую держит delete последней ссылки
+            if not StoredFile.objects.filter(name=name).update(references=F('references') + 1):
+                try:
+                    with transaction.atomic():
+                        StoredFile.objects.create(name=name, size=content.size)
+                except IntegrityError:
+                    # Тот же файл одновременно сохраняет другой процесс
+                    StoredFile.objects.filter(name=name).update(references=F('references') + 1)
+            if not self.exists(name):
+                # Запись во временный файл и переименование: читатели не видят недописанный файл
+                temporary_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+                os.replace(self.path(temporary_name), self.path(name))
+        return name
+
+    def delete(self, name):
+        from namito.catalog.models import StoredFile
+
+        if not name or not self.is_content_addressed(name):
+            return super().delete(name)
+        with transaction.atomic():
+            stored_file = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored_file is not None and stored_file.references > 1:
+                stored_file.references = F('references') - 1
+                stored_file.save(update_fields=['references'])
+                return
+            if stored_file is not None:
+                stored_file.delete()
+            super().delete(name)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    django.views.static.serve с кэшированием на год для файлов ContentAddressedStorage.
+    Подключается только при DEBUG, в production тот же заголовок ставит nginx.
+    """
+    response = serve(request, path, document_root, show_indexes)
+    if CONTENT_NAME_RE.match(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
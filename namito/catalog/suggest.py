@@ -0,0 +1,206 @@
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_left
+
+from django.db.models import Count
+
+from namito.catalog.cache import get_catalog_version
+
+# Поднимает категории и бренды над отдельными товарами при сопоставимой популярности
+TYPE_BOOST = {
+    'category': 3,
+    'brand': 3,
+    'query': 2,
+    'product': 0,
+}
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+class _Snapshot:
+    """
+    Отсортированный массив ключей (название и каждый его суффикс с начала слова)
+    и параллельный массив ссылок на записи. Для префиксов длиной до
+    short_prefix_length и для более длинных префиксов, под которые попадает
+    больше max_scan ключей, лучшие записи посчитаны заранее.
+    """
+
+    def __init__(self, entries, short_prefix_length, short_prefix_size, max_scan):
+        self.entries = entries
+        pairs = set()
+        for index, entry in enumerate(entries):
+            for name in entry['names'].values():
+                words = normalize(name).split(' ')
+                for position in range(len(words)):
+                    key = ' '.join(words[position:])
+                    if key:
+                        pairs.add((key, index))
+        pairs = sorted(pairs)
+        self.keys = [key for key, index in pairs]
+        self.refs = [index for key, index in pairs]
+        self.scores = [entry['score'] for entry in entries]
+
+        short = {}
+        for key, index in pairs:
+            for length in range(1, min(short_prefix_length, len(key)) + 1):
+                short.setdefault(key[:length], set()).add(index)
+        self.short = {
+            prefix: self.top(indexes, short_prefix_size) for prefix, indexes in short.items()
+        }
+        self.long = self.get_long_prefixes(short_prefix_length, short_prefix_size, max_scan)
+
+    def get_long_prefixes(self, short_prefix_length, size, max_scan):
+        """
+        Лучшие записи для префиксов длиннее short_prefix_length с диапазоном больше
+        max_scan ключей. Такие диапазоны не пересекаются на каждой длине, поэтому
+        их немного, а остальные префиксы просматриваются целиком.
+        """
+        result = {}
+        ranges = [(0, len(self.keys))]
+        length = short_prefix_length
+        while ranges:
+            length += 1
+            next_ranges = []
+            for start, end in ranges:
+                position = start
+                while position < end:
+                    if len(self.keys[position]) < length:
+                        position += 1
+                        continue
+                    prefix = self.keys[position][:length]
+                    prefix_end = bisect_left(self.keys, prefix + '\uffff', position, end)
+                    if prefix_end - position > max_scan:
+                        result[prefix] = self.top(set(self.refs[position:prefix_end]), size)
+                        next_ranges.append((position, prefix_end))
+                    position = prefix_end
+            ranges = next_ranges
+        return result
+
+    def top(self, indexes, limit):
+        return heapq.nsmallest(limit, indexes, key=lambda index: (-self.scores[index], index))
+
+
+class SuggestIndex:
+    """
+    Префиксный индекс для подсказок поиска: категории, бренды, товары и
+    популярные запросы на обоих языках. Строится в фоне, до этого подсказок нет.
+    Перестраивается, когда меняется версия каталога (namito.catalog.cache), но
+    не чаще check_interval.
+    """
+    check_interval = 60
+    max_age = 60 * 30
+    short_prefix_length = 3
+    short_prefix_size = 20
+    max_scan = 5000
+    max_queries = 5000
+    min_query_count = 3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._built_at = 0
+        self._checked_at = 0
+
+    def get_entries(self):
+        from namito.catalog.models import Brand, Category, Product, SearchQueryStat
+
+        entries = []
+
+        def add(entry_type, pk, names, weight, slug=None):
+            names = {language: name for language, name in names.items() if name}
+            if names:
+                entries.append({
+                    'type': entry_type,
+                    'id': pk,
+                    'slug': slug,
+                    'names': names,
+                    'score': TYPE_BOOST[entry_type] + math.log1p(weight or 0),
+                })
+
+        categories = Category.objects.annotate(weight=Count('products')).values_list(
+            'pk', 'name_ru', 'name_en', 'slug', 'weight'
+        )
+        for pk, name_ru, name_en, slug, weight in categories:
+            add('category', pk, {'ru': name_ru, 'en': name_en}, weight, slug)
+
+        for pk, name, weight in Brand.objects.annotate(weight=Count('products')).values_list('pk', 'name', 'weight'):
+            add('brand', pk, {'ru': name, 'en': name}, weight)
+
+        products = Product.objects.filter(active=True, stats__image_count__gt=0).values_list(
+            'pk', 'name_ru', 'name_en', 'stats__view_count'
+        )
+        for pk, name_ru, name_en, weight in products.iterator(chunk_size=5000):
+            add('product', pk, {'ru': name_ru, 'en': name_en}, weight)
+
+        queries = SearchQueryStat.objects.filter(count__gte=self.min_query_count).order_by('-count')
+        for query, weight in queries.values_list('query', 'count')[:self.max_queries]:
+            add('query', None, {'ru': query, 'en': query}, weight)
+
+        return entries
+
+    def build(self):
+        with self._build_lock:
+            started, version = time.time(), get_catalog_version()
+            snapshot = _Snapshot(self.get_entries(), self.short_prefix_length, self.short_prefix_size,
+                                 self.max_scan)
+            with self._lock:
+                self._snapshot = snapshot
+                self._version = version
+                self._built_at = started
+
+    def warm_up(self):
+        if not self._build_lock.locked():
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def refresh(self):
+        if self._snapshot is None:
+            # Полное построение занимает секунды: запрос его не ждет
+            self.warm_up()
+            return
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        # популярные запросы не меняют версию каталога, поэтому есть и max_age
+        if get_catalog_version() != self._version or now - self._built_at > self.max_age:
+            self.warm_up()
+
+    def suggest(self, text, language_code, limit=10):
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        self.refresh()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+
+        if len(prefix) <= self.short_prefix_length:
+            indexes = snapshot.short.get(prefix, [])
+        elif prefix in snapshot.long:
+            indexes = snapshot.long[prefix]
+        else:
+            # диапазоны больше max_scan посчитаны в snapshot.long
+            start = bisect_left(snapshot.keys, prefix)
+            end = bisect_left(snapshot.keys, prefix + '\uffff', start)
+            indexes = snapshot.top(set(snapshot.refs[start:end]), limit)
+
+        results = []
+        for index in indexes[:limit]:
+            entry = snapshot.entries[index]
+            names = entry['names']
+            results.append({
+                'type': entry['type'],
+                'id': entry['id'],
+                'slug': entry['slug'],
+                'name': names.get(language_code) or next(iter(names.values())),
+            })
+        return results
+
+
+suggest_index = SuggestIndex()
@@ -1,3 +1,584 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import threading
+import time
+from datetime import timedelta
 
-# Create your tests here.
+import pytest
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F, IntegerField, QuerySet, Value
+from django.db.models.functions import Lower
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from namito.catalog import search
+from namito.catalog.api.pagination import ProductKeysetPagination, ProductSearchKeysetPagination
+from namito.catalog.api.serializers import ProductListSerializer
+from namito.catalog.bitmap import CatalogIndex, schedule_index_change
+from namito.catalog.campaigns import run_discount_campaigns
+from namito.catalog.featured import MAIN_PAGE_POOL, TOP_PRODUCTS_POOL, get_featured_pool
+from namito.catalog.fuzzy import FuzzyProductIndex
+from namito.catalog.images import get_file_names, get_jobs, process_file, swap_files
+from namito.catalog.models import (
+    BoughtTogether, Brand, Category, Color, DiscountCampaign, Favorite, Image, PendingProductUpdate, Product,
+    ProductStats, ProductViewDaily, SearchQueryStat, SimilarProduct, Size, StoredFile, Variant
+)
+from namito.catalog.similarity import (
+    SIMILAR_PRODUCTS_UPDATE, rebuild_similar_products, update_pending_similar_products
+)
+from namito.catalog.storage import ContentAddressedStorage
+from namito.catalog.suggest import SuggestIndex
+from namito.catalog.together import BOUGHT_TOGETHER_UPDATE, update_pending_bought_together
+from namito.catalog.tracking import ProductViewBuffer, SearchQueryBuffer
+from namito.orders.models import Cart, CartItem, Order, OrderedItem
+from namito.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def api_client():
+    return APIClient()
+
+
+@pytest.fixture
+def buyer():
+    return User.objects.create(username='buyer', email='buyer@example.com', phone_number='+996555000001')
+
+
+def png_file(color=(200, 30, 30)):
+    output = io.BytesIO()
+    PILImage.new('RGB', (20, 20), color).save(output, format='PNG')
+    return ContentFile(output.getvalue(), name='image.png')
+
+
+@pytest.fixture
+def catalog():
+    root = Category(name='Root')
+    root.save()
+    child = Category(name='Child', parent=root)
+    child.save()
+    brand = Brand.objects.create(name='Brand')
+    colors = [Color.objects.create(name=f'Color {index}', color=f'#00000{index}') for index in range(2)]
+    sizes = [Size.objects.create(name=f'S{index}') for index in range(2)]
+    catalog = {'root': root, 'child': child, 'brand': brand, 'colors': colors, 'sizes': sizes, 'products': []}
+    add_products(catalog, 6)
+    return catalog
+
+
+def add_products(catalog, count, **kwargs):
+    """Добавляет count активных продуктов с одним вариантом и изображением."""
+    colors, sizes = catalog['colors'], catalog['sizes']
+    start = len(catalog['products'])
+    for index in range(start, start + count):
+        product = Product(name=f'Product {index}', description='', category=catalog['child'] if index % 2 else
+                          catalog['root'], brand=catalog['brand'] if index % 3 else None, active=True, **kwargs)
+        product.save()
+        Variant(product=product, color=colors[index % 2], size=sizes[index % 2], price=100 + index * 10,
+                stock=index).save()
+        Image(product=product, color=colors[index % 2], image=png_file(), main_image=True).save()
+        catalog['products'].append(product)
+    return catalog['products'][start:]
+
+
+def get_names(tree):
+    return [(category['name'], get_names(category['children'])) for category in tree]
+
+
+def test_category_tree_follows_category_changes(api_client, catalog):
+    assert get_names(api_client.get('/api/categories/').data) == [('Root', [('Child', [])])]
+
+    catalog['child'].name = 'Renamed'
+    catalog['child'].save()
+    assert get_names(api_client.get('/api/categories/').data) == [('Root', [('Renamed', [])])]
+
+    catalog['child'].move_to(None)
+    assert sorted(get_names(api_client.get('/api/categories/').data)) == [('Renamed', []), ('Root', [])]
+
+
+def test_product_count_cache_follows_writes(api_client, catalog):
+    response = api_client.get('/api/products/', {'page': 1})
+    assert response.data['count'] == 6 and response.data['count_exact']
+
+    product = catalog['products'][0]
+    product.active = False
+    product.save()
+    response = api_client.get('/api/products/', {'page': 1})
+    assert response.data['count'] == 5 and response.data['count_exact']
+
+
+def test_index_applies_changes_to_a_copy(catalog, django_capture_on_commit_callbacks):
+    index = CatalogIndex()
+    index.build()
+    product = catalog['products'][5]
+    snapshot = index._snapshot
+    in_stock = snapshot.in_stock.copy()
+    assert product.pk in index.resolve({'in_stock': True})
+
+    with django_capture_on_commit_callbacks(execute=True):
+        Variant.objects.filter(product=product).update(stock=0)
+        schedule_index_change(product.pk)
+    index._checked_at = 0
+    assert product.pk not in index.resolve({'in_stock': True})
+    # запросы, которые еще читают старый снимок, не видят частично измененных строк
+    assert index._snapshot is not snapshot
+    assert (snapshot.in_stock == in_stock).all()
+
+
+def test_index_is_rebuilt_periodically(catalog, monkeypatch):
+    index = CatalogIndex()
+    index.build()
+    rebuilds = []
+    monkeypatch.setattr(index, 'warm_up', lambda: rebuilds.append(True))
+    index._checked_at = 0
+    index.refresh()
+    assert not rebuilds
+    index._checked_at = index._built_at = 0
+    index.refresh()
+    assert rebuilds
+
+
+def test_orders_queue_bought_together_updates(catalog, buyer, django_capture_on_commit_callbacks):
+    variants = [product.variants.get() for product in catalog['products'][:3]]
+    with django_capture_on_commit_callbacks(execute=True):
+        order = Order.objects.create(user=buyer, total_amount=0, delivery_method='самовывоз')
+        for variant in variants:
+            OrderedItem.objects.create(order=order, product_variant=variant)
+    # оформление заказа только ставит продукты в очередь
+    assert not BoughtTogether.objects.exists()
+    assert set(PendingProductUpdate.objects.filter(kind=BOUGHT_TOGETHER_UPDATE).values_list('product_id', flat=True)) == {
+        variant.product_id for variant in variants
+    }
+
+    assert update_pending_bought_together() == 3
+    assert not PendingProductUpdate.objects.filter(kind=BOUGHT_TOGETHER_UPDATE).exists()
+    assert set(BoughtTogether.objects.filter(product=variants[0].product_id).values_list('other_id', flat=True)) == {
+        variants[1].product_id, variants[2].product_id
+    }
+
+
+def test_product_edits_queue_similar_products_updates(catalog):
+    PendingProductUpdate.objects.all().delete()
+    rebuild_similar_products(processes=1)
+    product = catalog['products'][0]
+    neighbour = SimilarProduct.objects.filter(similar=product).values_list('product_id', flat=True).first()
+    assert neighbour is not None
+    neighbours = set(SimilarProduct.objects.filter(product_id=neighbour).values_list('similar_id', flat=True))
+    assert len(neighbours) > 1
+    SimilarProduct.objects.filter(product_id=neighbour).exclude(similar=product).delete()
+
+    product.description = 'Updated'
+    product.save()
+    # сохранение только ставит продукт в очередь
+    assert list(PendingProductUpdate.objects.filter(kind=SIMILAR_PRODUCTS_UPDATE).values_list(
+        'product_id', flat=True
+    )) == [product.pk]
+    assert SimilarProduct.objects.filter(product_id=neighbour).count() == 1
+
+    assert update_pending_similar_products() == 1
+    assert not PendingProductUpdate.objects.filter(kind=SIMILAR_PRODUCTS_UPDATE).exists()
+    # списки, в которых продукт уже был, пересчитываются вместе с ним
+    assert set(SimilarProduct.objects.filter(product_id=neighbour).values_list('similar_id', flat=True)) == neighbours
+
+
+def walk_cursor(api_client, params):
+    """id продуктов по ссылкам next, затем обратно по ссылкам previous."""
+    response = api_client.get('/api/products/', {**params, 'cursor': '', 'page_size': 2})
+    pages = [[product['id'] for product in response.data['products']]]
+    while response.data['next']:
+        response = api_client.get(response.data['next'])
+        pages.append([product['id'] for product in response.data['products']])
+    backward = [pages[-1]]
+    while response.data['previous']:
+        response = api_client.get(response.data['previous'])
+        backward.append([product['id'] for product in response.data['products']])
+    return pages, backward[::-1]
+
+
+@pytest.mark.parametrize('ordering', [
+    None, 'name', 'price', '-price', 'created_at', 'max_discount', 'popularity', 'trending'
+])
+def test_keyset_pages_match_full_list(api_client, catalog, ordering):
+    products = catalog['products']
+    # равные значения ключа сортировки: порядок решает id
+    Variant.objects.filter(product__in=products[:4]).update(price=100, discount_value=5)
+    Product.objects.filter(pk__in=[product.pk for product in products[:3]]).update(name='Same')
+    # у части продуктов нет ProductStats: popularity и trending равны NULL
+    ProductStats.objects.filter(product__in=products[3:]).delete()
+    ProductStats.objects.filter(product__in=products[:3]).update(popularity=1, trending=2)
+    params = {'ordering': ordering} if ordering else {}
+
+    expected = [product['id'] for product in api_client.get('/api/products/', params).data['products']]
+    assert len(expected) == len(products)
+    pages, backward = walk_cursor(api_client, params)
+    assert [pk for page in pages for pk in page] == expected
+    assert backward == pages
+
+
+def test_keyset_pagination_rejects_invalid_cursor(api_client, catalog):
+    for cursor in ['garbage', base64.urlsafe_b64encode(b'{"p": [1]}').decode()]:
+        assert api_client.get('/api/products/', {'cursor': cursor}).status_code == 404
+
+
+def test_keyset_pagination_rejects_expression_ordering(catalog):
+    pagination = ProductKeysetPagination()
+    assert pagination.get_ordering(Product.objects.order_by(F('name').desc())) == [('name', True), ('pk', True)]
+    with pytest.raises(ImproperlyConfigured):
+        pagination.get_ordering(Product.objects.order_by(Lower('name')))
+
+
+def test_search_rank_cursor_keeps_tied_ranks(catalog, monkeypatch):
+    monkeypatch.setattr(search, 'search_enabled', lambda: True)
+    queryset = search.search_products(Product.objects.all(), 'ru', 'Product')
+    # значение ранга в курсоре должно сравниваться с колонкой точно
+    assert isinstance(queryset.query.annotations['rank'].output_field, IntegerField)
+
+    # на SQLite ts_rank нет: те же равные ранги задаются целой аннотацией
+    products = Product.objects.annotate(rank=Value(123456, output_field=IntegerField())).order_by('-rank', 'id')
+    pagination = ProductSearchKeysetPagination()
+    pagination.fields = pagination.get_ordering(products)
+    position = json.loads(json.dumps(pagination.get_position(products[2])))
+    assert list(products.filter(pagination.get_keyset_filter(position, False))) == list(products[3:])
+
+
+def add_shopping(user, products):
+    """Избранное, корзина и скидки для продуктов: все поля сериализатора заполнены."""
+    cart = Cart.objects.get_or_create(user=user)[0]
+    for product in products:
+        Favorite.objects.create(user=user, product=product)
+        variant = product.variants.get()
+        CartItem.objects.create(cart=cart, product_variant=variant, quantity=2)
+        Variant.objects.filter(pk=variant.pk).update(discount_value=10, discount_type='percent')
+
+
+def test_product_list_serializer_batches_like_single_products(catalog, buyer):
+    add_shopping(buyer, catalog['products'][::2])
+    request = APIRequestFactory().get('/')
+    request.user = buyer
+    context = {'request': request}
+
+    products = Product.objects.order_by('pk')
+    batched = ProductListSerializer(products, many=True, context=context).data
+    single = [ProductListSerializer(product, context=context).data for product in Product.objects.order_by('pk')]
+    assert json.loads(JSONRenderer().render(batched)) == json.loads(JSONRenderer().render(single))
+
+
+@pytest.mark.parametrize('url', [
+    '/api/products/', '/api/favorites/', '/api/discounts/', 'similar', '/api/main-page/'
+])
+def test_product_lists_use_a_fixed_number_of_queries(api_client, catalog, buyer, url, django_assert_num_queries):
+    Product.objects.update(is_top=True)
+    add_shopping(buyer, catalog['products'])
+    api_client.force_authenticate(buyer)
+    if url == 'similar':
+        url = f'/api/products/{catalog["products"][0].pk}/similar/'
+
+    # первый запрос создает главную страницу, второй заполняет кэши каталога
+    assert api_client.get(url).status_code == 200
+    api_client.get(url)
+    with CaptureQueriesContext(connection) as queries:
+        response = api_client.get(url)
+    queries = len(queries)
+
+    add_shopping(buyer, add_products(catalog, 6, is_top=True))
+    cache.clear()
+    api_client.get(url)
+    # в два раза больше продуктов - столько же запросов
+    with django_assert_num_queries(queries):
+        more = api_client.get(url)
+    assert len(JSONRenderer().render(more.data)) > len(JSONRenderer().render(response.data))
+
+
+@pytest.fixture
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def get_references(name):
+    return StoredFile.objects.filter(name=name).values_list('references', flat=True).first()
+
+
+def test_storage_saves_equal_files_once(media_root):
+    storage = ContentAddressedStorage()
+    name = storage.save('products/a.png', png_file())
+    assert storage.save('banners/b.PNG', png_file()) == name
+    assert storage.save('products/a.png', png_file((0, 0, 0))) != name
+    assert get_references(name) == 2
+    assert len(list(media_root.rglob('*.png'))) == 2
+
+
+def test_storage_counts_a_concurrently_created_file(media_root, monkeypatch):
+    storage = ContentAddressedStorage()
+    name = storage.get_content_name('image.png', png_file())
+    update = QuerySet.update
+
+    def racing_update(queryset, **kwargs):
+        # другой процесс создает запись между UPDATE и INSERT
+        monkeypatch.setattr(QuerySet, 'update', update)
+        StoredFile.objects.create(name=name, size=1)
+        return 0
+
+    monkeypatch.setattr(QuerySet, 'update', racing_update)
+    assert storage.save('image.png', png_file()) == name
+    assert get_references(name) == 2
+    assert storage.exists(name)
+
+
+def test_storage_deletes_file_with_last_reference(media_root):
+    storage = ContentAddressedStorage()
+    name = storage.save('image.png', png_file())
+    storage.save('image.png', png_file())
+
+    storage.delete(name)
+    assert get_references(name) == 1 and storage.exists(name)
+    storage.delete(name)
+    assert get_references(name) is None and not storage.exists(name)
+
+
+def test_storage_reads_and_deletes_legacy_files(media_root):
+    name = FileSystemStorage().save('products/legacy.png', png_file())
+    storage = ContentAddressedStorage()
+    assert not storage.is_content_addressed(name)
+    with storage.open(name) as file:
+        assert file.read() == png_file().read()
+    storage.delete(name)
+    assert not storage.exists(name)
+
+
+def test_product_meta_image_stores_file_name(catalog):
+    product = catalog['products'][0]
+    product.save()
+    image = Image.objects.get(product=product)
+    assert product.meta_image.name == image.image.name
+    assert len(product.meta_image.name) <= Product._meta.get_field('meta_image').max_length
+    assert product.meta_image.url == image.image.url
+
+
+def test_swap_files_deletes_every_replaced_file(media_root, catalog):
+    image = Image.objects.filter(product=catalog['products'][0]).get()
+    job, = [job for job in get_jobs(Image) if job['pk'] == image.pk]
+    assert swap_files(*process_file(job))
+
+    # новый исходный файл: обработка заменяет его webp, миниатюру и все размеры
+    storage = ContentAddressedStorage()
+    storage.delete(Image.objects.get(pk=image.pk).image.name)
+    Image.objects.filter(pk=image.pk).update(image=storage.save('image.png', png_file((0, 0, 0))), image_hash='')
+    job, = [job for job in get_jobs(Image) if job['pk'] == image.pk]
+    replaced = get_file_names({**job['thumbnails'], 'image': job['name'], 'renditions': job['renditions']})
+    assert len(replaced) > 2
+    assert swap_files(*process_file(job))
+
+    kept = {name for field_name, name in get_file_names(Image.objects.filter(pk=image.pk).values(
+        'image', 'small_image', 'renditions'
+    ).get())}
+    for _, name in replaced:
+        if name not in kept:
+            assert get_references(name) is None and not storage.exists(name)
+
+
+def get_product_names(response):
+    products = response.data['products'] if isinstance(response.data, dict) else response.data
+    return [product['name'] for product in products]
+
+
+@pytest.mark.parametrize('cursor', [None, ''])
+def test_search_falls_back_to_fuzzy_and_records_found_queries(api_client, catalog, monkeypatch, cursor):
+    fuzzy_texts = []
+
+    def fuzzy_search_products(queryset, *texts):
+        fuzzy_texts.append(texts)
+        return queryset.filter(pk=catalog['products'][0].pk) if texts[0] == 'Prodcut' else queryset.none()
+
+    monkeypatch.setattr('namito.catalog.api.views.fuzzy_search_products', fuzzy_search_products)
+    buffer = SearchQueryBuffer()
+    monkeypatch.setattr('namito.catalog.api.views.search_query_buffer', buffer)
+    params = {} if cursor is None else {'cursor': cursor}
+
+    response = api_client.get('/api/products/search/', {'name': 'Product 2', **params})
+    assert get_product_names(response) == ['Product 2']
+    # полнотекстовый поиск нашел продукты: нечеткий не выполняется
+    assert not fuzzy_texts
+
+    response = api_client.get('/api/products/search/', {'name': 'Prodcut', **params})
+    assert get_product_names(response) == ['Product 0']
+    assert fuzzy_texts == [('Prodcut', None)]
+
+    response = api_client.get('/api/products/search/', {'name': 'Missing', **params})
+    assert get_product_names(response) == []
+    buffer.flush()
+    assert sorted(SearchQueryStat.objects.values_list('query', flat=True)) == ['prodcut', 'product 2']
+
+
+def test_search_query_buffer_skips_short_queries_and_typed_prefixes():
+    buffer = SearchQueryBuffer()
+    for query in ['кр', 'кро', 'Кросс', 'кроссовки']:
+        buffer.record(query, client=1)
+    buffer.record('кроссовки', client=2)
+    buffer.record('Кросс ', client=3)
+    assert not SearchQueryStat.objects.exists()
+
+    buffer.flush()
+    assert dict(SearchQueryStat.objects.values_list('query', 'count')) == {'кроссовки': 2, 'кросс': 1}
+    buffer.record('кроссовки', client=1)
+    buffer.flush()
+    assert SearchQueryStat.objects.get(query='кроссовки').count == 3
+
+
+def test_anonymous_views_are_kept_out_of_view_count(catalog, buyer):
+    product = catalog['products'][0]
+    buffer = ProductViewBuffer()
+    buffer.record(product.pk, buyer.pk)
+    buffer.record(product.pk, buyer.pk)
+    buffer.record(product.pk)
+    buffer.flush()
+
+    daily = ProductViewDaily.objects.get(product=product)
+    assert (daily.views, daily.anonymous_views) == (2, 1)
+    assert ProductStats.objects.get(product=product).view_count == 2
+    ProductStats.objects.filter(product=product).refresh_views()
+    assert ProductStats.objects.get(product=product).view_count == 2
+
+
+def test_fuzzy_search_does_not_wait_for_the_index(monkeypatch):
+    index = FuzzyProductIndex()
+    loaded = threading.Event()
+    rows = [(1, 'Кроссовки беговые', 'Running sneakers', 'Brand', 'Обувь', 'Shoes')]
+
+    def get_rows(product_ids=None):
+        # полная выборка продуктов долгая
+        loaded.wait(5)
+        return iter(rows)
+
+    monkeypatch.setattr(index, 'get_rows', get_rows)
+    started = time.monotonic()
+    assert index.search('krossovki') == []
+    assert index.search('krossovki') == []
+    assert time.monotonic() - started < 1
+    assert not index.ready
+
+    loaded.set()
+    for _ in range(100):
+        if index.ready:
+            break
+        time.sleep(0.01)
+    assert index.search('krossovki') == [1]
+
+
+def test_suggest_ranks_long_prefixes_by_score(monkeypatch):
+    index = SuggestIndex()
+    index.max_scan = 2
+    entries = [
+        {'type': 'product', 'id': pk, 'slug': None, 'names': {'ru': f'Sneakers {name}'}, 'score': score}
+        for pk, name, score in [(1, 'alpha', 1), (2, 'beta', 2), (3, 'gamma', 5), (4, 'delta', 4)]
+    ]
+    monkeypatch.setattr(index, 'get_entries', lambda: entries)
+    monkeypatch.setattr(index, 'warm_up', lambda: None)
+    # до построения индекса подсказок нет, запрос не строит его сам
+    assert index.suggest('sneak', 'ru') == []
+
+    index.build()
+    # диапазон "sneak" больше max_scan: лучшие записи, а не первые по алфавиту
+    assert [item['id'] for item in index.suggest('sneak', 'ru', 3)] == [3, 4, 2]
+    assert [item['id'] for item in index.suggest('sneakers g', 'ru')] == [3]
+
+
+def test_featured_pools_keep_endpoint_filters(api_client, catalog):
+    products = catalog['products']
+    Product.objects.update(is_top=True)
+    Image.objects.filter(product=products[1]).delete()
+    # у products[0] нет товара в наличии, у products[1] - изображений
+    assert set(get_featured_pool(TOP_PRODUCTS_POOL)) == {product.pk for product in products} - {products[1].pk}
+    assert set(get_featured_pool(MAIN_PAGE_POOL)) == {product.pk for product in products} - {products[0].pk}
+
+    response = api_client.get('/api/top-products/')
+    assert products[0].pk in {product['id'] for product in response.data}
+    # главная страница показывает все топ-продукты в наличии, а не 15
+    add_products(catalog, 15, is_top=True)
+    response = api_client.get('/api/main-page/')
+    assert len(response.data['top_products']) == len(catalog['products']) - 2
+
+    # пул строится заново после изменения каталога
+    Variant.objects.filter(product=products[2]).get().delete()
+    assert products[2].pk not in get_featured_pool(MAIN_PAGE_POOL)
+
+
+def test_category_facets_skip_inactive_products(api_client, catalog):
+    root = catalog['root']
+    cheapest = catalog['products'][0]
+    response = api_client.get(f'/api/category/{root.slug}/facets/')
+    assert response.data['min_price'] == 100
+
+    cheapest.active = False
+    cheapest.save()
+    listed = api_client.get(f'/api/category/{root.slug}/products/').data['products']
+    assert cheapest.pk not in {product['id'] for product in listed}
+    response = api_client.get(f'/api/category/{root.slug}/facets/')
+    assert response.data['min_price'] == min(
+        Variant.objects.filter(product_id__in=[product['id'] for product in listed]).values_list('price', flat=True)
+    )
+
+
+def test_explain_product_filters_command(api_client, catalog):
+    output = io.StringIO()
+    call_command('explain_product_filters', params='min_price=100&in_stock=true', runs=1, stdout=output)
+    assert 'Successfully ran 1 times' in output.getvalue() and '5 products' in output.getvalue()
+
+    # неизвестное значение sort_by_discount - ошибка, а не пропущенный параметр
+    with pytest.raises(CommandError):
+        call_command('explain_product_filters', params='sort_by_discount=up', runs=1, stdout=io.StringIO())
+    assert api_client.get('/api/products/', {'sort_by_discount': 'up'}).status_code == 400
+
+
+def test_discount_campaign_must_end_after_it_starts():
+    starts_at = timezone.now()
+    campaign = DiscountCampaign(name='Sale', discount_value=10, starts_at=starts_at, ends_at=starts_at)
+    with pytest.raises(ValidationError) as error:
+        campaign.full_clean()
+    assert 'ends_at' in error.value.message_dict
+
+    campaign.ends_at = starts_at + timedelta(days=1)
+    campaign.full_clean()
+
+
+def get_variant_prices(products):
+    return [Variant.objects.get(product=product).discounted_price for product in products]
+
+
+def test_campaign_edits_and_deletes_apply_outside_the_admin(catalog, django_capture_on_commit_callbacks):
+    products = catalog['products'][:2]
+    prices = [variant.price for variant in Variant.objects.filter(product__in=products).order_by('product')]
+    now = timezone.now()
+    campaign = DiscountCampaign.objects.create(name='Sale', discount_type='unit', discount_value=30,
+                                               starts_at=now - timedelta(hours=1), ends_at=now + timedelta(hours=1))
+    campaign.products.add(*products)
+    run_discount_campaigns()
+    assert get_variant_prices(products) == [price - 30 for price in prices]
+
+    # правка только сохраняется, цены меняет следующий запуск планировщика
+    DiscountCampaign.objects.filter(pk=campaign.pk).update(discount_value=20)
+    campaign.products.remove(products[1])
+    assert get_variant_prices(products) == [price - 30 for price in prices]
+    run_discount_campaigns()
+    assert get_variant_prices(products) == [prices[0] - 20, prices[1]]
+    assert Variant.objects.get(product=products[1]).campaign is None
+
+    with django_capture_on_commit_callbacks(execute=True):
+        campaign.delete()
+    assert get_variant_prices(products) == prices
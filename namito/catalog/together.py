@@ -0,0 +1,138 @@
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+
+from namito.catalog.pending import PENDING_BATCH_SIZE, enqueue_products, process_pending_products
+
+BOUGHT_TOGETHER_COUNT = 20
+# Заказы с большим числом товаров почти ничего не говорят о связи товаров, но дают квадратичное число пар
+MAX_BASKET_SIZE = 50
+CANCELLED_STATUS = 2
+# Вид пересчета в очереди PendingProductUpdate
+BOUGHT_TOGETHER_UPDATE = 'bought_together'
+
+
+def get_order_lines():
+    from namito.orders.models import OrderedItem
+    return OrderedItem.objects.exclude(order__status=CANCELLED_STATUS)
+
+
+def load_baskets(lines):
+    """Массивы (заказ, продукт) без повторов, отсортированные по заказу."""
+    rows = np.fromiter(
+        (value for row in lines.values_list('order_id', 'product_variant__product_id').iterator(chunk_size=10000)
+         for value in row),
+        dtype=np.int64
+    ).reshape(-1, 2)
+    keys = np.unique((rows[:, 0] << 32) | rows[:, 1])
+    return keys >> 32, keys & 0xFFFFFFFF
+
+
+def group_bounds(orders):
+    starts = np.flatnonzero(np.r_[True, orders[1:] != orders[:-1]]) if len(orders) else np.zeros(0, dtype=np.int64)
+    return starts, np.diff(np.r_[starts, len(orders)])
+
+
+def count_pairs(orders, products):
+    """
+    Разреженная матрица совместных покупок: пары (a, b), a != b, и число заказов,
+    где они встретились вместе. Пары строятся векторно внутри каждого заказа,
+    поэтому время зависит от числа строк заказов, а не от размера каталога.
+    """
+    starts, sizes = group_bounds(orders)
+    keep = np.repeat(sizes <= MAX_BASKET_SIZE, sizes)
+    products = products[keep]
+    starts, sizes = group_bounds(orders[keep])
+
+    # каждый продукт заказа повторяется столько раз, сколько продуктов в заказе
+    element_sizes = np.repeat(sizes, sizes)
+    left = np.repeat(products, element_sizes)
+    offsets = np.arange(len(left)) - np.repeat(np.cumsum(element_sizes) - element_sizes, element_sizes)
+    right = products[np.repeat(np.repeat(starts, sizes), element_sizes) + offsets]
+    distinct = left != right
+    # пара кодируется одним int64, так np.unique работает намного быстрее, чем по строкам
+    keys, counts = np.unique((left[distinct] << 32) | right[distinct], return_counts=True)
+    return keys >> 32, keys & 0xFFFFFFFF, counts
+
+
+def top_pairs(left, right, counts, order_counts, min_count=1, limit=BOUGHT_TOGETHER_COUNT):
+    """
+    Лучшие limit пар для каждого продукта. Оценка - косинус: совместные заказы,
+    деленные на корень из произведения заказов каждого продукта, чтобы
+    самые популярные товары не попадали в рекомендации ко всему каталогу.
+    """
+    keep = counts >= min_count
+    left, right, counts = left[keep], right[keep], counts[keep]
+    product_ids, totals = order_counts
+    left_totals = totals[np.searchsorted(product_ids, left)]
+    right_totals = totals[np.searchsorted(product_ids, right)]
+    scores = counts / np.sqrt(left_totals * right_totals)
+
+    order = np.lexsort((right, -counts, -scores, left))
+    left, right, counts, scores = left[order], right[order], counts[order], scores[order]
+    starts, sizes = group_bounds(left)
+    ranks = np.arange(len(left)) - np.repeat(starts, sizes)
+    keep = ranks < limit
+    return zip(left[keep].tolist(), right[keep].tolist(), counts[keep].tolist(),
+               scores[keep].tolist(), ranks[keep].tolist(), strict=True)
+
+
+def save_bought_together(rows, product_ids=None):
+    from namito.catalog.models import BoughtTogether
+
+    with transaction.atomic():
+        queryset = BoughtTogether.objects.all()
+        if product_ids is not None:
+            queryset = queryset.filter(product_id__in=product_ids)
+        queryset.delete()
+        BoughtTogether.objects.bulk_create([
+            BoughtTogether(product_id=product_id, other_id=other_id, count=count, score=score, rank=rank)
+            for product_id, other_id, count, score, rank in rows
+        ], batch_size=5000)
+
+
+def rebuild_bought_together(min_count=1, limit=BOUGHT_TOGETHER_COUNT):
+    """Полный пересчет по всем строкам заказов. Возвращает число сохраненных пар."""
+    orders, products = load_baskets(get_order_lines())
+    left, right, counts = count_pairs(orders, products)
+    order_counts = np.unique(products, return_counts=True)
+    rows = list(top_pairs(left, right, counts, order_counts, min_count, limit))
+    save_bought_together(rows)
+    return len(rows)
+
+
+def update_bought_together(product_ids, min_count=1, limit=BOUGHT_TOGETHER_COUNT):
+    """
+    Пересчет строк отдельных продуктов по заказам, в которых они есть. Оценки
+    остальных продуктов обновятся при следующем полном пересчете.
+    """
+    lines = get_order_lines()
+    orders, products = load_baskets(lines.filter(
+        order__in=lines.filter(product_variant__product_id__in=product_ids).values('order_id')
+    ))
+    left, right, counts = count_pairs(orders, products)
+    selected = np.isin(left, product_ids)
+    left, right, counts = left[selected], right[selected], counts[selected]
+
+    # число заказов каждого продукта - агрегатом в БД, а не загрузкой всех их строк
+    others = np.union1d(left, right)
+    totals = dict(
+        lines.filter(product_variant__product_id__in=others.tolist()).order_by()
+        .values_list('product_variant__product_id').annotate(orders=Count('order_id', distinct=True))
+    )
+    order_counts = (others, np.array([totals.get(product_id, 0) for product_id in others.tolist()], dtype=np.int64))
+    save_bought_together(list(top_pairs(left, right, counts, order_counts, min_count, limit)), product_ids)
+
+
+def schedule_bought_together_update(product_ids):
+    """
+    Ставит продукты в очередь пересчета. Оформление заказа только добавляет
+    строки в очередь, пересчет делает update_pending_bought_together
+    (rebuild_bought_together --pending) вне запроса.
+    """
+    enqueue_products(BOUGHT_TOGETHER_UPDATE, product_ids)
+
+
+def update_pending_bought_together(batch_size=PENDING_BATCH_SIZE):
+    """Пересчитывает продукты из очереди. Возвращает их число."""
+    return process_pending_products(BOUGHT_TOGETHER_UPDATE, update_bought_together, batch_size)
@@ -0,0 +1,187 @@
+import atexit
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+PRODUCT_VIEW_RETENTION_DAYS = 90
+
+
+def bulk_increment(queryset_factory, field, increments, **values):
+    """
+    Прибавляет счетчики одним UPDATE на каждое значение прироста: почти все
+    приросты за несколько секунд - 1, 2 или 3, поэтому запросов мало.
+    values - поля, которые записываются вместе со счетчиком.
+    """
+    groups = {}
+    for key, value in increments.items():
+        groups.setdefault(value, []).append(key)
+    for value, keys in groups.items():
+        queryset_factory(keys).update(**{field: F(field) + value}, **values)
+
+
+class ProductViewBuffer:
+    """
+    Просмотры продуктов копятся в памяти процесса и записываются пачкой раз в
+    flush_interval секунд или после flush_size просмотров. Строки ProductView
+    вставляются с ignore_conflicts, счетчики ProductViewDaily и
+    ProductStats.view_count увеличиваются несколькими UPDATE. Анонимные просмотры
+    считаются отдельно (ProductViewDaily.anonymous_views) и в view_count не входят.
+    """
+    flush_interval = 30
+    flush_size = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = Counter()
+        self._anonymous_views = Counter()
+        self._viewers = set()
+        self._size = 0
+        self._flushed_at = time.time()
+
+    def record(self, product_id, user_id=None):
+        today = timezone.localdate()
+        with self._lock:
+            if user_id:
+                self._views[product_id, today] += 1
+                self._viewers.add((product_id, user_id, today))
+            else:
+                self._anonymous_views[product_id, today] += 1
+            self._size += 1
+            due = self._size >= self.flush_size or time.time() - self._flushed_at > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            views, anonymous_views, viewers = self._views, self._anonymous_views, self._viewers
+            self._views, self._anonymous_views, self._viewers, self._size = Counter(), Counter(), set(), 0
+            self._flushed_at = time.time()
+        if views or anonymous_views:
+            save_product_views(views, anonymous_views, viewers)
+
+
+def save_product_views(views, anonymous_views, viewers):
+    from namito.catalog.models import ProductStats, ProductView, ProductViewDaily
+
+    with transaction.atomic():
+        ProductView.objects.bulk_create([
+            ProductView(product_id=product_id, user_id=user_id, viewed_on=viewed_on)
+            for product_id, user_id, viewed_on in viewers
+        ], ignore_conflicts=True)
+
+        ProductViewDaily.objects.bulk_create([
+            ProductViewDaily(product_id=product_id, date=date) for product_id, date in views.keys() | anonymous_views
+        ], ignore_conflicts=True)
+        for field, counts in (('views', views), ('anonymous_views', anonymous_views)):
+            for date in {date for product_id, date in counts}:
+                bulk_increment(
+                    lambda product_ids, date=date: ProductViewDaily.objects.filter(
+                        date=date, product_id__in=product_ids
+                    ),
+                    field,
+                    {product_id: count for (product_id, day), count in counts.items() if day == date}
+                )
+
+        totals = Counter()
+        for (product_id, _), count in views.items():
+            totals[product_id] += count
+        bulk_increment(lambda product_ids: ProductStats.objects.filter(product_id__in=product_ids), 'view_count', totals)
+
+
+def rollup_product_views(days=2, retention_days=PRODUCT_VIEW_RETENTION_DAYS):
+    """
+    Переносит число уникальных пользователей за последние days дней из
+    ProductView в ProductViewDaily и удаляет строки старше retention_days.
+    """
+    from namito.catalog.models import ProductView, ProductViewDaily
+
+    today = timezone.localdate()
+    rows = ProductView.objects.filter(viewed_on__gt=today - timedelta(days=days)).values(
+        'product_id', 'viewed_on'
+    ).annotate(count=Count('pk')).order_by()
+    updated = 0
+    with transaction.atomic():
+        ProductViewDaily.objects.bulk_create([
+            ProductViewDaily(product_id=row['product_id'], date=row['viewed_on']) for row in rows
+        ], ignore_conflicts=True)
+        by_date = {}
+        for row in rows:
+            by_date.setdefault(row['viewed_on'], {})[row['product_id']] = row['count']
+        for date, counts in by_date.items():
+            groups = {}
+            for product_id, count in counts.items():
+                groups.setdefault(count, []).append(product_id)
+            for count, product_ids in groups.items():
+                updated += ProductViewDaily.objects.filter(date=date, product_id__in=product_ids).update(viewers=count)
+    deleted, _ = ProductView.objects.filter(viewed_on__lt=today - timedelta(days=retention_days)).delete()
+    return updated, deleted
+
+
+def normalize_search_query(query):
+    return ' '.join((query or '').lower().split())[:100]
+
+
+class SearchQueryBuffer:
+    """
+    Успешные поисковые запросы для подсказок (SearchQueryStat) копятся в памяти
+    процесса и записываются пачкой, как просмотры в ProductViewBuffer. Запросы
+    короче min_length не считаются. Из запросов одного клиента за период
+    отбрасываются префиксы его более длинных запросов: это промежуточные
+    состояния строки поиска при наборе.
+    """
+    flush_interval = 30
+    flush_size = 500
+    min_length = 3
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queries = {}
+        self._size = 0
+        self._flushed_at = time.time()
+
+    def record(self, query, client=None):
+        query = normalize_search_query(query)
+        if len(query) < self.min_length:
+            return
+        with self._lock:
+            queries = self._queries.setdefault(client, Counter())
+            queries[query] += 1
+            self._size += 1
+            due = self._size >= self.flush_size or time.time() - self._flushed_at > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            queries, self._queries, self._size = self._queries, {}, 0
+            self._flushed_at = time.time()
+        counts = Counter()
+        for client_queries in queries.values():
+            for query, count in client_queries.items():
+                if not any(other != query and other.startswith(query) for other in client_queries):
+                    counts[query] += count
+        if counts:
+            save_search_queries(counts)
+
+
+def save_search_queries(counts):
+    from namito.catalog.models import SearchQueryStat
+
+    with transaction.atomic():
+        SearchQueryStat.objects.bulk_create(
+            [SearchQueryStat(query=query, count=0) for query in counts], ignore_conflicts=True
+        )
+        bulk_increment(lambda queries: SearchQueryStat.objects.filter(query__in=queries), 'count', counts,
+                       updated_at=timezone.now())
+
+
+product_view_buffer = ProductViewBuffer()
+search_query_buffer = SearchQueryBuffer()
+# Просмотры и запросы, накопленные к остановке воркера, не теряются
+atexit.register(product_view_buffer.flush)
+atexit.register(search_query_buffer.flush)
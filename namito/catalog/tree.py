@@ -0,0 +1,27 @@
+from django.core.cache import cache
+from django.utils.translation import get_language
+from mptt.utils import get_cached_trees
+
+from namito.catalog.cache import get_model_version_name, get_version
+from namito.catalog.models import Category
+
+CATEGORY_TREE_TIMEOUT = 60 * 60 * 24
+
+
+def get_category_tree():
+    """Корневые категории; дети и родители всего дерева загружены одним запросом."""
+    return get_cached_trees(Category.objects.all())
+
+
+def get_serialized_category_tree(name, serialize, request):
+    """
+    Сериализованное дерево из кэша. Ключ - вид представления, версия категорий,
+    язык и адрес сайта (в данных абсолютные ссылки на изображения).
+    """
+    version = get_version(get_model_version_name(Category))
+    key = f'catalog:category-tree:{name}:{version}:{get_language()}:{request.build_absolute_uri("/")}'
+    data = cache.get(key)
+    if data is None:
+        data = serialize(get_category_tree())
+        cache.set(key, data, CATEGORY_TREE_TIMEOUT)
+    return data
@@ -24,11 +24,15 @@ from namito.catalog.api.views import (
     TopProductListView,
     NewProductListView,
     CategoryBySlugAPIView,
+    CategoryProductListView,
+    CategoryFacetsAPIView,
     CategoryByNameStartsWithAPIView,
     ProductSearchByNameAndBrandAPIView,
+    SuggestAPIView,
     ColorSizeBrandAPIView,
     ProductReviewListView,
     SimilarProductsView,
+    BoughtTogetherProductsView,
     DiscountAPIView, ProductSeoAPIView, CategorySeoAPIView
 )
 
@@ -39,6 +43,8 @@ category_patterns = [
     path('brands/', BrandListView.as_view()),
     path('brands/<int:pk>/', BrandDetailView.as_view()),
     path('category/<slug:slug>/', CategoryBySlugAPIView.as_view(), name='category-detail'),
+    path('category/<slug:slug>/products/', CategoryProductListView.as_view(), name='category-products'),
+    path('category/<slug:slug>/facets/', CategoryFacetsAPIView.as_view(), name='category-facets'),
     path('categories/startswith/', CategoryByNameStartsWithAPIView.as_view(), name='category_startswith'),
 ]
 
@@ -49,8 +55,11 @@ product_patterns = [
     path('new-products/', NewProductListView.as_view()),
     path('products/<int:pk>/', ProductDetailView.as_view()),
     path('products/search/', ProductSearchByNameAndBrandAPIView.as_view(), name='product_startswith'),
+    path('suggest/', SuggestAPIView.as_view(), name='suggest'),
     path('products/<int:pk>/reviews/', ProductReviewListView.as_view(), name='product-reviews'),
     path('products/<int:product_id>/similar/', SimilarProductsView.as_view(), name='similar-products'),
+    path('products/<int:product_id>/bought-together/', BoughtTogetherProductsView.as_view(),
+         name='bought-together-products'),
 ]
 
 entity_patterns = [
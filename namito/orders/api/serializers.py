@@ -39,29 +39,29 @@ class CartItemSerializer(serializers.ModelSerializer):
     product_variant = VariantSerializer(required=False)
     product_name = serializers.CharField(source='product_variant.product.name', read_only=True)
     product_image = serializers.SerializerMethodField()  # Добавляем изображение продукта
+    product_image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product_variant', 'quantity', 'to_purchase', 'product_name', 'product_image']
+        fields = ['id', 'product_variant', 'quantity', 'to_purchase', 'product_name', 'product_image',
+                  'product_image_srcset']
 
     def get_product_image(self, obj):
         variant = obj.product_variant
         product = variant.product
 
-        main_image = product.images.filter(main_image=True).first()
-        if main_image:
+        image_url = product.get_stats().main_image_url
+        if image_url:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(main_image.image.url)
-
-        first_image = product.images.first()
-        if first_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(first_image.image.url)
+                return request.build_absolute_uri(image_url)
 
         return None
 
+    def get_product_image_srcset(self, obj):
+        stats = obj.product_variant.product.get_stats()
+        return stats.get_main_image_srcset(['cart_line'], self.context.get('request'))
+
 
 class CartSerializer(ModelSerializer):
     items = CartItemSerializer(many=True)
@@ -99,17 +99,11 @@ class OrderedItemSerializer(ModelSerializer):
         variant = obj.product_variant
         product = variant.product
 
-        main_image = product.images.filter(main_image=True).first()
-        if main_image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(main_image.image.url)
-
-        first_image = product.images.first()
-        if first_image:
+        image_url = product.get_stats().main_image_url
+        if image_url:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(first_image.image.url)
+                return request.build_absolute_uri(image_url)
 
         return None
 
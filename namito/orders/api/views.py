@@ -11,6 +11,7 @@ from namito.orders.api.serializers import (
     OrderListSerializer,
     MultiCartItemAddSerializer
     )
+from namito.catalog.api.pagination import KeysetPagination
 from namito.orders.models import (
     Cart,
     CartItem,
@@ -179,15 +180,17 @@ class OrderDetailAPIView(generics.RetrieveUpdateAPIView):
 class OrderHistoryListAPIView(generics.ListAPIView):
     serializer_class = OrderHistorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
-        return OrderHistory.objects.filter(user=user) or []
+        return OrderHistory.objects.filter(user=user)
 
 
 class UserOrderListAPIView(generics.ListAPIView):
     serializer_class = OrderListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
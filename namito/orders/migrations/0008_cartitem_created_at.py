@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_alter_orderhistory_options'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, null=True, verbose_name='Время добавления'),
+        ),
+    ]
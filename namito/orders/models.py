@@ -31,6 +31,7 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1, verbose_name=_('Количество'))
     to_purchase = models.BooleanField(default=True, verbose_name=_('К покупке'))
     order = models.ForeignKey('Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='items', verbose_name=_('Заказ'))
+    created_at = models.DateTimeField(auto_now_add=True, null=True, verbose_name=_('Время добавления'))
 
     class Meta:
         verbose_name = _("Пердмет в корзине")
@@ -1,8 +1,9 @@
 from rest_framework import serializers
-from django.db.models import OuterRef, Subquery
 
 from namito.catalog.api.serializers import ProductListSerializer
+from namito.catalog.featured import MAIN_PAGE_POOL, get_featured_products
 from namito.catalog.models import Product, Category
+from namito.catalog.tree import get_serialized_category_tree
 from namito.pages.models import (
     MainPageSlider,
     MainPage,
@@ -18,7 +19,7 @@ class MainPageSliderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = MainPageSlider
-        fields = ['image', 'link', 'small_image']
+        fields = ['image', 'link', 'small_image', 'placeholder', 'dominant_color']
 
     def get_image(self, slider):
         if slider.image and slider.image.file:
@@ -59,14 +60,9 @@ class MainPageSerializer(serializers.ModelSerializer):
         return MainPageSliderSerializer(slider_qs, many=True, context=self.context).data
 
     def get_top_products(self, page):
-        # Используем подзапрос для выбора только уникальных продуктов
-        subquery = Product.objects.filter(
-            id=OuterRef('id'),
-            is_top=True,
-            variants__stock__gt=0
-        ).distinct().order_by('?')[:15]
-
-        products = Product.objects.filter(id__in=Subquery(subquery.values('id')))
+        # Все топ-продукты в наличии в случайном порядке (namito.catalog.featured)
+        request = self.context['request']
+        products = get_featured_products(Product.objects.all(), MAIN_PAGE_POOL, seed=request.query_params.get('seed'))
 
         # Сериализуем продукты
         serializer = ProductListSerializer(products, many=True, context={'request': self.context['request']})
@@ -77,6 +73,11 @@ class MainPageSerializer(serializers.ModelSerializer):
         return serialized_data
 
 
+class MainPageContentSerializer(MainPageSerializer):
+    class Meta(MainPageSerializer.Meta):
+        fields = [field for field in MainPageSerializer.Meta.fields if field != 'top_products']
+
+
 class FAQSerializer(serializers.ModelSerializer):
     class Meta:
         model = FAQ
@@ -139,27 +140,19 @@ class ContactsSerializer(serializers.ModelSerializer):
         return data
 
     def get_categories(self, obj):
+        request = self.context.get('request')
 
         def get_nested_categories_data(category):
-            request = self.context.get('request')
-            category_data = {
+            return {
                 'name': category.name,
                 'slug': category.slug,
                 'icon': request.build_absolute_uri(category.icon.url) if category.icon else None,
-                'children': []
+                'children': [get_nested_categories_data(child) for child in category.get_children()]
             }
-            children_categories = category.children.all()
-            for child_category in children_categories:
-                child_data = get_nested_categories_data(child_category)
-                category_data['children'].append(child_data)
-            return category_data
-
-        root_categories = Category.objects.filter(parent__isnull=True)
-        categories_data = []
-        for root_category in root_categories:
-            root_category_data = get_nested_categories_data(root_category)
-            categories_data.append(root_category_data)
-        return categories_data
+
+        return get_serialized_category_tree(
+            'layout', lambda roots: [get_nested_categories_data(root) for root in roots], request
+        )
 
 
 class LayoutSeoSerializer(serializers.ModelSerializer):
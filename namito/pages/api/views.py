@@ -5,8 +5,15 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
 
-from namito.pages.api.serializers import MainPageSerializer, StaticPageSerializer, ContactsSerializer, LayoutSeoSerializer
-from namito.pages.models import MainPage, StaticPage, Contacts, MainPageLayoutMeta
+from namito.advertisement.models import Advertisement
+from namito.catalog.cache import get_cached_response_data
+from namito.catalog.models import Category
+from namito.pages.api.serializers import (
+    MainPageSerializer, MainPageContentSerializer, StaticPageSerializer, ContactsSerializer, LayoutSeoSerializer
+)
+from namito.pages.models import (
+    MainPage, MainPageSlider, StaticPage, FAQ, Contacts, Phone, Email, SocialLink, PaymentMethod, MainPageLayoutMeta
+)
 from namito.pages.api import pages_default_texts
 
 
@@ -51,9 +58,13 @@ class MainPageView(generics.RetrieveAPIView):
         return instance
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        # Топ-продукты зависят от пользователя (избранное, корзина) и не кэшируются
+        data = get_cached_response_data(
+            'main-page', [MainPage, MainPageSlider, Advertisement], request,
+            lambda: MainPageContentSerializer(self.get_object(), context=self.get_serializer_context()).data
+        )
+        top_products = self.get_serializer().get_top_products(None)
+        return Response({**data, 'top_products': top_products})
 
 
 class StaticPageDetailView(generics.RetrieveAPIView):
@@ -94,9 +105,11 @@ class StaticPageDetailView(generics.RetrieveAPIView):
         return instance
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        data = get_cached_response_data(
+            f'static-page:{self.kwargs["slug"]}', [StaticPage, FAQ], request,
+            lambda: self.get_serializer(self.get_object()).data
+        )
+        return Response(data)
 
 
 class LayoutView(generics.RetrieveAPIView):
@@ -113,11 +126,25 @@ class LayoutView(generics.RetrieveAPIView):
         context['request'] = self.request
         return context
 
+    def retrieve(self, request, *args, **kwargs):
+        data = get_cached_response_data(
+            'layout', [Contacts, Phone, Email, SocialLink, PaymentMethod, Category], request,
+            lambda: self.get_serializer(self.get_object()).data
+        )
+        return Response(data)
+
 
 class LayoutSeoAPIView(generics.ListAPIView):
     queryset = MainPageLayoutMeta.objects.all()
     serializer_class = LayoutSeoSerializer
 
+    def list(self, request, *args, **kwargs):
+        data = get_cached_response_data(
+            'layout-seo', [MainPageLayoutMeta], request,
+            lambda: self.get_serializer(self.get_queryset(), many=True).data
+        )
+        return Response(data)
+
 
 def handle_not_found(request, exception):
     return JsonResponse({'error': 'Not found'}, status=404)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'namito.pages'
+
+    def ready(self):
+        import namito.pages.signals  # noqa: F401
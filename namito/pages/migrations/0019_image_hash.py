@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0018_remove_mainpageslider_link_mobile_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staticpage',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
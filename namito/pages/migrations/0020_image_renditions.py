@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0019_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staticpage',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
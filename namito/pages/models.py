@@ -70,12 +70,14 @@ class MainPageLayoutMeta(models.Model):
         verbose_name_plural = _("Мета главная страница")
 
 
-class MainPageSlider(models.Model):
+class MainPageSlider(ProcessedImageModel):
     image = models.ImageField(upload_to='slider/', blank=True, null=True, verbose_name=_("Изображение"))
     link = models.URLField(blank=True, null=True, verbose_name=_("Ссылка"))
     small_image = models.ImageField(upload_to='slider-mobile/', blank=True, null=True,
                                     verbose_name=_("Изображение для телефона"))
     page = models.ForeignKey(MainPage, on_delete=models.PROTECT, blank=True, null=True)
+    # Баннеры загружаются уже подготовленными: считаем только заглушку
+    image_quality = None
 
     class Meta:
         verbose_name = _('Слайдер')
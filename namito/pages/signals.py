@@ -0,0 +1,20 @@
+from namito.advertisement.models import Advertisement
+from namito.catalog.cache import track_model_versions
+from namito.pages.models import (
+    MainPage,
+    MainPageLayoutMeta,
+    MainPageSlider,
+    StaticPage,
+    FAQ,
+    Contacts,
+    Phone,
+    Email,
+    SocialLink,
+    PaymentMethod
+)
+
+# Модели страниц и макета, ответы по которым кэшируются до их изменения
+track_model_versions(
+    MainPage, MainPageLayoutMeta, MainPageSlider, StaticPage, FAQ, Contacts, Phone, Email, SocialLink,
+    PaymentMethod, Advertisement
+)